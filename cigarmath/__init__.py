@@ -11,6 +11,10 @@ from .clipping import declip
 from .clipping import is_hard_clipped
 from .clipping import left_clipping
 from .clipping import softclipify
+from .clipping import declip_batch
+from .clipping import softclipify_batch
+from .clipping import clip_event_table
+from .clipping import cluster_clip_events
 
 
 from .block import reference_offset
@@ -22,25 +26,48 @@ from .block import block_overlap_length
 from .block import reference_offset
 from .block import reference_mapping_blocks
 from .block import reference_deletion_blocks
+from .block import reference_offset_batch
+from .block import reference_block_batch
+from .block import reference_mapping_blocks_batch
+from .block import reference_deletion_blocks_batch
+from .block import count_blocks
+from .block import reference_junction_blocks_batch
+from .block import JunctionCounter
+from .block import library_strand
 
 from .inference import inferred_query_sequence_length
 from .inference import inferred_reference_length
+from .inference import alignment_stats
+from .inference import AlignmentStats
 
 from .defn import cigarstr2tup
 from .defn import cigartup2str
 
 from . import io
 
+from .batch import CigarBatch
+from .index import BlockIndex
+from .index import overlap_join
+from .intervals import IntervalSet
+
+from .memo import CigarCache
+from .cigar import Cigar
+
 from .conversions import segments_to_binary
+from .conversions import segments_to_bitmatrix
+from .conversions import bitmatrix_jaccard
 from .conversions import cigartuples2pairs
 
 from .conversions import msa2cigartuples
 from .conversions import softclipify
 
 from .cigarmath import collapse_adjacent_blocks
+from .cigarmath import collapse_adjacent_blocks_batch
+from .cigarmath import simplify_blocks_batch
 
 from .mapping import reference2query
 from .mapping import query2reference
+from .mapping import reference2query_batch
 
 from .iterators import cigar_iterator
 from .iterators import cigar_iterator_reference_slice
@@ -50,5 +77,17 @@ from .iterators import iterator_attach
 from .combine import combine_multiple_alignments
 from .combine import combine_adjacent_alignments
 from .combine import trim_alignment
+from .combine import trim_alignment_batch
+from .combine import trim_primers_batch
+
+from .pileup import depth
+from .pileup import depth_matrix
+from .consensus import consensus_sequence
+from .consensus import write_fasta
+
+from .reference import FastaReference
 
-from .pileup import depth
\ No newline at end of file
+from .sequence import mismatches
+from .sequence import mismatches_batch
+from .sequence import extend_matches_batch
+from .sequence import site_alleles_batch
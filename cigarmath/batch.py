@@ -0,0 +1,407 @@
+"""Columnar batches of alignments for vectorized operations"""
+
+__copyright__ = """Copyright (C) 2022-present
+    Dampier & DV Klopfenstein, PhD.
+    All rights reserved"""
+__author__ = "Will Dampier, PhD"
+
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
+import numpy as np
+from cigarmath.defn import (
+    CigarTuples,
+    CONSUMES_REFERENCE,
+    CONSUMES_QUERY,
+    CIGAR_HDRS,
+)
+
+if TYPE_CHECKING:
+    try:
+        import pysam
+    except ImportError:
+        pass
+
+# Lookup tables indexed by BAM op code, sized to cover every 4-bit op
+CONSUMES_REFERENCE_LUT = np.array([op in CONSUMES_REFERENCE
+                                   for op in range(16)])
+CONSUMES_QUERY_LUT = np.array([op in CONSUMES_QUERY for op in range(16)])
+
+# Lookup table from cigar letter (as a byte) to BAM op code, -1 for digits
+CIGAR_BYTE_LUT = np.full(256, -1, dtype=np.int16)
+CIGAR_BYTE_LUT[[ord(letter) for letter in CIGAR_HDRS]] = np.arange(
+    len(CIGAR_HDRS)
+)
+
+
+@dataclass
+class CigarBatch:
+    """A columnar batch of alignments.
+
+    The cigars of every read are stored in two flat arrays (ops, lengths);
+    read i owns ops[offsets[i]:offsets[i+1]]. Sequences and qualities are
+    stored the same way using sequence_offsets. Optional columns are None
+    when they were not requested.
+
+    CGT     4M1D3M          2S5M
+    START   10              30
+
+    >>>> batch = CigarBatch.from_alignments([(10, [(0, 4), (2, 1), (0, 3)]),
+    ....                                     (30, [(4, 2), (0, 5)])])
+    >>>> batch.ops, batch.lengths, batch.offsets
+    [0 2 0 4 0] [4 1 3 2 5] [0 3 5]
+    """
+    reference_start: np.ndarray
+    ops: np.ndarray
+    lengths: np.ndarray
+    offsets: np.ndarray
+    reference_id: Optional[np.ndarray] = None
+    flags: Optional[np.ndarray] = None
+    mapq: Optional[np.ndarray] = None
+    query_name: Optional[List[str]] = None
+    sequence: Optional[np.ndarray] = None
+    qualities: Optional[np.ndarray] = None
+    sequence_offsets: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.reference_start)
+
+    def __iter__(self) -> Iterator[Tuple[int, CigarTuples]]:
+        "Yield (reference_start, cigartuples) per read, like as_tuples streams"
+        for index in range(len(self)):
+            yield int(self.reference_start[index]), self.cigartuples(index)
+
+    def __getitem__(self, rows: slice) -> "CigarBatch":
+        "Slice a contiguous run of reads; arrays are views, not copies"
+        start, stop, step = rows.indices(len(self))
+        if step != 1:
+            raise ValueError(
+                'Only contiguous slices are supported, use take()'
+            )
+        stop = max(start, stop)
+
+        op_slice = slice(self.offsets[start], self.offsets[stop])
+        batch = CigarBatch(
+            reference_start=self.reference_start[start:stop],
+            ops=self.ops[op_slice],
+            lengths=self.lengths[op_slice],
+            offsets=self.offsets[start:stop + 1] - self.offsets[start],
+        )
+        for column in ('reference_id', 'flags', 'mapq', 'query_name'):
+            values = getattr(self, column)
+            if values is not None:
+                setattr(batch, column, values[start:stop])
+        if self.sequence is not None:
+            sequence_offsets = self.sequence_offsets[start:stop + 1]
+            sequence_slice = slice(sequence_offsets[0], sequence_offsets[-1])
+            batch.sequence = self.sequence[sequence_slice]
+            batch.qualities = self.qualities[sequence_slice]
+            batch.sequence_offsets = sequence_offsets - sequence_offsets[0]
+        return batch
+
+    def cigartuples(self, index: int) -> CigarTuples:
+        "Return the cigartuples of a single read"
+        slc = slice(self.offsets[index], self.offsets[index + 1])
+        return list(zip(self.ops[slc].tolist(), self.lengths[slc].tolist()))
+
+    def query_sequence(self, index: int) -> Optional[str]:
+        "Return the query sequence of a single read, if sequences were loaded"
+        if self.sequence is None:
+            return None
+        slc = slice(self.sequence_offsets[index],
+                    self.sequence_offsets[index + 1])
+        return self.sequence[slc].tobytes().decode()
+
+    @property
+    def read_index(self) -> np.ndarray:
+        "The read each op belongs to"
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    def take(self, indices: np.ndarray) -> "CigarBatch":
+        "Return a new batch of only the reads at indices (or a boolean mask)"
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+
+        op_index, offsets = ragged_take(self.offsets, indices)
+        batch = CigarBatch(
+            reference_start=self.reference_start[indices],
+            ops=self.ops[op_index],
+            lengths=self.lengths[op_index],
+            offsets=offsets,
+        )
+        for column in ('reference_id', 'flags', 'mapq'):
+            values = getattr(self, column)
+            if values is not None:
+                setattr(batch, column, values[indices])
+        if self.query_name is not None:
+            batch.query_name = [self.query_name[index]
+                                for index in indices.tolist()]
+        if self.sequence is not None:
+            sequence_index, batch.sequence_offsets = ragged_take(
+                self.sequence_offsets, indices
+            )
+            batch.sequence = self.sequence[sequence_index]
+            batch.qualities = self.qualities[sequence_index]
+        return batch
+
+    @classmethod
+    def concatenate(cls, batches: List["CigarBatch"]) -> "CigarBatch":
+        """Join batches end-to-end.
+
+        Optional columns are kept if every batch has them.
+        """
+        batch = cls(
+            reference_start=np.concatenate(
+                [b.reference_start for b in batches]
+            ),
+            ops=np.concatenate([b.ops for b in batches]),
+            lengths=np.concatenate([b.lengths for b in batches]),
+            offsets=_concatenate_offsets([b.offsets for b in batches]),
+        )
+        for column in ('reference_id', 'flags', 'mapq'):
+            if all(getattr(b, column) is not None for b in batches):
+                values = [getattr(b, column) for b in batches]
+                setattr(batch, column, np.concatenate(values))
+        if all(b.query_name is not None for b in batches):
+            batch.query_name = [name for b in batches for name in b.query_name]
+        if all(b.sequence is not None for b in batches):
+            batch.sequence = np.concatenate([b.sequence for b in batches])
+            batch.qualities = np.concatenate([b.qualities for b in batches])
+            batch.sequence_offsets = _concatenate_offsets(
+                [b.sequence_offsets for b in batches]
+            )
+        return batch
+
+    @classmethod
+    def from_cigarstrings(
+        cls,
+        reference_starts: Iterable[int],
+        cigarstrings: Iterable[str],
+        **columns
+    ) -> "CigarBatch":
+        """Build a batch from cigarstrings, parsing all of them in one pass.
+
+        >>>> CigarBatch.from_cigarstrings([10, 30], ['4M1D3M', '2S5M'])
+        """
+        encoded = [cigarstring.encode() if isinstance(cigarstring, str)
+                   else cigarstring for cigarstring in cigarstrings]
+        chars = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        cigar_offsets = _offsets_from_counts([len(c) for c in encoded])
+        ops, lengths, offsets = parse_cigar_buffer(chars, cigar_offsets)
+        return cls(
+            reference_start=np.array(list(reference_starts), dtype=np.int64),
+            ops=ops,
+            lengths=lengths,
+            offsets=offsets,
+            **columns
+        )
+
+    @classmethod
+    def from_alignments(
+        cls,
+        alignments: Iterable[Tuple[int, CigarTuples]],
+        **columns
+    ) -> "CigarBatch":
+        """Build a batch from (reference_start, cigartuples) pairs.
+
+        Any extra per-read columns (flags, mapq, ...) are passed through.
+        """
+        starts, counts, pairs = [], [], []
+        for reference_start, cigartuples in alignments:
+            starts.append(reference_start)
+            counts.append(len(cigartuples))
+            pairs.extend(cigartuples)
+
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        return cls(
+            reference_start=np.array(starts, dtype=np.int64),
+            ops=pairs[:, 0].astype(np.uint8),
+            lengths=pairs[:, 1],
+            offsets=_offsets_from_counts(counts),
+            **columns
+        )
+
+    @classmethod
+    def from_segments(
+        cls,
+        segments: Iterable["pysam.AlignedSegment"],
+        with_sequence: bool = False
+    ) -> "CigarBatch":
+        """Build a batch from pysam AlignedSegments.
+
+        Sequences and qualities are only decoded when with_sequence is set.
+        Missing qualities are stored as 255, as in BAM.
+        """
+        starts, reference_ids, flags, mapqs = [], [], [], []
+        names, cigarstrings = [], []
+        sequences, qualities, sequence_counts = [], [], []
+
+        for segment in segments:
+            starts.append(segment.reference_start)
+            reference_ids.append(segment.reference_id)
+            flags.append(segment.flag)
+            mapqs.append(segment.mapping_quality)
+            names.append(segment.query_name)
+            # parsing the cigarstrings in one pass beats building arrays
+            # from cigartuples
+            cigarstrings.append(segment.cigarstring or '')
+
+            if with_sequence:
+                sequence = (segment.query_sequence or '').encode()
+                quality = segment.query_qualities
+                sequences.append(sequence)
+                if quality is None:
+                    qualities.append(b'\xff' * len(sequence))
+                else:
+                    qualities.append(bytes(quality))
+                sequence_counts.append(len(sequence))
+
+        batch = cls.from_cigarstrings(
+            starts,
+            cigarstrings,
+            reference_id=np.array(reference_ids, dtype=np.int32),
+            flags=np.array(flags, dtype=np.uint16),
+            mapq=np.array(mapqs, dtype=np.uint8),
+            query_name=names,
+        )
+        if with_sequence:
+            batch.sequence = np.frombuffer(b''.join(sequences), dtype=np.uint8)
+            batch.qualities = np.frombuffer(b''.join(qualities),
+                                            dtype=np.uint8)
+            batch.sequence_offsets = _offsets_from_counts(sequence_counts)
+        return batch
+
+
+def segment_sum(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Sum a flat per-op array within each read, safe for reads with no ops.
+
+    >>>> segment_sum(np.array([4, 1, 3, 2, 5]), np.array([0, 3, 5]))
+    [8 7]
+    """
+    totals = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(values, out=totals[1:])
+    return totals[offsets[1:]] - totals[offsets[:-1]]
+
+
+def ragged_range(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenate range(start, start+count) for every start/count pair.
+
+    >>>> ragged_range(np.array([10, 3]), np.array([2, 3]))
+    [10 11 3 4 5]
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    ends = np.cumsum(counts)
+    starts = np.asarray(starts, dtype=np.int64)
+    shift = np.repeat(starts - (ends - counts), counts)
+    return shift + np.arange(ends[-1] if len(ends) else 0, dtype=np.int64)
+
+
+def pad_reads(
+    ops: np.ndarray,
+    lengths: np.ndarray,
+    offsets: np.ndarray,
+    op: int,
+    left_lengths: np.ndarray,
+    right_lengths: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Add an op at the start and/or end of every read where its length is > 0.
+
+    >>>> pad_reads(ops, lengths, offsets, BAM_CSOFT_CLIP,
+    ....           left_soft, right_soft)
+    """
+    has_left, has_right = left_lengths > 0, right_lengths > 0
+    counts = np.diff(offsets)
+    new_offsets = _offsets_from_counts(has_left + counts + has_right)
+
+    new_ops = np.empty(new_offsets[-1], dtype=ops.dtype)
+    new_lengths = np.empty(new_offsets[-1], dtype=lengths.dtype)
+    target = ragged_range(new_offsets[:-1] + has_left, counts)
+    new_ops[target], new_lengths[target] = ops, lengths
+
+    left_slot = new_offsets[:-1][has_left]
+    right_slot = new_offsets[1:][has_right] - 1
+    new_ops[left_slot], new_lengths[left_slot] = op, left_lengths[has_left]
+    new_ops[right_slot], new_lengths[right_slot] = op, right_lengths[has_right]
+    return new_ops, new_lengths, new_offsets
+
+
+def reverse_reads(offsets: np.ndarray) -> np.ndarray:
+    """Index that reverses the items within every read of a ragged array.
+
+    >>>> reverse_reads(np.array([0, 3, 5]))
+    [2 1 0 4 3]
+    """
+    counts = np.diff(offsets)
+    positions = np.arange(offsets[-1])
+    return np.repeat(offsets[:-1] + offsets[1:] - 1, counts) - positions
+
+
+def ragged_take(
+    offsets: np.ndarray,
+    indices: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    "Flat item index and new offsets that select rows of a ragged array"
+    counts = offsets[1:][indices] - offsets[:-1][indices]
+    item_index = ragged_range(offsets[:-1][indices], counts)
+    return item_index, _offsets_from_counts(counts)
+
+
+def parse_cigar_buffer(
+    chars: np.ndarray,
+    cigar_offsets: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Parse concatenated cigarstring bytes into ragged ops/lengths/offsets.
+
+    Read i owns chars[cigar_offsets[i]:cigar_offsets[i+1]]. Op letters are
+    found with a lookup table and all op lengths are converted at once.
+
+    >>>> chars = np.frombuffer(b'4M1D3M2S5M', dtype=np.uint8)
+    >>>> parse_cigar_buffer(chars, np.array([0, 6, 10]))
+    [0 2 0 4 0] [4 1 3 2 5] [0 3 5]
+    """
+    codes = CIGAR_BYTE_LUT[chars]
+    op_positions = np.flatnonzero(codes >= 0)
+    offsets = np.searchsorted(op_positions, cigar_offsets).astype(np.int64)
+
+    number_starts = np.concatenate([[0], op_positions[:-1] + 1])
+    number_starts = number_starts.astype(np.int64)
+    lengths = parse_uint_fields(chars, number_starts, op_positions)
+
+    return codes[op_positions].astype(np.uint8), lengths, offsets
+
+
+def parse_uint_fields(
+    buf: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray
+) -> np.ndarray:
+    """Parse the unsigned decimal numbers in buf[start:end] in one pass.
+
+    The loop runs once per digit column (Horner's rule across all fields),
+    never once per number.
+
+    >>>> parse_uint_fields(np.frombuffer(b'12M345I', dtype=np.uint8),
+    ....                   np.array([0, 3]), np.array([2, 6]))
+    [12 345]
+    """
+    counts = ends - starts
+    width = int(counts.max()) if len(counts) else 0
+    values = np.zeros(len(counts), dtype=np.int64)
+    for column in range(width):
+        present = counts > column
+        digits = buf[starts[present] + column].astype(np.int64) - 48
+        values[present] = values[present] * 10 + digits
+    return values
+
+
+def _concatenate_offsets(offsets: List[np.ndarray]) -> np.ndarray:
+    "Join ragged offsets arrays, shifting each by the items that came before"
+    counts = [np.diff(offset) for offset in offsets]
+    return _offsets_from_counts(np.concatenate(counts) if counts else [])
+
+
+def _offsets_from_counts(counts: List[int]) -> np.ndarray:
+    "Convert per-read item counts into a ragged offsets array of length n+1"
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(np.asarray(counts, dtype=np.int64), out=offsets[1:])
+    return offsets
@@ -5,17 +5,24 @@ __copyright__ = """Copyright (C) 2022-present
     All rights reserved"""
 __author__ = "Will Dampier, PhD"
 
-from typing import Iterator, Tuple
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
 from cigarmath.defn import (
     CONSUMES_REFERENCE,
     CONSUMES_QUERY,
     BAM_CSOFT_CLIP,
     BAM_CHARD_CLIP,
+    BAM_CMATCH,
     BAM_CDEL,
     BAM_CREF_SKIP,
+    BAM_CEQUAL,
+    BAM_CDIFF,
+    BAM_FREVERSE,
+    BAM_FREAD2,
     CigarTuples,
 )
 from cigarmath.clipping import left_clipping
+from cigarmath.batch import CigarBatch, CONSUMES_REFERENCE_LUT, segment_sum
 
 def reference_offset(cigartuples: CigarTuples) -> int:
     """Calculate the length of the reference mapping block based on cigartuples.
@@ -37,6 +44,17 @@ def reference_offset(cigartuples: CigarTuples) -> int:
     )
 
 
+def reference_offset_batch(batch: CigarBatch) -> np.ndarray:
+    """Vectorized reference_offset for every read in a batch.
+
+    >>>> batch = CigarBatch.from_cigarstrings([3], ['3H4M1D3M2I3M4H'])
+    >>>> reference_offset_batch(batch)
+    [11]
+    """
+    reference_length = batch.lengths * CONSUMES_REFERENCE_LUT[batch.ops]
+    return segment_sum(reference_length, batch.offsets)
+
+
 def reference_block(cigartuples: CigarTuples, reference_start: int = 0) -> Tuple[int, int]:
     """Returns a tuple of the reference (start, end) positions of the aligned segment
 
@@ -54,6 +72,17 @@ def reference_block(cigartuples: CigarTuples, reference_start: int = 0) -> Tuple
     return reference_start, reference_start + offset
 
 
+def reference_block_batch(batch: CigarBatch) -> Tuple[np.ndarray, np.ndarray]:
+    """Vectorized reference_block: reference (start, end) arrays of all reads.
+
+    >>>> batch = CigarBatch.from_cigarstrings([3, 20], ['4M1D3M', '2S5M'])
+    >>>> reference_block_batch(batch)
+    ([3 20], [11 25])
+    """
+    reference_end = batch.reference_start + reference_offset_batch(batch)
+    return batch.reference_start, reference_end
+
+
 def query_offset(cigartuples: CigarTuples) -> int:
     """Calculate the length of the query mapping block based on cigartuples.
 
@@ -196,4 +225,264 @@ def reference_deletion_blocks(
         reference_start += (op in CONSUMES_REFERENCE) * sz
 
 
+def reference_mapping_blocks_batch(
+    batch: CigarBatch,
+    deletion_split: int = 10
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized reference_mapping_blocks.
+
+    Returns a (read_index, block_start, block_end) table of the mapped
+    blocks of every read, split by deletions (or skips) of at least
+    deletion_split.
+
+    POS0  000000000011111111112222222222
+    POS1  012345678901234567890123456789
+
+    CGS      MMMMMMMDDDMMMMDDDDDDMMMM
+
+    >>>> batch = CigarBatch.from_cigarstrings([3], ['7M3D4M6D4M'])
+    >>>> reference_mapping_blocks_batch(batch, deletion_split=5)
+    ([0 0], [ 3 22], [16 26])
+    """
+    read_starts, read_ends = reference_block_batch(batch)
+    read_index, del_start, del_end = reference_deletion_blocks_batch(
+        batch, min_size=deletion_split
+    )
+
+    # every read has one more block than splitting deletions
+    block_reads = np.concatenate([np.arange(len(batch)), read_index])
+    block_start = np.concatenate([read_starts, del_end])
+    order = np.lexsort((block_start, block_reads))
+    block_reads, block_start = block_reads[order], block_start[order]
+
+    block_end = np.concatenate([del_start, read_ends])
+    end_reads = np.concatenate([read_index, np.arange(len(batch))])
+    block_end = block_end[np.lexsort((block_end, end_reads))]
+    return block_reads, block_start, block_end
+
+
+def reference_deletion_blocks_batch(
+    batch: CigarBatch,
+    min_size: int = 1
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized reference_deletion_blocks.
+
+    Returns a (read_index, del_start, del_end) table of every deletion (or
+    skip) of at least min_size in the batch.
+
+    POS0  000000000011111111112222222222
+    POS1  012345678901234567890123456789
+
+    CGS      MMMMDDDDDDMMMMDDDDDDMMMM
+
+    >>>> batch = CigarBatch.from_cigarstrings([3], ['4M6D4M6D4M'])
+    >>>> reference_deletion_blocks_batch(batch)
+    ([0 0], [ 7 17], [13 23])
+    """
+    reference_length = batch.lengths * CONSUMES_REFERENCE_LUT[batch.ops]
+    reference_sum = np.concatenate([[0], np.cumsum(reference_length)])
+
+    is_deletion = np.isin(batch.ops, [BAM_CDEL, BAM_CREF_SKIP])
+    is_deletion &= batch.lengths >= min_size
+    op_index = np.flatnonzero(is_deletion)
+    read_index = batch.read_index[op_index]
+
+    first = batch.offsets[:-1][read_index]
+    del_start = (batch.reference_start[read_index]
+                 + reference_sum[op_index] - reference_sum[first])
+    return read_index, del_start, del_start + batch.lengths[op_index]
+
+
+def count_blocks(
+    starts: np.ndarray,
+    ends: np.ndarray,
+    counts: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Count identical (start, end) blocks, e.g. for a deletion spectrum.
+
+    Returns (starts, ends, counts) of the distinct blocks sorted by start and
+    end. Passing previous counts merges tables, so a stream of batches can be
+    reduced one batch at a time.
+
+    >>>> count_blocks(np.array([17, 7, 7]), np.array([23, 13, 13]))
+    ([ 7 17], [13 23], [2 1])
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    (starts, ends), counts = _count_rows([starts, ends], counts)
+    return starts, ends, counts
+
+
+def _count_rows(
+    columns: List[np.ndarray],
+    counts: Optional[np.ndarray] = None
+) -> Tuple[List[np.ndarray], np.ndarray]:
+    """Sort rows of equal-length columns and sum the counts of identical rows.
+
+    Rows sort by the first column first.
+    """
+    columns = [np.asarray(col) for col in columns]
+    num_rows = len(columns[0])
+    if counts is None:
+        counts = np.ones(num_rows, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+
+    order = np.lexsort(columns[::-1])
+    columns, counts = [col[order] for col in columns], counts[order]
+
+    is_new = np.zeros(num_rows, dtype=bool)
+    is_new[:1] = True
+    for col in columns:
+        is_new[1:] |= col[1:] != col[:-1]
+    group_start = np.flatnonzero(is_new)
+    if num_rows:
+        counts = np.add.reduceat(counts, group_start)
+    return [col[group_start] for col in columns], counts
+
+
+LIBRARY_TYPES = ('unstranded', 'fr-firststrand', 'fr-secondstrand')
+
+
+def library_strand(batch: CigarBatch, library_type: str) -> np.ndarray:
+    """Transcript strand (1, -1 or 0) of every read of a stranded library.
+
+    fr-secondstrand (e.g. ligation, Illumina stranded): read 1 (and
+    unpaired reads) align in the transcript direction and read 2 opposite.
+    fr-firststrand (e.g. dUTP, TruSeq stranded): the other way round.
+    unstranded libraries give 0.
+    """
+    if library_type not in LIBRARY_TYPES:
+        raise ValueError(f"library_type must be one of {LIBRARY_TYPES}")
+    if library_type == 'unstranded':
+        return np.zeros(len(batch), dtype=np.int8)
+    if batch.flags is None:
+        raise ValueError(
+            "a stranded library_type needs the flags of the batch"
+        )
+
+    # the fragment runs forward when read 1 is forward or read 2 is reversed
+    reverse = (batch.flags & BAM_FREVERSE) > 0
+    forward = reverse == ((batch.flags & BAM_FREAD2) > 0)
+    if library_type == 'fr-firststrand':
+        forward = ~forward
+    return np.where(forward, 1, -1).astype(np.int8)
+
+
+def reference_junction_blocks_batch(
+    batch: CigarBatch,
+    strand: Optional[np.ndarray] = None,
+    library_type: Optional[str] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray,
+           np.ndarray, np.ndarray, np.ndarray]:
+    """Table of every splice junction (N op) in a batch.
+
+    Returns (read_index, start, end, strand, left_anchor, right_anchor).
+    The anchors are the aligned (M/=/X) bases between the junction and the
+    previous/next junction or end of the read. strand is 1 (+), -1 (-) or
+    0 (unknown); it comes from the per-read strand argument if given (e.g.
+    from XS tags), otherwise from the flags of a stranded library_type
+    (see library_strand), otherwise 0. The reverse flag alone says how a
+    read aligned, not which strand was transcribed.
+
+    POS0  000000000011111111112222222222
+    POS1  012345678901234567890123456789
+
+    CGS      MMMMNNNNNNMMMMNNNNNNMMMM
+    ANCH     4444      4444      4444
+
+    >>>> batch = CigarBatch.from_cigarstrings([3], ['4M6N4M6N4M'])
+    >>>> reference_junction_blocks_batch(batch)
+    ([0 0], [ 7 17], [13 23], [0 0], [4 4], [4 4])
+    """
+    first_op = batch.offsets[:-1]
+    reference_length = batch.lengths * CONSUMES_REFERENCE_LUT[batch.ops]
+    reference_sum = np.concatenate([[0], np.cumsum(reference_length)])
+    aligned = np.isin(batch.ops, [BAM_CMATCH, BAM_CEQUAL, BAM_CDIFF])
+    aligned_sum = np.concatenate([[0], np.cumsum(batch.lengths * aligned)])
+
+    op_index = np.flatnonzero(batch.ops == BAM_CREF_SKIP)
+    read_index = batch.read_index[op_index]
+    start = (batch.reference_start[read_index] + reference_sum[op_index]
+             - reference_sum[first_op[read_index]])
+
+    # anchors run to the neighbouring junction of the same read
+    # or to the read end
+    same_read = read_index[1:] == read_index[:-1]
+    previous = np.where(np.append(False, same_read),
+                        np.append(0, op_index[:-1] + 1), first_op[read_index])
+    following = np.where(np.append(same_read, False),
+                         np.append(op_index[1:], 0),
+                         batch.offsets[1:][read_index])
+    left_anchor = aligned_sum[op_index] - aligned_sum[previous]
+    right_anchor = aligned_sum[following] - aligned_sum[op_index + 1]
+
+    if strand is None and library_type is not None:
+        strand = library_strand(batch, library_type)
+    if strand is None:
+        strand = np.zeros(len(batch), dtype=np.int8)
+    strand = np.asarray(strand, dtype=np.int8)[read_index]
+
+    end = start + batch.lengths[op_index]
+    return read_index, start, end, strand, left_anchor, right_anchor
+
+
+class JunctionCounter:
+    """Streaming count of unique splice junctions over batches.
+
+    Each update extracts the junctions of a batch, drops those with an anchor
+    shorter than min_anchor on either side and merges their counts into the
+    running (reference_id, start, end, strand) table. Reads of batches
+    without reference_id are counted under reference_id -1. Strands are 0
+    unless given per batch or by a stranded library_type.
+
+    >>>> counter = JunctionCounter(min_anchor=8)
+    >>>> for batch in segment_stream_pysam(path, batch_size=65_536):
+    >>>>     counter.update(batch)
+    >>>> reference_id, start, end, strand, count = counter.table()
+    """
+
+    def __init__(
+        self,
+        min_anchor: int = 0,
+        library_type: Optional[str] = None
+    ):
+        self.min_anchor = min_anchor
+        self.library_type = library_type
+        self._columns = [np.empty(0, dtype=np.int64) for _ in range(4)]
+        self._counts = np.empty(0, dtype=np.int64)
+
+    def update(
+        self,
+        batch: CigarBatch,
+        strand: Optional[np.ndarray] = None
+    ) -> None:
+        "Add the junctions of a batch, with an optional per-read strand"
+        junctions = reference_junction_blocks_batch(
+            batch, strand=strand, library_type=self.library_type
+        )
+        read_index, start, end, strand, left_anchor, right_anchor = junctions
+        keep = ((left_anchor >= self.min_anchor)
+                & (right_anchor >= self.min_anchor))
+
+        if batch.reference_id is not None:
+            reference_id = batch.reference_id[read_index[keep]]
+        else:
+            reference_id = np.full(keep.sum(), -1)
+
+        columns = [reference_id, start[keep], end[keep], strand[keep]]
+        columns = [np.concatenate([old, new.astype(np.int64)])
+                   for old, new in zip(self._columns, columns)]
+        counts = np.concatenate([self._counts,
+                                 np.ones(keep.sum(), dtype=np.int64)])
+        self._columns, self._counts = _count_rows(columns, counts)
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def table(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray,
+                             np.ndarray, np.ndarray]:
+        "The (reference_id, start, end, strand, count) table by position"
+        return (*self._columns, self._counts)
+
+
 # Copyright (C) 2022-present, Dampier & DV Klopfenstein, PhD. All rights reserved
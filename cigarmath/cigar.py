@@ -0,0 +1,145 @@
+"""An immutable, hashable cigar value type"""
+
+__copyright__ = """Copyright (C) 2022-present
+    Dampier & DV Klopfenstein, PhD.
+    All rights reserved"""
+__author__ = "Will Dampier, PhD"
+
+from array import array
+from collections.abc import Sequence
+from typing import Iterable, Iterator, Tuple, Union
+from cigarmath.defn import CigarTuple, cigarstr2tup, cigartup2str
+from cigarmath.block import reference_offset, query_offset
+from cigarmath.block import reference_mapping_blocks
+from cigarmath.clipping import left_clipping, right_clipping
+
+# Slots holding lazily computed values; _UNSET marks "not computed yet"
+_UNSET = object()
+_DERIVED = ('_hash', '_reference_offset', '_query_offset', '_left_clipping',
+            '_right_clipping', '_mapping_blocks', '_cigarstring')
+
+
+class Cigar(Sequence):
+    """Immutable cigartuples packed BAM-style (length << 4 | op) into an array.
+
+    A Cigar is a sequence of (op, length) tuples, so every function taking
+    cigartuples accepts it. It hashes and compares like the equivalent
+    tuple of tuples, which makes it usable for dict/set deduplication.
+    Derived values are computed on first access and then cached.
+
+    As in BAM, op lengths must be below 2**28.
+
+    >>>> cigar = Cigar.from_string('3H4M1D3M2I3M4H')
+    >>>> cigar.reference_offset, cigar.query_offset, cigar.left_clipping
+    (11, 12, 3)
+    >>>> cigar[1:3]
+    Cigar('4M1D')
+    """
+    __slots__ = ('_codes',) + _DERIVED
+
+    def __init__(self, cigartuples: Iterable[CigarTuple] = ()):
+        if isinstance(cigartuples, Cigar):
+            codes = cigartuples._codes
+        else:
+            codes = array('I', [(sz << 4) | op for op, sz in cigartuples])
+        self._codes = codes
+        for name in _DERIVED:
+            setattr(self, name, _UNSET)
+
+    @classmethod
+    def from_string(cls, cigarstring: str) -> "Cigar":
+        "Create a Cigar from a cigarstring"
+        return cls(cigarstr2tup(cigarstring))
+
+    @classmethod
+    def _from_codes(cls, codes: array) -> "Cigar":
+        cigar = cls.__new__(cls)
+        cigar._codes = codes
+        for name in _DERIVED:
+            setattr(cigar, name, _UNSET)
+        return cigar
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def __getitem__(
+        self,
+        index: Union[int, slice]
+    ) -> Union[CigarTuple, "Cigar"]:
+        if isinstance(index, slice):
+            return Cigar._from_codes(self._codes[index])
+        code = self._codes[index]
+        return code & 0xF, code >> 4
+
+    def __iter__(self) -> Iterator[CigarTuple]:
+        for code in self._codes:
+            yield code & 0xF, code >> 4
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Cigar):
+            return self._codes == other._codes
+        if isinstance(other, (list, tuple)):
+            return tuple(self) == tuple(tuple(item) for item in other)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        if self._hash is _UNSET:
+            self._hash = hash(tuple(self))
+        return self._hash
+
+    def __add__(self, other: Iterable[CigarTuple]) -> "Cigar":
+        return Cigar._from_codes(self._codes + Cigar(other)._codes)
+
+    def __radd__(self, other: Iterable[CigarTuple]) -> "Cigar":
+        return Cigar._from_codes(Cigar(other)._codes + self._codes)
+
+    def __repr__(self) -> str:
+        return f"Cigar('{self.cigarstring}')"
+
+    def __str__(self) -> str:
+        return self.cigarstring
+
+    def __reduce__(self):
+        return (Cigar, (tuple(self),))
+
+    @property
+    def cigarstring(self) -> str:
+        "The cigarstring form, e.g. '4M1D3M'"
+        if self._cigarstring is _UNSET:
+            self._cigarstring = cigartup2str(self)
+        return self._cigarstring
+
+    @property
+    def reference_offset(self) -> int:
+        "Number of reference bases covered, see block.reference_offset"
+        if self._reference_offset is _UNSET:
+            self._reference_offset = reference_offset(self)
+        return self._reference_offset
+
+    @property
+    def query_offset(self) -> int:
+        "Number of aligned (unclipped) query bases, see block.query_offset"
+        if self._query_offset is _UNSET:
+            self._query_offset = query_offset(self)
+        return self._query_offset
+
+    @property
+    def left_clipping(self) -> int:
+        "Soft or hard clipping on the left, see clipping.left_clipping"
+        if self._left_clipping is _UNSET:
+            self._left_clipping = left_clipping(self) if self else 0
+        return self._left_clipping
+
+    @property
+    def right_clipping(self) -> int:
+        "Soft or hard clipping on the right, see clipping.right_clipping"
+        if self._right_clipping is _UNSET:
+            self._right_clipping = right_clipping(self) if self else 0
+        return self._right_clipping
+
+    @property
+    def mapping_blocks(self) -> Tuple[Tuple[int, int], ...]:
+        "reference_mapping_blocks relative to a reference_start of 0"
+        if self._mapping_blocks is _UNSET:
+            self._mapping_blocks = tuple(reference_mapping_blocks(self))
+        return self._mapping_blocks
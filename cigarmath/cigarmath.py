@@ -5,7 +5,13 @@ __copyright__ = """Copyright (C) 2022-present
     All rights reserved"""
 __author__ = "Will Dampier, PhD"
 
+from dataclasses import replace
+import numpy as np
+from cigarmath.batch import CigarBatch
 from cigarmath.defn import (
+    BAM_CMATCH,
+    BAM_CEQUAL,
+    BAM_CDIFF,
     BAM_CSOFT_CLIP,
     BAM_CHARD_CLIP,
     NTS,
@@ -17,8 +23,9 @@ from cigarmath.defn import (
     CONSUMES_QUERY,
 )
 
-
-
+# Op remapping used by simplify_blocks_batch: = and X become M
+SIMPLIFY_LUT = np.arange(16, dtype=np.uint8)
+SIMPLIFY_LUT[[BAM_CEQUAL, BAM_CDIFF]] = BAM_CMATCH
 
 
 def simplify_blocks(cigartuples, collapse=True):
@@ -74,4 +81,52 @@ def collapse_adjacent_blocks(cigartuples):
     yield last_op, last_sz
 
 
+def simplify_blocks_batch(
+    batch: CigarBatch,
+    collapse: bool = True
+) -> CigarBatch:
+    """Vectorized simplify_blocks: replace = and X with M in every read.
+
+    CGS     ====XX=XX==     3S4=1I2X
+    OUT     11M             3S4M1I2M
+
+    >>>> batch = CigarBatch.from_cigarstrings([0, 0],
+    ....                                      ['4=2X1=2X2=', '3S4=1I2X'])
+    >>>> simplify_blocks_batch(batch)
+    [(0, [(0, 11)]), (0, [(4, 3), (0, 4), (1, 1), (0, 2)])]
+    """
+    simpled = replace(batch, ops=SIMPLIFY_LUT[batch.ops])
+    if collapse:
+        return collapse_adjacent_blocks_batch(simpled)
+    return simpled
+
+
+def collapse_adjacent_blocks_batch(batch: CigarBatch) -> CigarBatch:
+    """Vectorized collapse_adjacent_blocks: merge identical adjacent ops.
+
+    A run starts wherever the op changes or a new read begins; run lengths
+    are summed with np.add.reduceat.
+
+    >>>> batch = CigarBatch.from_cigarstrings([0, 0], ['3M3M2I', '2I1I'])
+    >>>> collapse_adjacent_blocks_batch(batch)
+    [(0, [(0, 6), (1, 2)]), (0, [(1, 3)])]
+    """
+    ops, lengths = batch.ops, batch.lengths
+
+    run_start = np.ones(len(ops), dtype=bool)
+    run_start[1:] = ops[1:] != ops[:-1]
+    run_start[batch.offsets[:-1][np.diff(batch.offsets) > 0]] = True
+    run_starts = np.flatnonzero(run_start)
+
+    run_lengths = lengths[:0]
+    if len(run_starts):
+        run_lengths = np.add.reduceat(lengths, run_starts)
+    return replace(
+        batch,
+        ops=ops[run_starts],
+        lengths=run_lengths,
+        offsets=np.searchsorted(run_starts, batch.offsets).astype(np.int64),
+    )
+
+
 # Copyright (C) 2022-present, Dampier & DV Klopfenstein, PhD. All rights reserved
@@ -5,7 +5,18 @@ __copyright__ = """Copyright (C) 2022-present
     All rights reserved"""
 __author__ = "Will Dampier, PhD"
 
-from typing import Tuple, List, Union, TypeVar, Any
+from dataclasses import replace
+from typing import Tuple, List, Optional, Union, TypeVar, Any
+import numpy as np
+from cigarmath.batch import (
+    CigarBatch,
+    CONSUMES_QUERY_LUT,
+    CONSUMES_REFERENCE_LUT,
+    pad_reads,
+    ragged_range,
+    segment_sum,
+    _offsets_from_counts,
+)
 from cigarmath.defn import (
     CigarTuples,
     BAM_CSOFT_CLIP,
@@ -19,6 +30,9 @@ from cigarmath.defn import (
 
 T = TypeVar('T')  # For generic types in declip function
 
+# side codes of clip events
+LEFT_CLIP, RIGHT_CLIP = 0, 1
+
 def left_clipping(cigartuples: CigarTuples, with_hard: bool = True) -> int:
     """Returns the length of clipped bases (hard or soft) on the left side of the alignment
 
@@ -160,5 +174,214 @@ def _decide_softclip_end(cigartuples: CigarTuples, required_mapping: int) -> Tup
     return None, None
 
 
+def clip_event_table(
+    batch: CigarBatch,
+    min_clip: int = 1,
+    with_hard: bool = True
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Table of the clipped read ends of a batch, e.g. to find breakpoints.
+
+    Returns (read_index, position, side, clip_length) for every read end
+    with at least min_clip clipped bases. Left clips (side LEFT_CLIP) sit at
+    the reference_start and right clips (side RIGHT_CLIP) at the reference
+    end of the read. Adjacent clip ops such as 2H3S are added together.
+
+    POS0     000000000011111111112222222222
+    POS1     012345678901234567890123456789
+
+    REF         AAAAACCCCC
+    QRY      TTTAAAAACCCCCGGGG
+    CGS      SSSMMMMMMMMMMSSSS
+    EVENT       ^         ^
+                3 L       13 R
+
+    >>>> clip_event_table(CigarBatch.from_cigarstrings([3], ['3S10M4S']))
+    ([0 0], [ 3 13], [0 1], [3 4])
+    """
+    clip_ops = [BAM_CSOFT_CLIP]
+    if with_hard:
+        clip_ops.append(BAM_CHARD_CLIP)
+    is_clip = np.isin(batch.ops, clip_ops)
+
+    # leading (trailing) clips are the ops with no unclipped op
+    # before (after) them
+    unclipped_sum = np.concatenate([[0], np.cumsum(~is_clip)])
+    read_index = batch.read_index
+    read_first = unclipped_sum[batch.offsets[:-1]][read_index]
+    read_last = unclipped_sum[batch.offsets[1:]][read_index]
+    leading = is_clip & (unclipped_sum[:-1] == read_first)
+    trailing = is_clip & (unclipped_sum[1:] == read_last)
+
+    left = segment_sum(batch.lengths * leading, batch.offsets)
+    right = segment_sum(batch.lengths * (trailing & ~leading), batch.offsets)
+    reference_length = batch.lengths * CONSUMES_REFERENCE_LUT[batch.ops]
+    reference_end = (batch.reference_start
+                     + segment_sum(reference_length, batch.offsets))
+
+    left_reads = np.flatnonzero(left >= min_clip)
+    right_reads = np.flatnonzero(right >= min_clip)
+    read_index = np.concatenate([left_reads, right_reads])
+    side = np.repeat(np.array([LEFT_CLIP, RIGHT_CLIP], dtype=np.int8),
+                     [len(left_reads), len(right_reads)])
+    is_left = side == LEFT_CLIP
+    position = np.where(is_left, batch.reference_start[read_index],
+                        reference_end[read_index])
+    clip_length = np.where(is_left, left[read_index], right[read_index])
+
+    order = np.argsort(read_index, kind='stable')
+    return read_index[order], position[order], side[order], clip_length[order]
+
+
+def cluster_clip_events(
+    position: np.ndarray,
+    side: np.ndarray,
+    tolerance: int = 5,
+    min_support: int = 1,
+    reference_id: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Cluster clip events along the reference into breakpoint candidates.
+
+    Events of the same reference_id and side are sorted by position and a new
+    cluster starts wherever the gap to the previous event exceeds tolerance.
+    Returns (reference_id, side, start, end, support) of the clusters with
+    at least min_support events, where [start, end] spans their positions.
+    Without reference_id every event is on reference_id -1.
+
+    POS      0000000000111111111122222
+             0123456789012345678901234
+    EVENTS     ||| |         |
+    CLUSTER    ^---^         ^         tolerance = 2
+
+    >>>> cluster_clip_events(np.array([2, 3, 4, 6, 16]), np.zeros(5),
+    ....                     tolerance=2)
+    ([-1 -1], [0 0], [ 2 16], [ 6 16], [4 1])
+    """
+    position = np.asarray(position, dtype=np.int64)
+    side = np.asarray(side, dtype=np.int8)
+    if reference_id is None:
+        reference_id = np.full(len(position), -1, dtype=np.int64)
+    reference_id = np.asarray(reference_id, dtype=np.int64)
+
+    order = np.lexsort((position, side, reference_id))
+    position, side = position[order], side[order]
+    reference_id = reference_id[order]
+
+    # sweep: a cluster breaks on a new reference_id/side or a gap > tolerance
+    is_new = np.ones(len(position), dtype=bool)
+    is_new[1:] = ((np.diff(position) > tolerance)
+                  | (side[1:] != side[:-1])
+                  | (reference_id[1:] != reference_id[:-1]))
+    first = np.flatnonzero(is_new)
+    last = np.append(first[1:], len(position)) - 1
+    support = last - first + 1
+
+    keep = support >= min_support
+    first, last = first[keep], last[keep]
+    return (reference_id[first], side[first], position[first],
+            position[last], support[keep])
+
+
+def declip_batch(batch: CigarBatch) -> CigarBatch:
+    """Vectorized declip: drop leading and trailing clipping ops of every read.
+
+    Soft-clipped bases are removed from the sequences and qualities, if the
+    batch has them; hard-clipped bases were never there.
+
+    CGT     3S10M4S     2H5M
+    OUT     10M         5M
+
+    >>>> batch = CigarBatch.from_cigarstrings([0, 0], ['3S10M4S', '2H5M'])
+    >>>> declip_batch(batch)
+    [(0, [(0, 10)]), (0, [(0, 5)])]
+    """
+    first, last = batch.offsets[:-1], batch.offsets[1:]
+
+    # pad with a non-clipping op so lookups for empty reads stay in bounds
+    ops = np.append(batch.ops, BAM_CMATCH)
+    lengths = np.append(batch.lengths, 0)
+    has_ops = last > first
+    clip_ops = [BAM_CSOFT_CLIP, BAM_CHARD_CLIP]
+    left_clip = has_ops & np.isin(ops[first], clip_ops)
+    right_clip = has_ops & np.isin(ops[last - 1], clip_ops)
+
+    starts = first + left_clip
+    ends = np.maximum(last - right_clip, starts)
+    op_index = ragged_range(starts, ends - starts)
+    declipped = replace(
+        batch,
+        ops=batch.ops[op_index],
+        lengths=batch.lengths[op_index],
+        offsets=_offsets_from_counts(ends - starts),
+    )
+
+    if batch.sequence is not None:
+        # a lone soft clip is only removed once
+        right_clip &= (last - first > 1) | ~left_clip
+        left_soft = np.where(left_clip & (ops[first] == BAM_CSOFT_CLIP),
+                             lengths[first], 0)
+        right_soft = np.where(right_clip & (ops[last - 1] == BAM_CSOFT_CLIP),
+                              lengths[last - 1], 0)
+        seq_starts = batch.sequence_offsets[:-1] + left_soft
+        seq_ends = np.maximum(batch.sequence_offsets[1:] - right_soft,
+                              seq_starts)
+        seq_counts = seq_ends - seq_starts
+        sequence_index = ragged_range(seq_starts, seq_counts)
+        declipped.sequence = batch.sequence[sequence_index]
+        declipped.qualities = batch.qualities[sequence_index]
+        declipped.sequence_offsets = _offsets_from_counts(seq_counts)
+
+    return declipped
+
+
+def softclipify_batch(
+    batch: CigarBatch,
+    required_mapping: int = 1
+) -> Tuple[CigarBatch, np.ndarray]:
+    """Vectorized softclipify: convert the ops outside the first and last
+    mapping blocks of at least required_mapping bases into soft clips.
+
+    Returns the new batch and the per-read reference offset to add to
+    reference_start, exactly like softclipify. Reads without such a mapping
+    block are returned unchanged with an offset of 0.
+
+    REF    --AAAAGACCCCCGACTCGTTA---
+    QUE    TT----AACCCCCGAC----TAGCA
+    CIG    IIDDDDMMMMMMMMMMDDDDMMIII
+
+    OUT    SS    MMMMMMMMMMDDDDMMSSS required_mapping = 1
+    OUT    SS    MMMMMMMMMM    SSSSS required_mapping = 4
+    """
+    first, last = batch.offsets[:-1], batch.offsets[1:]
+
+    mapping = np.isin(batch.ops, [BAM_CMATCH, BAM_CEQUAL, BAM_CDIFF])
+    mapping &= batch.lengths >= required_mapping
+    mapping_index = np.append(np.flatnonzero(mapping), len(batch.ops))
+
+    # first and last qualifying op of each read (if any) by binary search
+    left = mapping_index[np.searchsorted(mapping_index, first)]
+    before_last = np.maximum(np.searchsorted(mapping_index, last) - 1, 0)
+    right = mapping_index[before_last]
+    found = left < last
+    left = np.where(found, left, first)
+    right_end = np.where(found, right + 1, last)
+
+    # masked cumulative sums of query and reference consuming lengths
+    query_length = batch.lengths * CONSUMES_QUERY_LUT[batch.ops]
+    reference_length = batch.lengths * CONSUMES_REFERENCE_LUT[batch.ops]
+    query_sum = np.concatenate([[0], np.cumsum(query_length)])
+    reference_sum = np.concatenate([[0], np.cumsum(reference_length)])
+    left_soft = query_sum[left] - query_sum[first]
+    right_soft = query_sum[last] - query_sum[right_end]
+    offset = np.where(left_soft > 0,
+                      reference_sum[left] - reference_sum[first], 0)
+
+    middle = ragged_range(left, right_end - left)
+    ops, lengths, offsets = pad_reads(
+        batch.ops[middle], batch.lengths[middle],
+        _offsets_from_counts(right_end - left),
+        BAM_CSOFT_CLIP, left_soft, right_soft
+    )
+    return replace(batch, ops=ops, lengths=lengths, offsets=offsets), offset
+
 
 # Copyright (C) 2022-present, Dampier & DV Klopfenstein, PhD. All rights reserved
@@ -1,9 +1,32 @@
 """Functions for combining CIGAR strings"""
 
-from typing import Tuple, List, Optional
-from functools import partial
-from cigarmath.block import reference_block, query_block
-from cigarmath.defn import CigarTuples, BAM_CDEL, CONSUMES_QUERY, CONSUMES_REFERENCE
+from dataclasses import replace
+from typing import Tuple, List, Optional, Union
+import numpy as np
+from cigarmath.batch import (
+    CigarBatch,
+    CONSUMES_QUERY_LUT,
+    CONSUMES_REFERENCE_LUT,
+    pad_reads,
+    ragged_range,
+    reverse_reads,
+    segment_sum,
+    _offsets_from_counts,
+)
+from cigarmath.block import reference_block, query_block, reference_block_batch
+from cigarmath.index import BlockIndex
+from cigarmath.mapping import reference2query_batch
+from cigarmath.defn import (
+    CigarTuples,
+    BAM_CMATCH,
+    BAM_CDEL,
+    BAM_CEQUAL,
+    BAM_CDIFF,
+    BAM_CSOFT_CLIP,
+    BAM_CHARD_CLIP,
+    CONSUMES_QUERY,
+    CONSUMES_REFERENCE,
+)
 from cigarmath.cigarmath import collapse_adjacent_blocks
 from cigarmath.clipping import declip
 
@@ -103,11 +126,9 @@ def _trim(
     ref_pos_delta = 0
     to_trim = trim_amount
     
-    # Reverse tuples if trimming from end
+    # Reverse tuples if trimming from end (the result is reversed back)
     tuples = reversed(cigartuples) if not from_start else cigartuples
-    
-    # Get the appropriate method for appending or inserting
-    extend_func = partial(new_tuples.append) if from_start else partial(new_tuples.insert, 0)
+    extend_func = new_tuples.append
     
     for op, length in tuples:
         if to_trim > 0:
@@ -133,6 +154,9 @@ def _trim(
         else:
             # Past trimming
             extend_func((op, length))
+
+    if not from_start:
+        new_tuples.reverse()
                 
     return tuple(new_tuples), ref_pos_delta
 
@@ -180,7 +204,6 @@ def trim_alignment(
         
     # Add clipping if requested
     if add_clipping:
-        from cigarmath.defn import BAM_CSOFT_CLIP, BAM_CHARD_CLIP
         clip_op = BAM_CSOFT_CLIP if add_clipping == 'soft' else BAM_CHARD_CLIP
         
         result = []
@@ -193,6 +216,242 @@ def trim_alignment(
         
     return ref_start + ref_delta, trimmed_cigars
 
+
+def trim_alignment_batch(
+    batch: CigarBatch,
+    left: Union[int, np.ndarray] = 0,
+    right: Union[int, np.ndarray] = 0,
+    add_clipping: Optional[str] = None
+) -> CigarBatch:
+    """Vectorized trim_alignment: trim query bases from every read of a batch.
+
+    left and right are a single amount or one amount per read. The
+    reference_start of each read is moved past the trimmed bases, and
+    sequences/qualities are trimmed too unless add_clipping is 'soft'.
+    Results match trim_alignment read by read.
+
+    >>>> batch = CigarBatch.from_cigarstrings([10, 10], ['5M1D3M', '8M'])
+    >>>> trimmed = trim_alignment_batch(batch, left=np.array([2, 3]),
+    ....                                right=1, add_clipping='soft')
+    >>>> list(trimmed)
+    [(12, [(4, 2), (0, 3), (2, 1), (0, 2), (4, 1)]),
+     (13, [(4, 3), (0, 4), (4, 1)])]
+    """
+    if add_clipping not in (None, 'soft', 'hard'):
+        raise ValueError("add_clipping must be None, 'soft', or 'hard'")
+
+    left = np.broadcast_to(np.asarray(left, dtype=np.int64), (len(batch),))
+    right = np.broadcast_to(np.asarray(right, dtype=np.int64), (len(batch),))
+
+    ops, lengths, offsets, reference_delta = _trim_left_batch(
+        batch.ops, batch.lengths, batch.offsets, left
+    )
+
+    # trim the right end by trimming the left end of the reversed reads
+    reverse = reverse_reads(offsets)
+    ops, lengths, offsets, _ = _trim_left_batch(ops[reverse],
+                                                lengths[reverse],
+                                                offsets, right)
+    reverse = reverse_reads(offsets)
+    ops, lengths = ops[reverse], lengths[reverse]
+
+    if add_clipping:
+        clip_op = BAM_CSOFT_CLIP if add_clipping == 'soft' else BAM_CHARD_CLIP
+        ops, lengths, offsets = pad_reads(ops, lengths, offsets, clip_op,
+                                          left, right)
+
+    trimmed = replace(
+        batch,
+        reference_start=batch.reference_start + reference_delta,
+        ops=ops,
+        lengths=lengths,
+        offsets=offsets,
+    )
+
+    if (batch.sequence is not None) and (add_clipping != 'soft'):
+        seq_starts = np.minimum(batch.sequence_offsets[:-1] + left,
+                                batch.sequence_offsets[1:])
+        seq_ends = np.maximum(batch.sequence_offsets[1:] - right, seq_starts)
+        seq_counts = seq_ends - seq_starts
+        sequence_index = ragged_range(seq_starts, seq_counts)
+        trimmed.sequence = batch.sequence[sequence_index]
+        trimmed.qualities = batch.qualities[sequence_index]
+        trimmed.sequence_offsets = _offsets_from_counts(seq_counts)
+
+    return trimmed
+
+
+def trim_primers_batch(
+    batch: CigarBatch,
+    primer_starts: np.ndarray,
+    primer_ends: np.ndarray,
+    window: int = 0
+) -> CigarBatch:
+    """Soft-clip primer sequence off the ends of every read, ivar-style.
+
+    Primers are (start, end) reference intervals, e.g. from a primer BED.
+    A primer trims the left end of a read if the read starts inside it (or
+    up to window bases before it) and trims the right end if the read ends
+    inside it (or up to window bases after it). The covered reference span
+    is converted to query bases and soft-clipped, reference_start moves to
+    the first base kept, and deletions or insertions left at the new ends
+    are folded into the soft clips. Reads lying entirely inside primers are
+    soft-clipped completely.
+
+    POS0    000000000011111111112222222222
+    POS1    012345678901234567890123456789
+    PRIMER  ------                ------
+    READ      MMMMMMMMMMMMMMMMMMMMMMMM
+    OUT       SSSSMMMMMMMMMMMMMMMMSSSS
+
+    >>>> batch = CigarBatch.from_cigarstrings([2], ['24M'])
+    >>>> primer_starts, primer_ends = np.array([0, 22]), np.array([6, 28])
+    >>>> list(trim_primers_batch(batch, primer_starts, primer_ends))
+    [(6, [(4, 4), (0, 16), (4, 4)])]
+    """
+    read_starts, read_ends = reference_block_batch(batch)
+    primer_starts = np.asarray(primer_starts, dtype=np.int64)
+    primer_ends = np.asarray(primer_ends, dtype=np.int64)
+
+    # only primers overlapping a read (widened by window) are considered
+    index = BlockIndex(primer_starts - window, primer_ends + window)
+    read_index, primer_index = index.overlap_join(read_starts, read_ends)
+    starts, ends = primer_starts[primer_index], primer_ends[primer_index]
+
+    read_start, read_end = read_starts[read_index], read_ends[read_index]
+    left_cut = read_starts.copy()
+    trims_left = (starts - window <= read_start) & (read_start < ends)
+    np.maximum.at(left_cut, read_index[trims_left], ends[trims_left])
+
+    right_cut = read_ends.copy()
+    trims_right = (starts < read_end) & (read_end <= ends + window)
+    np.minimum.at(right_cut, read_index[trims_right], starts[trims_right])
+
+    # convert reference cuts into query bases and trim through the
+    # query engine
+    query_length = batch.lengths * CONSUMES_QUERY_LUT[batch.ops]
+    total_query = segment_sum(query_length, batch.offsets)
+
+    left = np.where(left_cut > read_starts,
+                    reference2query_batch(batch, left_cut), 0)
+    left = np.where(left_cut >= read_ends, total_query, left)
+    right = np.where(right_cut < read_ends,
+                     total_query - reference2query_batch(batch, right_cut), 0)
+    right = np.minimum(right, total_query - left)
+
+    # trimming drops hard clips at a trimmed end, so carry them over;
+    # the padding keeps the lookups safe for reads without ops
+    hard = np.where(batch.ops == BAM_CHARD_CLIP, batch.lengths, 0)
+    hard = np.append(hard, 0)
+    has_ops = batch.offsets[1:] > batch.offsets[:-1]
+    left_hard = np.where((left > 0) & has_ops, hard[batch.offsets[:-1]], 0)
+    right_hard = np.where((right > 0) & has_ops,
+                          hard[batch.offsets[1:] - 1], 0)
+
+    trimmed = trim_alignment_batch(batch, left=left, right=right,
+                                   add_clipping='soft')
+    return _fold_read_ends(trimmed, left_hard, right_hard)
+
+
+def _fold_read_ends(
+    batch: CigarBatch,
+    left_hard: np.ndarray,
+    right_hard: np.ndarray
+) -> CigarBatch:
+    """Fold everything outside the first and last mapping op of each read into
+    one soft clip per side, like softclipify, and move reference_start past
+    any deletions dropped from the left. Hard clips are kept, plus the
+    left_hard/right_hard extra hard clipping per read.
+    """
+    first, last = batch.offsets[:-1], batch.offsets[1:]
+
+    mapping = np.isin(batch.ops, [BAM_CMATCH, BAM_CEQUAL, BAM_CDIFF])
+    mapping &= batch.lengths > 0
+    mapping_index = np.append(np.flatnonzero(mapping), len(batch.ops))
+    left = mapping_index[np.searchsorted(mapping_index, first)]
+    before_last = np.maximum(np.searchsorted(mapping_index, last) - 1, 0)
+    right = mapping_index[before_last]
+    found = left < last
+    left = np.where(found, left, first)
+    right_end = np.where(found, right + 1, last)
+
+    query_length = batch.lengths * CONSUMES_QUERY_LUT[batch.ops]
+    reference_length = batch.lengths * CONSUMES_REFERENCE_LUT[batch.ops]
+    hard_length = batch.lengths * (batch.ops == BAM_CHARD_CLIP)
+    query_sum = np.concatenate([[0], np.cumsum(query_length)])
+    reference_sum = np.concatenate([[0], np.cumsum(reference_length)])
+    hard_sum = np.concatenate([[0], np.cumsum(hard_length)])
+
+    middle = ragged_range(left, right_end - left)
+    ops, lengths, offsets = pad_reads(
+        batch.ops[middle], batch.lengths[middle],
+        _offsets_from_counts(right_end - left),
+        BAM_CSOFT_CLIP,
+        query_sum[left] - query_sum[first],
+        query_sum[last] - query_sum[right_end]
+    )
+    ops, lengths, offsets = pad_reads(
+        ops, lengths, offsets,
+        BAM_CHARD_CLIP,
+        left_hard + hard_sum[left] - hard_sum[first],
+        right_hard + hard_sum[last] - hard_sum[right_end]
+    )
+    reference_delta = reference_sum[left] - reference_sum[first]
+    return replace(
+        batch,
+        reference_start=batch.reference_start + reference_delta,
+        ops=ops,
+        lengths=lengths,
+        offsets=offsets,
+    )
+
+
+def _trim_left_batch(
+    ops: np.ndarray,
+    lengths: np.ndarray,
+    offsets: np.ndarray,
+    trim_amount: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Trim trim_amount query bases from the start of every read, like _trim.
+
+    An op survives if it still has query bases after the cut, or if it
+    consumes no query and lies at or after the cut. Encoding each op as
+    2 * (query bases up to and including it) + (1 if it consumes no query)
+    gives a non-decreasing key over the whole batch, so the first surviving
+    op of every read is found with a single searchsorted.
+
+    Returns (ops, lengths, offsets, reference_delta).
+    """
+    first, last = offsets[:-1], offsets[1:]
+    consumes_query = CONSUMES_QUERY_LUT[ops] & (lengths > 0)
+
+    query_sum = np.concatenate([[0], np.cumsum(lengths * consumes_query)])
+    reference_length = lengths * CONSUMES_REFERENCE_LUT[ops]
+    reference_sum = np.concatenate([[0], np.cumsum(reference_length)])
+    key = 2 * query_sum[1:] + ~consumes_query
+
+    cut = np.searchsorted(key, 2 * (query_sum[first] + trim_amount),
+                          side='right')
+    cut = np.where(trim_amount > 0, np.minimum(cut, last), first)
+    has_cut = cut < last
+
+    # the cut op loses the bases trimmed out of it; reads trimmed away
+    # entirely have cut == len(ops), so pad the per-op lookups
+    cut_consumes_query = np.append(consumes_query, False)[cut]
+    cut_consumes_reference = np.append(CONSUMES_REFERENCE_LUT[ops], False)[cut]
+    partial = np.where(has_cut & cut_consumes_query,
+                       query_sum[first] + trim_amount - query_sum[cut], 0)
+    reference_delta = (reference_sum[cut] - reference_sum[first]
+                       + partial * cut_consumes_reference)
+
+    counts = last - cut
+    keep = ragged_range(cut, counts)
+    new_offsets = _offsets_from_counts(counts)
+    new_lengths = lengths[keep]
+    new_lengths[new_offsets[:-1][has_cut]] -= partial[has_cut]
+    return ops[keep], new_lengths, new_offsets, reference_delta
+
+
 def combine_multiple_alignments(
     alignments: List[Tuple[int, CigarTuples]],
     allowed_overlap: int = 0
@@ -0,0 +1,149 @@
+"""Consensus sequences from array pileups"""
+
+__copyright__ = """Copyright (C) 2022-present
+    Dampier & DV Klopfenstein, PhD.
+    All rights reserved"""
+__author__ = "Will Dampier, PhD"
+
+from typing import Iterable, TextIO, Union
+import numpy as np
+from cigarmath.pileup import PileupMatrix, PILEUP_SYMBOLS, DELETION_SYMBOL
+
+# IUPAC code of every subset of ACGT, indexed by a bitmask A=1, C=2, G=4, T=8
+IUPAC_CODES = np.frombuffer(b'NACMGRSVTWYHKDBN', dtype=np.uint8)
+_SYMBOLS = np.frombuffer(PILEUP_SYMBOLS, dtype=np.uint8)
+
+
+def _iupac_calls(counts: np.ndarray, threshold: float) -> np.ndarray:
+    """The IUPAC code of the fewest bases reaching threshold of each row.
+
+    threshold is a fraction of the ACGT depth of the row.
+    """
+    bases = counts[:, :4]
+    order = np.argsort(-bases, axis=1, kind='stable')
+    ranked = np.take_along_axis(bases, order, axis=1)
+
+    base_depth = bases.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        before = (np.cumsum(ranked, axis=1) - ranked) / base_depth
+    included = (before < threshold) & (ranked > 0)
+
+    mask = (included * (1 << order)).sum(axis=1)
+    return IUPAC_CODES[mask]
+
+
+def consensus_sequence(
+    pileup: PileupMatrix,
+    method: str = 'majority',
+    threshold: float = 0.75,
+    min_depth: int = 1,
+    insertion_fraction: float = 0.5,
+    mask: bytes = b'N'
+) -> bytes:
+    """Call a consensus sequence over the window of an array pileup.
+
+    method='majority' calls the most common symbol of each position.
+    method='iupac' calls the IUPAC code of the fewest bases that together
+    reach threshold of the A/C/G/T reads (N when there are none), unless a
+    deletion is the most common symbol.
+    Positions where a deletion wins are left out, positions with fewer than
+    min_depth reads (and uncovered positions, whatever min_depth) are
+    masked, and insertions supported by at least insertion_fraction of the
+    reads covering their anchor are added using the majority base at every
+    offset most of the inserting reads reach.
+
+    REF:     AAAAGACC--CCC
+    READ1:   AAAA-ACCGGCCC
+    READ2:   AAAAGACC--CCC
+    READ3:   AATA-ACCGGCC
+
+    >>>> consensus_sequence(depth_matrix(batch, 0, 11))
+    b'AAAAACCGGCCC'
+    >>>> consensus_sequence(depth_matrix(batch, 0, 11), method='iupac')
+    b'AAWAACCGGCCC'
+    """
+    if method not in ('majority', 'iupac'):
+        raise ValueError("method must be 'majority' or 'iupac'")
+
+    counts = pileup.counts
+    depth = pileup.depth
+    called = counts.argmax(axis=1)
+    calls = _SYMBOLS[called]
+    if method == 'iupac':
+        calls = np.where(called == DELETION_SYMBOL, calls,
+                         _iupac_calls(counts, threshold))
+
+    masked = depth < max(min_depth, 1)
+    calls[masked] = ord(mask)
+    keep = masked | (called != DELETION_SYMBOL)
+    positions = np.arange(len(calls))
+
+    # insertions: majority symbol of each offset reached by most
+    # inserting reads
+    rows = pileup.insertion_position - pileup.start
+    min_support = np.maximum(insertion_fraction * depth, 1)
+    supported = pileup.insertion_depth >= min_support
+    supported &= ~masked
+    selected = supported[rows]
+    rows, offsets = rows[selected], pileup.insertion_offset[selected]
+    symbols = pileup.insertion_symbol[selected]
+    symbol_counts = pileup.insertion_count[selected]
+
+    # sorting each (position, offset) group by descending count puts its
+    # majority symbol first
+    order = np.lexsort((-symbol_counts, offsets, rows))
+    rows, offsets = rows[order], offsets[order]
+    symbols, symbol_counts = symbols[order], symbol_counts[order]
+    is_new = np.ones(len(rows), dtype=bool)
+    is_new[1:] = (rows[1:] != rows[:-1]) | (offsets[1:] != offsets[:-1])
+    group_first = np.flatnonzero(is_new)
+    offset_support = symbol_counts
+    if len(rows):
+        offset_support = np.add.reduceat(symbol_counts, group_first)
+
+    reached = 2 * offset_support > pileup.insertion_depth[rows[group_first]]
+    group_first = group_first[reached]
+    insert_rows, insert_offsets = rows[group_first], offsets[group_first]
+    insert_calls = _SYMBOLS[symbols[group_first]]
+
+    # splice the insertions in after their anchor positions
+    all_rows = np.concatenate([positions[keep], insert_rows])
+    all_offsets = np.concatenate([np.zeros(keep.sum(), dtype=np.int64),
+                                  insert_offsets + 1])
+    all_calls = np.concatenate([calls[keep], insert_calls])
+    return all_calls[np.lexsort((all_offsets, all_rows))].tobytes()
+
+
+def write_fasta(
+    handle: TextIO,
+    name: str,
+    chunks: Iterable[Union[bytes, str]],
+    line_width: int = 60
+) -> int:
+    """Write a FASTA record from a stream of sequence chunks.
+
+    Lines are wrapped at line_width as the chunks arrive.
+
+    Only one partial line is held in memory, so a consensus can be written
+    window by window. Returns the number of bases written.
+
+    >>>> with open('consensus.fa', 'w') as handle:
+    >>>>     windows = (depth_matrix(batch, start, start + 10_000)
+    ....                for start in range(0, 9719, 10_000))
+    >>>>     chunks = (consensus_sequence(pileup) for pileup in windows)
+    >>>>     write_fasta(handle, 'consensus', chunks)
+    """
+    handle.write(f'>{name}\n')
+    pending, total = '', 0
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode('ascii')
+        total += len(chunk)
+        pending += chunk
+        full = len(pending) - len(pending) % line_width
+        for start in range(0, full, line_width):
+            handle.write(pending[start:start + line_width] + '\n')
+        pending = pending[full:]
+    if pending:
+        handle.write(pending + '\n')
+    return total
@@ -6,8 +6,11 @@ __copyright__ = """Copyright (C) 2022-present
 __author__ = "Will Dampier, PhD"
 
 from typing import List, Tuple, Iterator, Optional, Union
+import numpy as np
+from cigarmath.batch import CigarBatch, ragged_range
 from cigarmath.block import reference_block
 from cigarmath.block import reference_mapping_blocks
+from cigarmath.block import reference_mapping_blocks_batch
 from cigarmath.clipping import left_clipping
 from cigarmath.clipping import right_clipping
 from cigarmath.clipping import declip
@@ -64,6 +67,153 @@ def segments_to_binary(
     return mapping
 
 
+def segments_to_bitmatrix(
+    batch: CigarBatch,
+    max_genome_size: int = 10_000,
+    deletion_size: int = 50,
+    chunk_bytes: int = 1 << 22
+) -> np.ndarray:
+    """Per-read segments_to_binary: a bit-packed reads x reference matrix.
+
+    Row i holds the reference_mapping_blocks of read i (split by deletions
+    of at least deletion_size) packed 8 positions per byte as by
+    np.packbits, so position p of read i is bit (7 - p % 8) of
+    matrix[i, p // 8]. Bits are written straight into the packed rows:
+    the partial bytes at the ends of each block are OR-ed in with masks
+    and the bytes between them are filled whole, chunk_bytes of them at a
+    time, so no dense per-position array is ever built.
+
+    POS0    000000000011111111112222222222333333333
+    POS1    012345678901234567890123456789012345678
+    QRY1    AAAAGA-----GAC
+    QRY2                           TGCTA---AGCTAG
+    ROW1    111111000001110000000000000000000000000
+    ROW2    000000000000000000000001111100011111100
+
+    >>>> batch = CigarBatch.from_cigarstrings([0, 23], ['6M5D3M', '5M3D6M'])
+    >>>> matrix = segments_to_bitmatrix(batch, max_genome_size=38,
+    ....                                deletion_size=4)
+    >>>> np.unpackbits(matrix, axis=1)
+    """
+    read_index, block_start, block_end = reference_mapping_blocks_batch(
+        batch, deletion_split=deletion_size
+    )
+    block_start = np.clip(block_start, 0, max_genome_size)
+    block_end = np.clip(block_end, 0, max_genome_size)
+    nonempty = block_end > block_start
+    read_index = read_index[nonempty]
+    block_start, block_end = block_start[nonempty], block_end[nonempty]
+
+    num_bytes = (max_genome_size + 7) // 8
+    matrix = np.zeros((len(batch), num_bytes), dtype=np.uint8)
+    flat = matrix.reshape(-1)
+    row_offset = read_index * num_bytes
+
+    # masks of the first and last byte of every block; one byte blocks get both
+    first_byte, last_byte = block_start // 8, (block_end - 1) // 8
+    head_mask = (0xFF >> (block_start % 8)).astype(np.uint8)
+    tail_mask = ((0xFF << (7 - (block_end - 1) % 8)) & 0xFF).astype(np.uint8)
+    single = first_byte == last_byte
+    head_mask[single] &= tail_mask[single]
+    np.bitwise_or.at(flat, row_offset + first_byte, head_mask)
+    np.bitwise_or.at(flat, (row_offset + last_byte)[~single],
+                     tail_mask[~single])
+
+    # whole bytes in between, expanded a bounded number at a time
+    inner_start = row_offset + first_byte + 1
+    inner_length = np.maximum(last_byte - first_byte - 1, 0)
+    bounds = np.searchsorted(np.cumsum(inner_length),
+                             np.arange(chunk_bytes, inner_length.sum(),
+                                       chunk_bytes))
+    firsts = np.concatenate([[0], bounds])
+    lasts = np.concatenate([bounds, [len(inner_length)]])
+    for first, last in zip(firsts, lasts):
+        inner = ragged_range(inner_start[first:last], inner_length[first:last])
+        flat[inner] = 0xFF
+
+    return matrix
+
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    "Number of set bits of every uint64 word"
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return POPCOUNT_LUT[words[..., None].view(np.uint8)].sum(axis=-1)
+
+
+# set bits of every byte value, for NumPy versions without bitwise_count
+POPCOUNT_LUT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1)
+POPCOUNT_LUT = POPCOUNT_LUT.sum(axis=1).astype(np.uint8)
+
+
+def _as_words(matrix: np.ndarray) -> np.ndarray:
+    "View the rows of a bit-packed matrix as uint64 words, zero padding rows"
+    padding = -matrix.shape[1] % 8
+    if padding:
+        matrix = np.pad(matrix, ((0, 0), (0, padding)))
+    return np.ascontiguousarray(matrix).view(np.uint64)
+
+
+def bitmatrix_jaccard(
+    matrix_a: np.ndarray,
+    matrix_b: Optional[np.ndarray] = None,
+    chunk_size: int = 1024,
+    min_similarity: Optional[float] = None
+) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Jaccard similarity of every row of matrix_a with every row of matrix_b.
+
+    Works directly on bit-packed rows (e.g. from segments_to_bitmatrix):
+    intersections and unions are popcounts of AND/OR-ed 64 bit words, so
+    rows are never unpacked. matrix_b defaults to matrix_a. Two empty rows
+    have a similarity of 1. Deduplicating rows first (e.g. with np.unique
+    on axis=0) keeps the pairwise work down when patterns repeat.
+
+    The result is a dense len(a) x len(b) float64 matrix. For many rows pass
+    min_similarity instead to get a sparse (index_a, index_b, similarity)
+    table of the pairs reaching it; rows are then compared chunk_size at a
+    time and only the kept pairs are stored.
+
+    >>>> matrix = segments_to_bitmatrix(batch, max_genome_size=38,
+    ....                                deletion_size=4)
+    >>>> bitmatrix_jaccard(matrix)
+    [[1. 0.]
+     [0. 1.]]
+    >>>> bitmatrix_jaccard(matrix, min_similarity=0.5)
+    ([0 1], [0 1], [1. 1.])
+    """
+    words_a = _as_words(matrix_a)
+    words_b = words_a if matrix_b is None else _as_words(matrix_b)
+    ones_a = _popcount(words_a).sum(axis=1, dtype=np.int64)
+    ones_b = _popcount(words_b).sum(axis=1, dtype=np.int64)
+
+    chunks = []
+    for first in range(0, len(words_a), chunk_size):
+        chunk = words_a[first:first + chunk_size]
+        intersection = np.zeros((len(chunk), len(words_b)), dtype=np.int64)
+        for word in range(words_a.shape[1]):
+            both = chunk[:, word, None] & words_b[None, :, word]
+            intersection += _popcount(both)
+        union = (ones_a[first:first + chunk_size, None] + ones_b[None, :]
+                 - intersection)
+        similarity = np.ones(intersection.shape, dtype=np.float64)
+        np.divide(intersection, union, out=similarity, where=union > 0)
+
+        if min_similarity is None:
+            chunks.append(similarity)
+        else:
+            rows, columns = np.nonzero(similarity >= min_similarity)
+            chunks.append((rows + first, columns, similarity[rows, columns]))
+
+    if min_similarity is None:
+        if not chunks:
+            return np.ones((0, len(words_b)), dtype=np.float64)
+        return np.concatenate(chunks)
+    if not chunks:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.float64))
+    return tuple(np.concatenate(column) for column in zip(*chunks))
+
+
 def cigartuples2pairs(
     cigartuples: CigarTuples, 
     reference_start: int = 0, 
@@ -98,6 +98,20 @@ BAM_CEQUAL = 7  # =
 BAM_CDIFF = 8  # X
 BAM_CBACK = 9  # B
 
+# SAM FLAG bits
+BAM_FPAIRED = 0x1  # template has multiple segments
+BAM_FPROPER_PAIR = 0x2  # each segment properly aligned
+BAM_FUNMAP = 0x4  # segment unmapped
+BAM_FMUNMAP = 0x8  # next segment unmapped
+BAM_FREVERSE = 0x10  # SEQ reverse complemented
+BAM_FMREVERSE = 0x20  # SEQ of next segment reverse complemented
+BAM_FREAD1 = 0x40  # first segment in the template
+BAM_FREAD2 = 0x80  # last segment in the template
+BAM_FSECONDARY = 0x100  # secondary alignment
+BAM_FQCFAIL = 0x200  # not passing quality controls
+BAM_FDUP = 0x400  # PCR or optical duplicate
+BAM_FSUPPLEMENTARY = 0x800  # supplementary alignment
+
 
 # Copyright (C) 2022-present, Dampier & DV Klopfenstein, PhD. All rights reserved
 
@@ -0,0 +1,157 @@
+"""Position index over reference blocks for fast overlap queries"""
+
+__copyright__ = """Copyright (C) 2022-present
+    Dampier & DV Klopfenstein, PhD.
+    All rights reserved"""
+__author__ = "Will Dampier, PhD"
+
+from typing import Optional, Tuple
+import numpy as np
+from cigarmath.batch import CigarBatch, ragged_range
+from cigarmath.block import reference_block_batch
+
+
+class BlockIndex:
+    """Index of (start, end) reference blocks for O(log n) overlap queries.
+
+    Blocks are sorted by start and paired with the running maximum of their
+    ends. For a query [start, end) every candidate lies between the first
+    block whose running maximum end passes start and the last block that
+    starts before end; both bounds come from a binary search.
+
+    POS0  000000000011111111112222222222
+    POS1  012345678901234567890123456789
+
+    BLK0    ----------
+    BLK1         ------
+    BLK2                    --------
+    QRY              ---
+
+    >>>> index = BlockIndex(np.array([2, 7, 20]), np.array([12, 13, 28]))
+    >>>> index.overlapping(11, 14)
+    [0 1]
+    """
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray):
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        self.order = np.argsort(starts, kind='stable')
+        self.starts = starts[self.order]
+        self.ends = ends[self.order]
+        self.max_ends = self.ends
+        if len(self.ends):
+            self.max_ends = np.maximum.accumulate(self.ends)
+
+    @classmethod
+    def from_batch(cls, batch: CigarBatch) -> "BlockIndex":
+        "Index the reference_block of every read in a batch"
+        return cls(*reference_block_batch(batch))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def overlapping(self, start: int, end: int) -> np.ndarray:
+        """Indices (in construction order) of blocks overlapping [start, end).
+
+        Results are ordered by block start, so a sorted batch stays sorted:
+
+        >>>> index = BlockIndex.from_batch(batch)
+        >>>> reads = batch.take(index.overlapping(1000, 2000))
+        """
+        _, block_index = self.overlap_join(np.array([start]), np.array([end]))
+        return block_index
+
+    def overlap_join(
+        self,
+        starts: np.ndarray,
+        ends: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Find every overlapping (query, block) pair for many queries at once.
+
+        Returns (query_index, block_index) arrays, grouped by query and
+        ordered by block start within each query. Empty blocks and empty
+        queries overlap nothing.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+
+        first = np.searchsorted(self.max_ends, starts, side='right')
+        last = np.searchsorted(self.starts, ends, side='left')
+        counts = np.maximum(last - first, 0)
+
+        candidates = ragged_range(first, counts)
+        query_index = np.repeat(np.arange(len(starts)), counts)
+        hits = ((self.ends[candidates] > starts[query_index])
+                & (self.ends[candidates] > self.starts[candidates])
+                & (ends > starts)[query_index])
+
+        return query_index[hits], self.order[candidates[hits]]
+
+
+def overlap_join(
+    starts_a: np.ndarray,
+    ends_a: np.ndarray,
+    starts_b: Optional[np.ndarray] = None,
+    ends_b: Optional[np.ndarray] = None,
+    min_overlap: int = 1
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized block_overlap_length over every pair of blocks from two sets.
+
+    Returns (index_a, index_b, overlap_length) for each pair whose overlap
+    is at least min_overlap, grouped by index_a and ordered by the start of
+    b within each group. Like block_overlap_length, a negative min_overlap
+    also pairs blocks that are up to that distance apart. Without b, the a
+    blocks are joined against themselves and each pair is reported once
+    with index_a < index_b. Empty blocks are never paired.
+
+    The b blocks are split into classes of similar length (powers of two)
+    and each class gets its own BlockIndex, so a long block only widens the
+    candidate range of its own class. Within a class the candidates that
+    miss a query all cover one position shortly before it, so the work is
+    the number of hits plus the coverage depth of each class rather than
+    len(a) * len(b). It still degrades when a class is very deep, e.g. many
+    long blocks piled on the same positions.
+
+    POS0  000000000011111111112222222222
+    POS1  012345678901234567890123456789
+
+    A0        ----------
+    B0              ----------
+    B1                          ----
+
+    >>>> overlap_join([4], [14], [10, 28], [20, 32])
+    ([0], [0], [4])
+    >>>> overlap_join([4], [14], [10, 28], [20, 32], min_overlap=-14)
+    ([0 0], [0 1], [  4 -14])
+    """
+    starts_a = np.asarray(starts_a, dtype=np.int64)
+    ends_a = np.asarray(ends_a, dtype=np.int64)
+    self_join = starts_b is None
+    if self_join:
+        starts_b, ends_b = starts_a, ends_a
+    starts_b = np.asarray(starts_b, dtype=np.int64)
+    ends_b = np.asarray(ends_b, dtype=np.int64)
+
+    # widen the queries so blocks within reach of min_overlap
+    # count as overlapping
+    slack = max(1 - min_overlap, 0)
+    length_class = np.frexp(np.maximum(ends_b - starts_b, 1))[1]
+    index_a = [np.empty(0, dtype=np.int64)]
+    index_b = [np.empty(0, dtype=np.int64)]
+    for size in np.unique(length_class):
+        members = np.flatnonzero(length_class == size)
+        index = BlockIndex(starts_b[members], ends_b[members])
+        query_index, block_index = index.overlap_join(starts_a - slack,
+                                                      ends_a + slack)
+        index_a.append(query_index)
+        index_b.append(members[block_index])
+    index_a, index_b = np.concatenate(index_a), np.concatenate(index_b)
+    order = np.lexsort((index_b, starts_b[index_b], index_a))
+    index_a, index_b = index_a[order], index_b[order]
+
+    overlap_length = (np.minimum(ends_a[index_a], ends_b[index_b])
+                      - np.maximum(starts_a[index_a], starts_b[index_b]))
+    keep = (overlap_length >= min_overlap) & (ends_a > starts_a)[index_a]
+    if self_join:
+        keep &= index_a < index_b
+    return index_a[keep], index_b[keep], overlap_length[keep]
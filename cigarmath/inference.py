@@ -5,10 +5,20 @@ __copyright__ = """Copyright (C) 2022-present
     All rights reserved"""
 __author__ = "Will Dampier, PhD"
 
+from dataclasses import dataclass
+import numpy as np
+from cigarmath.batch import CigarBatch
 from cigarmath.defn import (
     CigarTuples,
     CONSUMES_QUERY,
-    CONSUMES_REFERENCE
+    CONSUMES_REFERENCE,
+    CLIPPING,
+    BAM_CMATCH,
+    BAM_CINS,
+    BAM_CDEL,
+    BAM_CHARD_CLIP,
+    BAM_CEQUAL,
+    BAM_CDIFF,
 )
 
 def inferred_query_sequence_length(cigartuples: CigarTuples) -> int:
@@ -45,3 +55,104 @@ def inferred_reference_length(cigartuples: CigarTuples) -> int:
         for bam_num, block_size in cigartuples
         if bam_num in CONSUMES_REFERENCE
     )
+
+
+@dataclass
+class AlignmentStats:
+    """Columnar per-read alignment statistics, see alignment_stats.
+
+    op_counts and op_lengths are (reads, 16) arrays holding the number of
+    ops and the number of bases of each op type (indexed by BAM op code).
+    """
+    query_length: np.ndarray
+    reference_length: np.ndarray
+    aligned_length: np.ndarray
+    op_counts: np.ndarray
+    op_lengths: np.ndarray
+    insertions: np.ndarray
+    insertion_length: np.ndarray
+    deletions: np.ndarray
+    deletion_length: np.ndarray
+    left_clipping: np.ndarray
+    right_clipping: np.ndarray
+    clip_fraction: np.ndarray
+    identity: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.query_length)
+
+
+def alignment_stats(batch: CigarBatch) -> AlignmentStats:
+    """Compute per-read alignment statistics for a batch in one pass.
+
+    A single bincount over (read, op) gives the number of ops and bases of
+    every op type per read; everything else is derived from those two
+    tables and the first/last op of each read.
+
+    query_length      inferred_query_sequence_length
+    reference_length  inferred_reference_length
+    aligned_length    bases in M/=/X ops
+    left_clipping     left_clipping (soft or hard) of the first op
+    right_clipping    right_clipping (soft or hard) of the last op
+    clip_fraction     (left_clipping + right_clipping)
+                      / (query_length + hard clips)
+    identity          = / (= + X + I + D) bases, NaN without =/X ops
+
+    POS  01234567890  12345
+    REF     AAAAGACC--CCC
+    QRY     AAAA-ACCGGCCC
+    CGS  HHHMMMMDMMMIIMMMHHHH
+    CGT  3H 4M 1D3M 2I 3M 4H
+
+    >>>> batch = CigarBatch.from_cigarstrings([0], ['3H4M1D3M2I3M4H'])
+    >>>> stats = alignment_stats(batch)
+    >>>> (stats.query_length, stats.reference_length,
+    ....  stats.aligned_length, stats.clip_fraction)
+    [12] [11] [10] [0.36842105]
+    """
+    num_reads = len(batch)
+    bins = 16 * batch.read_index + batch.ops
+    op_counts = np.bincount(bins, minlength=16 * num_reads)
+    op_counts = op_counts.reshape(num_reads, 16)
+    op_lengths = np.bincount(bins, weights=batch.lengths,
+                             minlength=16 * num_reads)
+    op_lengths = op_lengths.astype(np.int64).reshape(num_reads, 16)
+
+    # clipping only counts when it is the first/last op, like left_clipping;
+    # the padding keeps the lookups safe for reads without ops
+    has_ops = batch.offsets[1:] > batch.offsets[:-1]
+    is_clip = np.isin(batch.ops, list(CLIPPING))
+    clip_lengths = np.append(np.where(is_clip, batch.lengths, 0), 0)
+    left_clip = np.where(has_ops, clip_lengths[batch.offsets[:-1]], 0)
+    right_clip = np.where(has_ops, clip_lengths[batch.offsets[1:] - 1], 0)
+
+    query_length = op_lengths[:, sorted(CONSUMES_QUERY)].sum(axis=1)
+    reference_length = op_lengths[:, sorted(CONSUMES_REFERENCE)].sum(axis=1)
+    aligned_ops = [BAM_CMATCH, BAM_CEQUAL, BAM_CDIFF]
+    aligned_length = op_lengths[:, aligned_ops].sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        read_length = query_length + op_lengths[:, BAM_CHARD_CLIP]
+        clipped = np.minimum(left_clip + right_clip, read_length)
+        clip_fraction = np.where(read_length > 0,
+                                 clipped / read_length, 0.0)
+        equal, diff = op_lengths[:, BAM_CEQUAL], op_lengths[:, BAM_CDIFF]
+        indels = op_lengths[:, BAM_CINS] + op_lengths[:, BAM_CDEL]
+        identity = equal / (equal + diff + indels)
+        identity = np.where(equal + diff > 0, identity, np.nan)
+
+    return AlignmentStats(
+        query_length=query_length,
+        reference_length=reference_length,
+        aligned_length=aligned_length,
+        op_counts=op_counts,
+        op_lengths=op_lengths,
+        insertions=op_counts[:, BAM_CINS],
+        insertion_length=op_lengths[:, BAM_CINS],
+        deletions=op_counts[:, BAM_CDEL],
+        deletion_length=op_lengths[:, BAM_CDEL],
+        left_clipping=left_clip,
+        right_clipping=right_clip,
+        clip_fraction=clip_fraction,
+        identity=identity,
+    )
@@ -0,0 +1,215 @@
+"""Sorted-array interval sets over reference positions"""
+
+__copyright__ = """Copyright (C) 2022-present
+    Dampier & DV Klopfenstein, PhD.
+    All rights reserved"""
+__author__ = "Will Dampier, PhD"
+
+from typing import Iterator, Optional, Tuple
+import numpy as np
+from cigarmath.batch import CigarBatch
+from cigarmath.block import reference_mapping_blocks_batch
+from cigarmath.block import reference_deletion_blocks_batch
+
+
+def _depth_runs(
+    positions: np.ndarray,
+    deltas: np.ndarray,
+    min_depth: int = 1
+) -> Tuple[np.ndarray, np.ndarray]:
+    """The (starts, ends) where the running sum of deltas is >= min_depth.
+
+    Deltas at the same position are applied together, so touching runs
+    come back merged.
+    """
+    boundaries, inverse = np.unique(positions, return_inverse=True)
+    depth = np.cumsum(np.bincount(inverse, weights=deltas,
+                                  minlength=len(boundaries)))
+
+    inside = depth >= min_depth
+    was_inside = np.concatenate([[False], inside[:-1]])
+    starts = boundaries[inside & ~was_inside]
+    ends = boundaries[~inside & was_inside]
+    return starts.astype(np.int64), ends.astype(np.int64)
+
+
+class IntervalSet:
+    """A set of reference positions as sorted, disjoint [start, end) intervals.
+
+    Overlapping and touching intervals are merged on construction, so two
+    sets holding the same positions compare equal. Set operations are
+    sweeps over the sorted boundaries of both operands and never compare
+    intervals pairwise.
+
+    POS0  000000000011111111112222222222
+    POS1  012345678901234567890123456789
+
+    A       ----------      ------
+    B            -----------------
+    A|B     ----------------------
+    A&B          -----      ------
+    A-B     -----
+    B-A               ------
+
+    >>>> a = IntervalSet([2, 18], [12, 24])
+    >>>> b = IntervalSet([7], [24])
+    >>>> list(a & b), list(a - b)
+    [(7, 12), (18, 24)] [(2, 7)]
+    """
+
+    def __init__(self, starts=(), ends=()):
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if starts.shape != ends.shape:
+            raise ValueError("starts and ends must have the same length")
+        self.starts, self.ends = _depth_runs(*self._events(starts, ends))
+
+    @staticmethod
+    def _events(
+        starts: np.ndarray,
+        ends: np.ndarray,
+        weight: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        "Boundary positions and depth changes of the non-empty intervals"
+        keep = ends > starts
+        positions = np.concatenate([starts[keep], ends[keep]])
+        deltas = np.repeat([weight, -weight], keep.sum())
+        return positions, deltas
+
+    @classmethod
+    def _from_sorted(cls, starts: np.ndarray,
+                     ends: np.ndarray) -> "IntervalSet":
+        "Wrap intervals that are already sorted, disjoint and non-touching"
+        interval_set = cls.__new__(cls)
+        interval_set.starts, interval_set.ends = starts, ends
+        return interval_set
+
+    @classmethod
+    def from_blocks(
+        cls,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        min_depth: int = 1
+    ) -> "IntervalSet":
+        """Positions covered by at least min_depth of the blocks.
+
+        The blocks may overlap.
+
+        >>>> IntervalSet.from_blocks([0, 5, 8], [10, 12, 9], min_depth=2)
+        IntervalSet([(5, 10)])
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        runs = _depth_runs(*cls._events(starts, ends), min_depth=min_depth)
+        return cls._from_sorted(*runs)
+
+    @classmethod
+    def from_batch(
+        cls,
+        batch: CigarBatch,
+        deletion_split: int = 10,
+        min_depth: int = 1
+    ) -> "IntervalSet":
+        "Positions in the reference_mapping_blocks of at least min_depth reads"
+        _, starts, ends = reference_mapping_blocks_batch(
+            batch, deletion_split=deletion_split
+        )
+        return cls.from_blocks(starts, ends, min_depth=min_depth)
+
+    @classmethod
+    def from_deletions(
+        cls,
+        batch: CigarBatch,
+        min_size: int = 1,
+        min_depth: int = 1
+    ) -> "IntervalSet":
+        "Positions deleted (or skipped) by at least min_depth reads"
+        _, starts, ends = reference_deletion_blocks_batch(batch,
+                                                          min_size=min_size)
+        return cls.from_blocks(starts, ends, min_depth=min_depth)
+
+    def _combine(
+        self,
+        other: "IntervalSet",
+        weight: int,
+        min_depth: int
+    ) -> "IntervalSet":
+        positions, deltas = self._events(self.starts, self.ends)
+        other_positions, other_deltas = self._events(other.starts, other.ends,
+                                                     weight=weight)
+        runs = _depth_runs(np.concatenate([positions, other_positions]),
+                           np.concatenate([deltas, other_deltas]),
+                           min_depth=min_depth)
+        return self._from_sorted(*runs)
+
+    def union(self, other: "IntervalSet") -> "IntervalSet":
+        "Positions in either set"
+        return self._combine(other, weight=1, min_depth=1)
+
+    def intersection(self, other: "IntervalSet") -> "IntervalSet":
+        "Positions in both sets"
+        return self._combine(other, weight=1, min_depth=2)
+
+    def difference(self, other: "IntervalSet") -> "IntervalSet":
+        "Positions in this set but not in other"
+        # inside self adds 1 and inside other subtracts 2,
+        # so only self-only positions reach 1
+        return self._combine(other, weight=-2, min_depth=1)
+
+    def complement(
+        self,
+        start: int = 0,
+        end: Optional[int] = None
+    ) -> "IntervalSet":
+        """Positions of [start, end) not in this set.
+
+        end defaults to the end of the last interval.
+        """
+        if end is None:
+            end = int(self.ends[-1]) if len(self) else start
+        return IntervalSet([start], [end]).difference(self)
+
+    def merge(self, max_gap: int = 0) -> "IntervalSet":
+        "Close the gaps of at most max_gap positions between intervals"
+        if len(self) == 0:
+            return self
+        keep_gap = (self.starts[1:] - self.ends[:-1]) > max_gap
+        starts = self.starts[np.concatenate([[True], keep_gap])]
+        ends = self.ends[np.concatenate([keep_gap, [True]])]
+        return self._from_sorted(starts, ends)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    @property
+    def lengths(self) -> np.ndarray:
+        "Length of every interval"
+        return self.ends - self.starts
+
+    def total_length(self) -> int:
+        "Number of positions in the set"
+        return int(self.lengths.sum())
+
+    def contains(self, positions: np.ndarray) -> np.ndarray:
+        "Whether each position falls inside the set"
+        positions = np.asarray(positions, dtype=np.int64)
+        candidate = np.searchsorted(self.starts, positions, side='right') - 1
+        inside = candidate >= 0
+        inside[inside] = positions[inside] < self.ends[candidate[inside]]
+        return inside
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return zip(self.starts.tolist(), self.ends.tolist())
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, IntervalSet):
+            return NotImplemented
+        return (np.array_equal(self.starts, other.starts)
+                and np.array_equal(self.ends, other.ends))
+
+    def __repr__(self) -> str:
+        return f"IntervalSet({list(self)})"
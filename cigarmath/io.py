@@ -5,11 +5,33 @@ __copyright__ = """Copyright (C) 2022-present
     All rights reserved"""
 __author__ = "Will Dampier, PhD"
 
-import random
-from itertools import groupby
-from typing import Union, Iterator, Optional, Tuple, TYPE_CHECKING, List
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import (
+    Executor, ProcessPoolExecutor, ThreadPoolExecutor
+)
+from dataclasses import dataclass
+from functools import partial
+from itertools import groupby, islice
+from typing import (
+    Union, Iterator, Optional, Tuple, TYPE_CHECKING, List, Callable, BinaryIO
+)
+import numpy as np
 from cigarmath.defn import CigarTuples
 from cigarmath.combine import combine_multiple_alignments
+from cigarmath.batch import (
+    CigarBatch,
+    parse_cigar_buffer,
+    parse_uint_fields,
+    ragged_range,
+    _offsets_from_counts,
+)
+from cigarmath.block import reference_offset_batch
 
 if TYPE_CHECKING:
     try:
@@ -17,42 +39,726 @@ if TYPE_CHECKING:
     except ImportError:
         pass
 
+
+@dataclass
+class SegmentFilter:
+    """Per-segment checks evaluated before any cigar or sequence is decoded.
+
+    flag_include: every one of these FLAG bits must be set
+    flag_exclude: none of these FLAG bits may be set
+    min_mapq: mapping_quality must be greater than this
+        (as in segment_stream_pysam)
+    min_aligned_length: minimum number of reference bases covered by the
+        alignment
+    contig: only keep segments aligned to this reference
+
+    >>> SegmentFilter(flag_exclude=BAM_FUNMAP | BAM_FSECONDARY, min_mapq=20)
+    """
+    flag_include: int = 0
+    flag_exclude: int = 0
+    min_mapq: int = 0
+    min_aligned_length: int = 0
+    contig: Optional[str] = None
+
+    def predicate(
+        self,
+        samfile: "pysam.AlignmentFile"
+    ) -> Callable[["pysam.AlignedSegment"], bool]:
+        """Return a keep/drop function bound to the header of samfile.
+
+        Checks are ordered from cheapest to most expensive; all of them read
+        fixed-size fields of the BAM record so rejected segments never have
+        their cigartuples or sequence built.
+        """
+
+        flag_include, flag_exclude = self.flag_include, self.flag_exclude
+        min_mapq, min_aligned_length = self.min_mapq, self.min_aligned_length
+        reference_id = None
+        if self.contig is not None:
+            reference_id = _contig_tid(self.contig, samfile.references)
+
+        def keep(segment: "pysam.AlignedSegment") -> bool:
+            flag = segment.flag
+            if (flag & flag_include) != flag_include or (flag & flag_exclude):
+                return False
+            if segment.mapping_quality <= min_mapq:
+                return False
+            if (reference_id is not None
+                    and segment.reference_id != reference_id):
+                return False
+            if (min_aligned_length
+                    and (segment.reference_length or 0) < min_aligned_length):
+                return False
+            return True
+
+        return keep
+
+    def mask(
+        self,
+        flags: np.ndarray,
+        mapq: np.ndarray,
+        reference_id: np.ndarray,
+        reference_names: List[str]
+    ) -> np.ndarray:
+        """Vectorized flag, mapq and contig checks over columns.
+
+        min_aligned_length needs the cigar and is checked by the caller.
+        """
+
+        keep = (flags & self.flag_include) == self.flag_include
+        keep &= (flags & self.flag_exclude) == 0
+        keep &= mapq > self.min_mapq
+        if self.contig is not None:
+            keep &= reference_id == _contig_tid(self.contig, reference_names)
+        return keep
+
+
+def _contig_tid(contig: str, reference_names: List[str]) -> int:
+    """Reference id of contig, or -2 when the header does not have it.
+
+    -1 is the reference_id of unmapped reads, so a missing contig must not
+    map to it.
+    """
+    if contig not in reference_names:
+        return -2
+    return list(reference_names).index(contig)
+
+
 def segment_stream_pysam(
     path: str,
     mode: str = 'rt',
     fetch: Optional[str] = None,
     min_mapq: int = 0,
     downsample: Optional[float] = None,
-    as_tuples: bool = False
-) -> Iterator[Union[Tuple[int, CigarTuples], "pysam.AlignedSegment"]]:
+    as_tuples: bool = False,
+    threads: int = 1,
+    regions: Optional[List[str]] = None,
+    processes: Optional[int] = None,
+    segment_filter: Optional[SegmentFilter] = None,
+    seed: int = 0,
+    batch_size: Optional[int] = None,
+    with_sequence: bool = False,
+) -> Iterator[
+    Union[Tuple[int, CigarTuples], "pysam.AlignedSegment", CigarBatch]
+]:
     """
     Yield AlignedSegments from sam/bam file with pysam.
+
+    min_mapq is a shorthand for SegmentFilter(min_mapq=min_mapq); pass a
+    segment_filter for flag, length and contig filtering. Filtering happens
+    before downsampling and before cigartuples are built.
+
+    downsample keeps the given fraction of reads chosen by a hash of
+    query_name and seed (see hash_fraction), so the same reads are kept on
+    every run, in every region and for every segment of a read.
+
+    When batch_size is set, segments with cigartuples are collected into
+    CigarBatch objects of up to batch_size reads instead; sequences and
+    qualities are only decoded when with_sequence is set.
+
+    threads sets the number of BGZF decompression threads used by pysam.
+
+    When regions are given (an indexed, coordinate-sorted file is required)
+    they are read in coordinate order and every segment overlapping any of
+    them is yielded once, in coordinate order, however the regions overlap.
+    Batches never span regions. With as_tuples or batch_size the regions
+    are read by a pool of `processes` workers that return CigarBatches;
+    AlignedSegments are read by a pool of threads instead.
     """
 
     import pysam
 
-    with pysam.AlignmentFile(path, mode, check_sq=False) as samfile:
+    if segment_filter is None:
+        segment_filter = SegmentFilter(min_mapq=min_mapq)
+    elif min_mapq:
+        raise ValueError('Provide min_mapq through segment_filter, not both')
+
+    if regions:
+        yield from _region_parallel_stream(
+            path, mode, regions, segment_filter, downsample, seed, as_tuples,
+            threads, processes, batch_size=batch_size,
+            with_sequence=with_sequence
+        )
+        return
+
+    if batch_size:
+        segments = segment_stream_pysam(
+            path, mode, fetch=fetch, downsample=downsample, threads=threads,
+            segment_filter=segment_filter, seed=seed
+        )
+        yield from _batch_segments(segments, batch_size, with_sequence)
+        return
+
+    with pysam.AlignmentFile(path, mode, check_sq=False,
+                             threads=threads) as samfile:
         iterable = samfile
         
         if fetch:
-            iterable = iterable.fetch(fetch)
+            iterable = iterable.fetch(region=fetch)
+        elif segment_filter.contig and samfile.has_index():
+            if segment_filter.contig in samfile.references:
+                iterable = iterable.fetch(segment_filter.contig)
+            else:
+                iterable = iter(())
+
+        iterable = filter(segment_filter.predicate(samfile), iterable)
             
         if downsample:
-            iterable = _downsample(iterable, downsample)
+            iterable = _downsample(iterable, downsample, seed)
         
         for segment in iterable:
-            if segment.mapping_quality > min_mapq:
-                if as_tuples:
-                    if segment.cigartuples:
-                        yield (segment.reference_start, segment.cigartuples)
+            if as_tuples:
+                if segment.cigartuples:
+                    yield (segment.reference_start, segment.cigartuples)
+            else:
+                yield segment
+
+
+def _region_tasks(
+    path: str,
+    mode: str,
+    regions: List[str]
+) -> List[Tuple[str, int]]:
+    """Sort regions by coordinate and pair each with skip_before.
+
+    skip_before is the furthest end of the earlier regions on the same
+    contig: a segment of the region starting before it overlaps one of
+    those regions and was already yielded there.
+
+    REGION0   ----------
+    REGION1        ----------
+    READ0         ---            yielded by REGION0 only
+    READ1                ----    yielded by REGION1
+    """
+
+    import pysam
+
+    with pysam.AlignmentFile(path, mode, check_sq=False) as samfile:
+        parsed = sorted((samfile.parse_region(region=region)[1:], num)
+                        for num, region in enumerate(regions))
+
+    tasks, contig_tid, reached = [], None, 0
+    for (tid, _, stop), num in parsed:
+        if tid != contig_tid:
+            contig_tid, reached = tid, 0
+        tasks.append((regions[num], reached))
+        reached = max(reached, stop)
+    return tasks
+
+
+def _region_segments(
+    path: str,
+    mode: str,
+    region: str,
+    skip_before: int,
+    segment_filter: SegmentFilter,
+    downsample: Optional[float],
+    seed: int,
+    threads: int,
+) -> Iterator["pysam.AlignedSegment"]:
+    """Segments of one region that start at or after skip_before."""
+
+    # Each region re-uses the serial reader so both paths filter identically
+    stream = segment_stream_pysam(
+        path, mode, fetch=region, segment_filter=segment_filter,
+        downsample=downsample, seed=seed, as_tuples=False, threads=threads
+    )
+    return (segment for segment in stream
+            if segment.reference_start >= skip_before)
+
+
+def _fetch_region(
+    path: str,
+    mode: str,
+    region: str,
+    skip_before: int,
+    segment_filter: SegmentFilter,
+    downsample: Optional[float],
+    seed: int,
+    threads: int,
+    batch_size: Optional[int],
+    with_sequence: bool,
+) -> List[CigarBatch]:
+    """Process worker: fetch one region into CigarBatches of batch_size reads.
+
+    Only the columnar arrays cross the process boundary; a region without
+    batch_size comes back as a single batch.
+    """
+    stream = _region_segments(path, mode, region, skip_before, segment_filter,
+                              downsample, seed, threads)
+    return list(_batch_segments(stream, batch_size, with_sequence))
+
+
+def _fetch_region_segments(
+    path: str,
+    mode: str,
+    region: str,
+    skip_before: int,
+    segment_filter: SegmentFilter,
+    downsample: Optional[float],
+    seed: int,
+    threads: int,
+) -> List["pysam.AlignedSegment"]:
+    """Thread worker: fetch the AlignedSegments of one region.
+
+    Every thread opens its own file handle.
+    """
+    return list(_region_segments(path, mode, region, skip_before,
+                                 segment_filter, downsample, seed, threads))
+
+
+def _ordered_map(
+    executor: Executor,
+    worker: Callable,
+    tasks: List[Tuple],
+    window: int
+) -> Iterator:
+    """Like executor.map, but with only window tasks in flight at a time.
+
+    Results are yielded in task order as they arrive.
+
+    Every task is a tuple of positional arguments for worker.
+    """
+    tasks = iter(tasks)
+    pending = deque(executor.submit(worker, *task)
+                    for task in islice(tasks, window))
+    while pending:
+        result = pending.popleft().result()
+        for task in islice(tasks, 1):
+            pending.append(executor.submit(worker, *task))
+        yield result
+
+
+def _region_parallel_stream(
+    path: str,
+    mode: str,
+    regions: List[str],
+    segment_filter: SegmentFilter,
+    downsample: Optional[float],
+    seed: int,
+    as_tuples: bool,
+    threads: int,
+    processes: Optional[int],
+    batch_size: Optional[int] = None,
+    with_sequence: bool = False,
+) -> Iterator[
+    Union[Tuple[int, CigarTuples], "pysam.AlignedSegment", CigarBatch]
+]:
+    """Stream regions in coordinate order, fetching them in a pool.
+
+    Workers build the CigarBatches themselves and at most two regions per
+    worker are held at once. AlignedSegments are tied to their file and
+    cannot be sent between processes, so without as_tuples or batch_size
+    the regions are read by threads, each with its own file handle; pysam
+    releases the GIL while it decompresses and decodes records.
+    """
+
+    tasks = _region_tasks(path, mode, regions)
+    processes = processes or os.cpu_count() or 1
+    options = dict(segment_filter=segment_filter, downsample=downsample,
+                   seed=seed, threads=threads)
+
+    if not (as_tuples or batch_size):
+        worker = partial(_fetch_region_segments, path, mode, **options)
+        with ThreadPoolExecutor(max_workers=processes) as executor:
+            ordered = _ordered_map(executor, worker, tasks, 2 * processes)
+            for segments in ordered:
+                yield from segments
+        return
+
+    worker = partial(_fetch_region, path, mode, batch_size=batch_size,
+                     with_sequence=with_sequence, **options)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        ordered = _ordered_map(executor, worker, tasks, 2 * processes)
+        for batches in ordered:
+            for batch in batches:
+                if batch_size:
+                    yield batch
                 else:
-                    yield segment
+                    yield from batch
+
+
+def sam_batch_stream(
+    source: Union[str, BinaryIO],
+    batch_size: int = 65_536,
+    with_sequence: bool = False,
+    segment_filter: Optional[SegmentFilter] = None,
+    downsample: Optional[float] = None,
+    seed: int = 0,
+    block_size: int = 1 << 24,
+) -> Iterator[CigarBatch]:
+    """Yield CigarBatches from SAM text without pysam.
+
+    source is a path or a binary handle (e.g. sys.stdin.buffer when piping
+    from an aligner). The text is read in blocks of block_size bytes and
+    every block is split into columns with NumPy: only QNAME, FLAG, RNAME,
+    POS, MAPQ and CIGAR (plus SEQ and QUAL with with_sequence) are
+    extracted and all cigarstrings of a block are parsed together.
+
+    Records without a CIGAR are skipped, as with batch_size in
+    segment_stream_pysam. Filters and downsampling behave the same way.
+
+    >>>> for batch in sam_batch_stream(sys.stdin.buffer, batch_size=10_000):
+    ....     print(len(batch))
+    """
+
+    if segment_filter is None:
+        segment_filter = SegmentFilter()
+
+    if isinstance(source, str):
+        handle = open(source, 'rb')
+    else:
+        handle = getattr(source, 'buffer', source)
+    try:
+        reference_names: List[str] = []
+        pending: List[CigarBatch] = []
+        pending_reads = 0
+
+        for block in _sam_blocks(handle, block_size):
+            batch = _parse_sam_block(
+                block, reference_names, with_sequence, segment_filter,
+                downsample, seed
+            )
+            pending.append(batch)
+            pending_reads += len(batch)
+
+            while pending_reads >= batch_size:
+                joined = CigarBatch.concatenate(pending)
+                yield joined[:batch_size]
+                pending = [joined[batch_size:]]
+                pending_reads = len(pending[0])
+
+        if pending_reads:
+            yield CigarBatch.concatenate(pending)
+    finally:
+        if isinstance(source, str):
+            handle.close()
+
+
+def _sam_blocks(handle: BinaryIO, block_size: int) -> Iterator[bytes]:
+    """Read a handle in large blocks that always end on a complete line."""
+    remainder = b''
+    while True:
+        block = handle.read(block_size)
+        if not block:
+            break
+        block = remainder + block
+        cut = block.rfind(b'\n') + 1
+        remainder = block[cut:]
+        if cut:
+            yield block[:cut]
+    if remainder:
+        yield remainder + b'\n'
+
+
+# SAM columns used by the text reader
+_QNAME, _FLAG, _RNAME, _POS, _MAPQ, _CIGAR = 0, 1, 2, 3, 4, 5
+_SEQ, _QUAL = 9, 10
+
+
+def _parse_sam_block(
+    block: bytes,
+    reference_names: List[str],
+    with_sequence: bool,
+    segment_filter: SegmentFilter,
+    downsample: Optional[float],
+    seed: int,
+) -> CigarBatch:
+    """Parse a block of complete SAM lines into a CigarBatch.
+
+    Header @SQ lines extend reference_names in place.
+    """
+
+    buf = np.frombuffer(block, dtype=np.uint8)
+    line_ends = np.flatnonzero(buf == ord('\n'))
+    line_starts = np.concatenate([[0], line_ends[:-1] + 1])
+
+    is_header = buf[line_starts] == ord('@')
+    header_starts = line_starts[is_header].tolist()
+    header_ends = line_ends[is_header].tolist()
+    for start, end in zip(header_starts, header_ends):
+        fields = block[start:end].decode().rstrip('\r').split('\t')
+        if fields[0] == '@SQ':
+            tags = dict(field.split(':', 1)
+                        for field in fields[1:] if ':' in field)
+            reference_names.append(tags['SN'])
+
+    is_record = ~is_header & (line_ends > line_starts)
+    line_starts, line_ends = line_starts[is_record], line_ends[is_record]
+
+    # (read, column) start and end of every needed field, clamped to its line
+    n_columns = _QUAL + 1 if with_sequence else _CIGAR + 1
+    tabs = np.concatenate([np.flatnonzero(buf == ord('\t')),
+                           np.full(n_columns, len(buf))])
+    first_tab = np.searchsorted(tabs, line_starts)
+    field_ends = np.minimum(tabs[first_tab[:, None] + np.arange(n_columns)],
+                            line_ends[:, None])
+    field_starts = np.column_stack([line_starts, field_ends[:, :-1] + 1])
+
+    def column(num):
+        return field_starts[:, num], field_ends[:, num]
+
+    flags = parse_uint_fields(buf, *column(_FLAG)).astype(np.uint16)
+    mapq = parse_uint_fields(buf, *column(_MAPQ)).astype(np.uint8)
+    rnames = _fixed_width_fields(buf, *column(_RNAME))
+    reference_id = _reference_ids(rnames, reference_names)
+
+    cigar_starts, cigar_ends = column(_CIGAR)
+    is_star = buf[cigar_starts] == ord('*')
+    no_cigar = (cigar_ends - cigar_starts == 1) & is_star
+    passed = segment_filter.mask(flags, mapq, reference_id, reference_names)
+    keep = np.flatnonzero(~no_cigar & passed)
+
+    qname_starts, qname_ends = [col[keep] for col in column(_QNAME)]
+    names = _fixed_width_fields(buf, qname_starts, qname_ends)
+    names = names.astype(str).tolist()
+    if downsample:
+        sampled = [num for num, name in enumerate(names)
+                   if hash_fraction(name, seed) < downsample]
+        keep, names = keep[sampled], [names[num] for num in sampled]
+
+    chars, cigar_offsets = _gather_fields(buf, cigar_starts[keep],
+                                          cigar_ends[keep])
+    ops, lengths, offsets = parse_cigar_buffer(chars, cigar_offsets)
+    batch = CigarBatch(
+        reference_start=parse_uint_fields(
+            buf, *[col[keep] for col in column(_POS)]
+        ) - 1,
+        ops=ops,
+        lengths=lengths,
+        offsets=offsets,
+        reference_id=reference_id[keep],
+        flags=flags[keep],
+        mapq=mapq[keep],
+        query_name=names,
+    )
+
+    if segment_filter.min_aligned_length:
+        aligned_length = reference_offset_batch(batch)
+        long_enough = aligned_length >= segment_filter.min_aligned_length
+        batch, keep = batch.take(long_enough), keep[long_enough]
+
+    if with_sequence:
+        _attach_sam_sequences(batch, buf, column(_SEQ), column(_QUAL), keep)
+
+    return batch
+
+
+def _attach_sam_sequences(
+    batch: CigarBatch,
+    buf: np.ndarray,
+    seq_column: Tuple[np.ndarray, np.ndarray],
+    qual_column: Tuple[np.ndarray, np.ndarray],
+    keep: np.ndarray
+) -> None:
+    """Gather SEQ and QUAL of the kept reads; '*' becomes empty or 255s."""
+
+    seq_starts, seq_ends = seq_column[0][keep], seq_column[1][keep]
+    qual_starts, qual_ends = qual_column[0][keep], qual_column[1][keep]
+
+    no_seq = (seq_ends - seq_starts == 1) & (buf[seq_starts] == ord('*'))
+    seq_ends = np.where(no_seq, seq_starts, seq_ends)
+    batch.sequence, batch.sequence_offsets = _gather_fields(
+        buf, seq_starts, seq_ends
+    )
+
+    seq_lengths = seq_ends - seq_starts
+    has_qual = (qual_ends - qual_starts) == seq_lengths
+    qual_chars, _ = _gather_fields(buf, qual_starts[has_qual],
+                                   qual_ends[has_qual])
+    if has_qual.all():
+        batch.qualities = qual_chars - 33
+    else:
+        batch.qualities = np.full(len(batch.sequence), 255, dtype=np.uint8)
+        batch.qualities[np.repeat(has_qual, seq_lengths)] = qual_chars - 33
+
+
+def _gather_fields(
+    buf: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenate buf[start:end] of every field into ragged (values, offsets).
+
+    Short fields are gathered with one flat index array; long fields
+    (sequences of long reads) are copied as slices, where building a
+    per-byte index would cost more than the copy itself.
+    """
+    counts = ends - starts
+    offsets = _offsets_from_counts(counts)
+    if len(counts) and (offsets[-1] >= _LONG_FIELD * len(counts)):
+        fields = zip(starts.tolist(), ends.tolist())
+        values = np.concatenate([buf[start:end] for start, end in fields])
+    else:
+        values = buf[ragged_range(starts, counts)]
+    return values, offsets
+
+
+# Average field length above which _gather_fields copies slices
+_LONG_FIELD = 256
+
+
+def _fixed_width_fields(
+    buf: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray
+) -> np.ndarray:
+    """Copy variable-length fields into a fixed-width bytes array at once."""
+    counts = ends - starts
+    width = max(int(counts.max()) if len(counts) else 0, 1)
+    columns = np.arange(width)
+    matrix = buf[np.minimum(starts[:, None] + columns, len(buf) - 1)]
+    matrix[columns >= counts[:, None]] = 0
+    return np.ascontiguousarray(matrix).view(f'S{width}').ravel()
+
+
+def _reference_ids(
+    rnames: np.ndarray,
+    reference_names: List[str]
+) -> np.ndarray:
+    """Convert RNAME values into header reference ids.
+
+    '*' and names missing from the header become -1.
+    """
+    lookup = {name: num for num, name in enumerate(reference_names)}
+    unique, inverse = np.unique(rnames, return_inverse=True)
+    ids = np.array([lookup.get(name.decode(), -1) for name in unique.tolist()],
+                   dtype=np.int32)
+    return ids[inverse.ravel()] if len(unique) else np.zeros(0, dtype=np.int32)
+
+
+# Columns stored by cached_batch; bump _CACHE_VERSION when this changes
+_CACHE_COLUMNS = ('reference_start', 'ops', 'lengths', 'offsets',
+                  'reference_id', 'flags', 'mapq')
+_CACHE_VERSION = 1
+
+
+def cached_batch(
+    path: str,
+    mode: str = 'rb',
+    cache_dir: Optional[str] = None,
+    threads: int = 1,
+) -> CigarBatch:
+    """Return every aligned segment of a sam/bam file as a memory-mapped batch.
+
+    The first call decodes the file and stores reference_start, the ragged
+    ops/lengths, reference_id, flags and mapq as .npy files in a directory
+    next to the file (or under cache_dir). Later calls memory-map those
+    arrays and return immediately. The cache is rebuilt whenever the size
+    or modification time of the file changes.
+
+    Nothing is filtered out (besides segments without a cigar), so select
+    reads with the flags and mapq columns:
+
+    >>>> batch = cached_batch('sample.bam')
+    >>>> primary = batch.take((batch.flags & 0x900) == 0)
+    """
+
+    location = _cache_location(path, cache_dir)
+    stat = os.stat(path)
+    meta = {'version': _CACHE_VERSION, 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns}
+
+    if _read_cache_meta(location) != meta:
+        stream = segment_stream_pysam(
+            path, mode, threads=threads,
+            segment_filter=SegmentFilter(min_mapq=-1), batch_size=1 << 16
+        )
+        batches = list(stream)
+        if batches:
+            batch = CigarBatch.concatenate(batches)
+        else:
+            batch = CigarBatch.from_segments([])
+        _write_cache(location, batch, meta)
+
+    columns = {
+        column: np.load(os.path.join(location, column + '.npy'), mmap_mode='r')
+        for column in _CACHE_COLUMNS
+    }
+    return CigarBatch(**columns)
+
+
+def _cache_location(path: str, cache_dir: Optional[str]) -> str:
+    """Cache directory for path.
+
+    It sits alongside path, or in cache_dir keyed by the absolute path.
+    """
+    if cache_dir is None:
+        return path + '.cigarmath'
+    key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f'{os.path.basename(path)}.{key}.cigarmath')
+
+
+def _read_cache_meta(location: str) -> Optional[dict]:
+    """Return the stored metadata of a cache, or None without a usable one."""
+    try:
+        with open(os.path.join(location, 'meta.json')) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache(location: str, batch: CigarBatch, meta: dict) -> None:
+    """Write the cache to a temporary directory then swap it into place."""
+    parent = os.path.dirname(os.path.abspath(location))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=parent, prefix='.cigarmath-')
+    for column in _CACHE_COLUMNS:
+        np.save(os.path.join(staging, column + '.npy'), getattr(batch, column))
+    # meta.json is written last so a half-written cache is never trusted
+    with open(os.path.join(staging, 'meta.json'), 'w') as handle:
+        json.dump(meta, handle)
+
+    shutil.rmtree(location, ignore_errors=True)
+    os.replace(staging, location)
+
+
+def _batch_segments(
+    segments: Iterator["pysam.AlignedSegment"],
+    batch_size: Optional[int],
+    with_sequence: bool
+) -> Iterator[CigarBatch]:
+    """Group a segment stream into CigarBatches of up to batch_size reads.
+
+    A batch_size of None puts every segment into one batch.
+    """
+    segments = (segment for segment in segments if segment.cigartuples)
+    while True:
+        chunk = list(islice(segments, batch_size))
+        if not chunk:
+            return
+        yield CigarBatch.from_segments(chunk, with_sequence=with_sequence)
+
+
+def _fmix32(value: int) -> int:
+    """MurmurHash3 32-bit finalizer; mixes every input bit into the output."""
+    value ^= value >> 16
+    value = (value * 0x85EBCA6B) & 0xFFFFFFFF
+    value ^= value >> 13
+    value = (value * 0xC2B2AE35) & 0xFFFFFFFF
+    value ^= value >> 16
+    return value
+
+
+def hash_fraction(query_name: str, seed: int = 0) -> float:
+    """Map a query_name to a reproducible number in [0, 1).
+
+    Every segment of a read (primary, supplementary, mate) shares a
+    query_name and therefore a value, so keeping reads with
+    hash_fraction(name, seed) < frac keeps or drops them together,
+    identically across runs and across workers.
+
+    >>> hash_fraction('read1') == hash_fraction('read1')
+    True
+    """
+    digest = zlib.crc32(query_name.encode()) ^ _fmix32(seed & 0xFFFFFFFF)
+    return _fmix32(digest) / 2**32
 
 
-def _downsample(stream: Iterator, frac: float) -> Iterator:
-    """Randomly sample items from a stream with given fraction."""
+def _downsample(stream: Iterator, frac: float, seed: int = 0) -> Iterator:
+    """Deterministically sample stream items by hashing their query_name."""
     for item in stream:
-        if random.random() < frac:
+        if hash_fraction(item.query_name, seed) < frac:
             yield item
 
 
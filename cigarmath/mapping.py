@@ -6,6 +6,9 @@ __copyright__ = """Copyright (C) 2022-present
 __author__ = "Will Dampier, PhD"
 
 from typing import Iterator, Optional, Tuple
+import numpy as np
+from cigarmath.batch import CigarBatch, CONSUMES_QUERY_LUT
+from cigarmath.batch import CONSUMES_REFERENCE_LUT
 from cigarmath.defn import CigarTuples
 from cigarmath.iterators import cigar_iterator
 
@@ -31,6 +34,57 @@ def reference2query(cigartuples: CigarTuples, reference_start: int = 0) -> Itera
             yield cig_index.query_index
 
 
+def reference2query_batch(
+    batch: CigarBatch,
+    reference_positions: np.ndarray,
+    read_index: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Vectorized reference to query lookup of one position per read.
+
+    With read_index there is one position per read_index entry instead.
+
+    Returns the index into the stored query sequence (SEQ) aligned to each
+    reference position: soft clipped bases are counted but hard clipped
+    bases are not, unlike reference2query, whose cigar_iterator also counts
+    a leading H. A deleted position gives the index of the next aligned
+    query base, so the result is always the number of SEQ bases before the
+    position. Positions are clamped to the first and last reference
+    position of each read.
+
+    RPOS    0123  456789 # Index within the reference
+    REF     AAGA--CTTCGG
+    CIGAR    SMMIIMDDMSS
+    QRY     -xAAGGC--Cxx
+    QPOS     012345  678 # Index within the query
+
+    >>>> batch = CigarBatch.from_cigarstrings([2], ['1S2M2I1M2D1M2S'])
+    >>>> reference2query_batch(batch, np.array([5]))
+    [6]
+    """
+    if read_index is None:
+        read_index = np.arange(len(batch))
+    first, last = batch.offsets[:-1][read_index], batch.offsets[1:][read_index]
+
+    consumes_query = CONSUMES_QUERY_LUT[batch.ops]
+    reference_length = batch.lengths * CONSUMES_REFERENCE_LUT[batch.ops]
+    query_sum = np.concatenate([[0],
+                                np.cumsum(batch.lengths * consumes_query)])
+    reference_sum = np.concatenate([[0], np.cumsum(reference_length)])
+
+    # reference_sum is non-decreasing over the whole batch, so one
+    # searchsorted finds the op holding each position; insertions ending
+    # at it count as before
+    key = (reference_sum[first] + np.asarray(reference_positions)
+           - batch.reference_start[read_index])
+    key = np.clip(key, reference_sum[first],
+                  np.maximum(reference_sum[last] - 1, reference_sum[first]))
+    op = np.searchsorted(reference_sum[1:], key, side='right')
+    op = np.minimum(op, last)
+
+    inside = (key - reference_sum[op]) * np.append(consumes_query, False)[op]
+    return query_sum[op] + inside - query_sum[first]
+
+
 def query2reference(cigartuples: CigarTuples, reference_start: int = 0) -> Iterator[Optional[int]]:
     """Create a generator the same size as the query
     that maps positions in the query to positions in the reference
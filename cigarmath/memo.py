@@ -0,0 +1,131 @@
+"""Memoization of values derived from repeated cigars"""
+
+__copyright__ = """Copyright (C) 2022-present
+    Dampier & DV Klopfenstein, PhD.
+    All rights reserved"""
+__author__ = "Will Dampier, PhD"
+
+from collections import OrderedDict
+from functools import wraps
+from types import GeneratorType
+from typing import Any, Callable, Dict, Hashable, Tuple
+from cigarmath.defn import CigarTuples
+from cigarmath.cigar import Cigar
+
+
+class CigarCache:
+    """A bounded cache of derived cigar values keyed on the immutable cigar.
+
+    A handful of cigars (150M, 151M, ...) cover most short reads, so
+    reference_offset, softclipify and friends can be computed once per
+    distinct cigar. Lists and generators are stored as tuples so cached
+    values can be shared safely.
+
+    policy is 'lru' (evict the least recently used value) or 'fifo'
+    (evict the oldest value, cheaper on hits).
+
+    >>>> cache = CigarCache(maxsize=1024)
+    >>>> offset = cache.wrap(reference_offset)
+    >>>> offset([(0, 150)]), offset([(0, 150)])
+    (150, 150)
+    >>>> cache.hit_rate
+    0.5
+    """
+
+    def __init__(self, maxsize: int = 4096, policy: str = 'lru'):
+        if policy not in ('lru', 'fifo'):
+            raise ValueError("policy must be 'lru' or 'fifo'")
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.maxsize = maxsize
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._values: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __call__(
+        self,
+        func: Callable,
+        cigartuples: CigarTuples,
+        *args,
+        **kwargs
+    ) -> Any:
+        "Return func(cigartuples, *args, **kwargs), computed once per cigar"
+        key = (func, cigar_key(cigartuples), args,
+               tuple(sorted(kwargs.items())))
+        try:
+            value = self._values[key]
+        except KeyError:
+            self.misses += 1
+            value = _freeze(func(cigartuples, *args, **kwargs))
+            self._values[key] = value
+            if len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+                self.evictions += 1
+            return value
+
+        self.hits += 1
+        if self.policy == 'lru':
+            self._values.move_to_end(key)
+        return value
+
+    def wrap(self, func: Callable) -> Callable:
+        "Return a version of func whose results are cached here"
+        @wraps(func)
+        def cached(cigartuples, *args, **kwargs):
+            return self(func, cigartuples, *args, **kwargs)
+        return cached
+
+    @property
+    def hit_rate(self) -> float:
+        "Fraction of lookups answered from the cache"
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        "Current hit/miss/eviction counts"
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate,
+            'size': len(self),
+            'maxsize': self.maxsize,
+        }
+
+    def clear(self) -> None:
+        "Drop all cached values and reset the statistics"
+        self._values.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+def cigar_key(cigartuples: CigarTuples) -> Tuple[Tuple[int, int], ...]:
+    """Hashable form of cigartuples.
+
+    Tuples are used as they are and a list of tuples (as returned by pysam)
+    is copied with a single tuple() call; only ops that are not tuples
+    themselves are converted one by one.
+
+    >>> cigar_key([(0, 75), (1, 1), (0, 74)])
+    ((0, 75), (1, 1), (0, 74))
+    """
+    if isinstance(cigartuples, Cigar):
+        # hashes and compares like the tuple below, with the hash cached
+        return cigartuples
+    key = cigartuples if type(cigartuples) is tuple else tuple(cigartuples)
+    if key and type(key[0]) is not tuple:
+        key = tuple((op, sz) for op, sz in key)
+    return key
+
+
+def _freeze(value: Any) -> Any:
+    "Turn lists and generators (also inside tuples) into tuples"
+    if isinstance(value, (list, GeneratorType)):
+        return tuple(value)
+    if isinstance(value, tuple):
+        return tuple(_freeze(item) for item in value)
+    return value
@@ -0,0 +1,216 @@
+"""Memory-mapped access to indexed FASTA references"""
+
+__copyright__ = """Copyright (C) 2022-present
+    Dampier & DV Klopfenstein, PhD.
+    All rights reserved"""
+__author__ = "Will Dampier, PhD"
+
+import mmap
+import os
+from typing import Dict, Iterator, List, NamedTuple, Union
+import numpy as np
+
+
+class FaiRecord(NamedTuple):
+    "One line of a samtools .fai index"
+    name: str
+    length: int
+    offset: int
+    line_bases: int
+    line_width: int
+
+
+def read_fai(path: str) -> List[FaiRecord]:
+    "Read a samtools .fai index"
+    records = []
+    with open(path) as handle:
+        for line in handle:
+            name, length, offset, line_bases, line_width = line.split('\t')[:5]
+            records.append(FaiRecord(name, int(length), int(offset),
+                                     int(line_bases), int(line_width)))
+    return records
+
+
+def write_fai(fasta_path: str, fai_path: str) -> List[FaiRecord]:
+    """Index a FASTA file like samtools faidx and write the .fai.
+
+    Every line of a record except the last must have the same length.
+    """
+    records = []
+    name, length, offset, line_bases, line_width = None, 0, 0, 0, 0
+    position = 0
+    with open(fasta_path, 'rb') as handle:
+        for line in handle:
+            if line.startswith(b'>'):
+                if name is not None:
+                    records.append(FaiRecord(name, length, offset,
+                                             line_bases, line_width))
+                name = line[1:].split()[0].decode()
+                length, offset = 0, position + len(line)
+                line_bases, line_width = 0, 0
+            elif name is not None:
+                bases = len(line.rstrip(b'\r\n'))
+                if not line_bases:
+                    line_bases, line_width = bases, len(line)
+                length += bases
+            position += len(line)
+    if name is not None:
+        records.append(FaiRecord(name, length, offset, line_bases, line_width))
+
+    with open(fai_path, 'w') as handle:
+        for record in records:
+            handle.write('\t'.join(map(str, record)) + '\n')
+    return records
+
+
+class FastaContig:
+    """A read-only view of one contig of a memory-mapped FASTA.
+
+    Integer and slice indexing return str like an in-memory reference, so a
+    contig can be passed to iterator_attach as the reference_sequence.
+    Indexing with an integer array returns the bases as a uint8 array
+    (used by the vectorized sequence functions), and fetch returns a
+    uint8 array of a region that is zero-copy within a single line.
+
+    >>>> contig = FastaReference('hxb2.fa')['HXB2F']
+    >>>> len(contig), contig[0:5], contig[np.array([0, 2])]
+    9719 'TGGAA' [84 71]
+    """
+
+    def __init__(self, buffer: np.ndarray, record: FaiRecord):
+        self.buffer = buffer
+        self.record = record
+
+    @property
+    def name(self) -> str:
+        return self.record.name
+
+    def __len__(self) -> int:
+        return self.record.length
+
+    def _file_offsets(self, positions: np.ndarray) -> np.ndarray:
+        record = self.record
+        line, column = np.divmod(positions, max(record.line_bases, 1))
+        return record.offset + line * record.line_width + column
+
+    def fetch(
+        self,
+        start: int = 0,
+        end: Union[int, None] = None
+    ) -> np.ndarray:
+        "The bases of [start, end) as a uint8 array; zero-copy on one line"
+        start, end, _ = slice(start, end).indices(len(self))
+        end = max(start, end)
+        first_offset = int(self._file_offsets(start))
+        line_bases = max(self.record.line_bases, 1)
+        same_line = start // line_bases == (end - 1) // line_bases
+        if (end - start) <= 1 or same_line:
+            return self.buffer[first_offset:first_offset + end - start]
+        return self.buffer[self._file_offsets(np.arange(start, end))]
+
+    def take(self, positions: np.ndarray) -> np.ndarray:
+        "The bases at an array of positions as a uint8 array"
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) and ((positions.min() < 0)
+                               or (positions.max() >= len(self))):
+            raise IndexError(f"position out of range for {self.name} "
+                             f"of length {len(self)}")
+        return self.buffer[self._file_offsets(positions)]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError("FastaContig slices must be contiguous")
+            return self.fetch(index.start or 0, index.stop).tobytes().decode()
+        if isinstance(index, np.ndarray):
+            return self.take(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"position {index} out of range for {self.name} "
+                             f"of length {len(self)}")
+        return chr(self.buffer[int(self._file_offsets(index))])
+
+    def __repr__(self) -> str:
+        return f"FastaContig('{self.name}', length={len(self)})"
+
+
+class FastaReference:
+    """A FASTA file memory-mapped through its samtools .fai index.
+
+    The file is mapped read-only, so contigs are paged in on demand and
+    shared between processes through the OS page cache rather than being
+    loaded into each worker. The .fai is built next to the FASTA if it does
+    not exist. Pickling only stores the path, so a FastaReference can be
+    sent to worker processes and is re-mapped there.
+
+    >>>> reference = FastaReference('hxb2.fa')
+    >>>> reference.names
+    ['HXB2F']
+    >>>> iterator_attach(cigar_iterator(cigartuples, start),
+    ....                 reference_sequence=reference['HXB2F'])
+    """
+
+    def __init__(self, path: str, fai_path: Union[str, None] = None):
+        self.path = path
+        self.fai_path = fai_path or path + '.fai'
+        if os.path.exists(self.fai_path):
+            records = read_fai(self.fai_path)
+        else:
+            records = write_fai(path, self.fai_path)
+        self.records: Dict[str, FaiRecord] = {record.name: record
+                                              for record in records}
+        self._open()
+
+    def _open(self) -> None:
+        with open(self.path, 'rb') as handle:
+            if os.fstat(handle.fileno()).st_size:
+                self._mmap = mmap.mmap(handle.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+                self.buffer = np.frombuffer(self._mmap, dtype=np.uint8)
+            else:
+                self._mmap = None
+                self.buffer = np.empty(0, dtype=np.uint8)
+
+    @property
+    def names(self) -> List[str]:
+        "Contig names in file order"
+        return list(self.records)
+
+    def __getitem__(self, name: str) -> FastaContig:
+        return FastaContig(self.buffer, self.records[name])
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.records
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.records)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def close(self) -> None:
+        "Release the memory map once no contig views of it are left"
+        self.buffer = np.empty(0, dtype=np.uint8)
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # arrays from fetch/contigs still point into the map;
+                # it is released when they are garbage collected
+                pass
+            self._mmap = None
+
+    def __enter__(self) -> "FastaReference":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __getstate__(self):
+        return {'path': self.path, 'fai_path': self.fai_path,
+                'records': self.records}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
@@ -0,0 +1,327 @@
+"""Sequence-aware cigar operations comparing query and reference bases"""
+
+__copyright__ = """Copyright (C) 2022-present
+    Dampier & DV Klopfenstein, PhD.
+    All rights reserved"""
+__author__ = "Will Dampier, PhD"
+
+from dataclasses import replace
+from typing import Optional, Sequence, Tuple, Union
+import numpy as np
+from cigarmath.batch import (
+    CigarBatch,
+    CONSUMES_QUERY_LUT,
+    CONSUMES_REFERENCE_LUT,
+    ragged_range,
+    segment_sum,
+    _offsets_from_counts,
+)
+from cigarmath.block import reference_block_batch
+from cigarmath.index import BlockIndex
+from cigarmath.reference import FastaContig
+from cigarmath.defn import (
+    CigarTuples,
+    BAM_CMATCH,
+    BAM_CINS,
+    BAM_CDEL,
+    BAM_CEQUAL,
+    BAM_CDIFF,
+)
+
+SequenceLike = Union[str, bytes, bytearray, memoryview, np.ndarray,
+                     FastaContig]
+
+# allele markers for sites a read deletes or does not cover
+DELETED_ALLELE = ord('-')
+MISSING_ALLELE = ord('.')
+
+# case-folding table so soft-masked (lowercase) references compare equal
+UPPER_LUT = np.arange(256, dtype=np.uint8)
+UPPER_LUT[ord('a'):ord('z') + 1] -= ord('a') - ord('A')
+
+
+def as_byte_array(sequence: SequenceLike) -> np.ndarray:
+    """View a sequence as a uint8 array without copying where possible.
+
+    >>>> as_byte_array('ACGT')
+    [65 67 71 84]
+    """
+    if isinstance(sequence, str):
+        sequence = sequence.encode('ascii')
+    if isinstance(sequence, np.ndarray):
+        if sequence.dtype.itemsize == 1:
+            return sequence.view(np.uint8)
+        return sequence.astype(np.uint8)
+    return np.frombuffer(sequence, dtype=np.uint8)
+
+
+def _reference_bases(
+    reference_sequence: SequenceLike,
+    reference_index: np.ndarray
+) -> np.ndarray:
+    """The reference bases at reference_index.
+
+    A FastaContig is read straight from the map.
+    """
+    if isinstance(reference_sequence, FastaContig):
+        return reference_sequence.take(reference_index)
+    return as_byte_array(reference_sequence)[reference_index]
+
+
+def _aligned_bases(
+    batch: CigarBatch,
+    aligned_ops: Sequence[int] = (BAM_CMATCH, BAM_CEQUAL, BAM_CDIFF),
+    window: Optional[Tuple[int, int]] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Flat (op_index, read_index, query_index, reference_index) for every
+    base of the aligned_ops (M/=/X by default) of a batch.
+
+    query_index points into batch.sequence and reference_index is a
+    reference coordinate. With a (start, end) window each op is clipped to
+    it before expanding, so only the bases inside the window are built.
+    """
+    first = batch.offsets[:-1]
+    read_index = batch.read_index
+    query_length = batch.lengths * CONSUMES_QUERY_LUT[batch.ops]
+    reference_length = batch.lengths * CONSUMES_REFERENCE_LUT[batch.ops]
+    query_sum = np.concatenate([[0], np.cumsum(query_length)])
+    reference_sum = np.concatenate([[0], np.cumsum(reference_length)])
+
+    op_index = np.flatnonzero(np.isin(batch.ops, aligned_ops))
+    op_read = read_index[op_index]
+    query_start = (batch.sequence_offsets[op_read] + query_sum[op_index]
+                   - query_sum[first[op_read]])
+    reference_start = (batch.reference_start[op_read]
+                       + reference_sum[op_index]
+                       - reference_sum[first[op_read]])
+
+    lengths = batch.lengths[op_index]
+    if window is not None:
+        clipped_start = np.clip(reference_start, *window)
+        clipped_end = np.minimum(reference_start + lengths, window[1])
+        lengths = np.maximum(clipped_end - clipped_start, 0)
+        query_start = query_start + clipped_start - reference_start
+        reference_start = clipped_start
+
+    base_op = np.repeat(op_index, lengths)
+    return (base_op, np.repeat(op_read, lengths),
+            ragged_range(query_start, lengths),
+            ragged_range(reference_start, lengths))
+
+
+def _require_sequence(batch: CigarBatch) -> None:
+    if batch.sequence is None:
+        raise ValueError(
+            "batch has no query sequences, load it with with_sequence=True"
+        )
+
+
+def mismatches_batch(
+    batch: CigarBatch,
+    reference_sequence: SequenceLike
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Compare every aligned base of a batch against one reference buffer.
+
+    Returns (nm, num_mismatches, read_index, positions): the per-read edit
+    distance (mismatches + inserted + deleted bases, like the SAM NM tag),
+    the per-read mismatch count and a flat table of the reads and reference
+    positions of every mismatch. Bases are compared case-insensitively.
+    The batch must have sequences and all reads must be on reference_sequence,
+    which may be a FastaContig of a memory-mapped FastaReference.
+
+    REF     AAGACTTCGG
+    QRY       GAGT--GG
+    CIGAR     MMMMDDMM
+    MM          ^
+
+    >>>> # with sequence GAGTGG
+    >>>> batch = CigarBatch.from_cigarstrings([2], ['4M2D2M'])
+    >>>> mismatches_batch(batch, 'AAGACTTCGG')
+    ([3], [1], [0], [4])
+    """
+    _require_sequence(batch)
+    _, base_read, query_index, reference_index = _aligned_bases(batch)
+
+    reference_bases = _reference_bases(reference_sequence, reference_index)
+    query_bases = batch.sequence[query_index]
+    is_mismatch = UPPER_LUT[query_bases] != UPPER_LUT[reference_bases]
+    read_index = base_read[is_mismatch]
+    positions = reference_index[is_mismatch]
+    num_mismatches = np.bincount(read_index, minlength=len(batch))
+
+    indel_length = batch.lengths * np.isin(batch.ops, [BAM_CINS, BAM_CDEL])
+    nm = num_mismatches + segment_sum(indel_length, batch.offsets)
+    return nm, num_mismatches, read_index, positions
+
+
+def mismatches(
+    cigartuples: CigarTuples,
+    query_sequence: SequenceLike,
+    reference_sequence: SequenceLike,
+    reference_start: int = 0
+) -> Tuple[int, int, np.ndarray]:
+    """Return (nm, num_mismatches, mismatch_positions) of a single alignment.
+
+    The aligned blocks are compared as byte arrays at once rather than
+    base by base; see mismatches_batch.
+
+    REF     AAGACTTCGG
+    QRY       GAGT--GG
+    CIGAR     MMMMDDMM
+    MM          ^
+
+    >>>> mismatches(cigarstr2tup('4M2D2M'), 'GAGTGG', 'AAGACTTCGG',
+    ....            reference_start=2)
+    (3, 1, [4])
+    """
+    batch = CigarBatch.from_alignments([(reference_start, cigartuples)])
+    batch.sequence = as_byte_array(query_sequence)
+    batch.sequence_offsets = np.array([0, len(batch.sequence)])
+    nm, num_mismatches, _, positions = mismatches_batch(batch,
+                                                        reference_sequence)
+    return int(nm[0]), int(num_mismatches[0]), positions
+
+
+def extend_matches_batch(
+    batch: CigarBatch,
+    reference_sequence: SequenceLike
+) -> CigarBatch:
+    """Rewrite the M ops of every read as =/X runs against the reference.
+
+    Each M op is expanded to one unit per base, labelled = or X by a byte
+    comparison, and the units are run-length encoded again within the op.
+    All other ops (including existing =/X) are kept as they are. Bases are
+    compared case-insensitively. The batch must have sequences and all
+    reads must be on reference_sequence.
+
+    REF     AAGACTTCGG
+    QRY       GAGT--GG
+    CIGAR     MMMMDDMM
+    OUT       ==X=DD==
+
+    >>>> # with sequence GAGTGG
+    >>>> batch = CigarBatch.from_cigarstrings([2], ['4M2D2M'])
+    >>>> list(extend_matches_batch(batch, 'AAGACTTCGG'))
+    [(2, [(7, 2), (8, 1), (7, 1), (2, 2), (7, 2)])]
+    """
+    _require_sequence(batch)
+
+    # one unit per base of every M op, one unit per other op
+    is_match = batch.ops == BAM_CMATCH
+    unit_counts = np.where(is_match, batch.lengths, 1)
+    unit_source = np.repeat(np.arange(len(batch.ops)), unit_counts)
+    unit_ops = batch.ops[unit_source]
+    unit_lengths = np.where(is_match, 1, batch.lengths)[unit_source]
+
+    _, _, query_index, reference_index = _aligned_bases(
+        batch, aligned_ops=(BAM_CMATCH,)
+    )
+    reference_bases = _reference_bases(reference_sequence, reference_index)
+    query_bases = batch.sequence[query_index]
+    is_equal = UPPER_LUT[query_bases] == UPPER_LUT[reference_bases]
+    unit_ops[unit_ops == BAM_CMATCH] = np.where(is_equal, BAM_CEQUAL,
+                                                BAM_CDIFF)
+
+    # a run ends where the op or the source op changes
+    is_new = np.ones(len(unit_ops), dtype=bool)
+    is_new[1:] = ((unit_ops[1:] != unit_ops[:-1])
+                  | (unit_source[1:] != unit_source[:-1]))
+    run_start = np.flatnonzero(is_new)
+    lengths = unit_lengths
+    if len(run_start):
+        lengths = np.add.reduceat(unit_lengths, run_start)
+    run_reads = batch.read_index[unit_source[run_start]]
+    run_counts = np.bincount(run_reads, minlength=len(batch))
+
+    return replace(
+        batch,
+        ops=unit_ops[run_start],
+        lengths=lengths,
+        offsets=_offsets_from_counts(run_counts),
+    )
+
+
+def site_alleles_batch(
+    batch: CigarBatch,
+    sites: np.ndarray,
+    width: int = 1
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the allele of every read at every site as a reads x sites matrix.
+
+    Each allele covers the width reference positions starting at the site
+    (e.g. width=3 for codons) and is returned as a byte string: query bases
+    for aligned positions, DELETED_ALLELE ('-') for deleted positions and
+    MISSING_ALLELE ('.') for positions the read does not cover or skips (N).
+    The second matrix holds the number of inserted bases directly after any
+    position of the window (aligned or deleted), so insertions can be
+    flagged or filtered.
+
+    Only (read, site) pairs that overlap are looked up, each with a binary
+    search over the batch-wide reference coordinates of the ops.
+
+    RPOS    0123  456789
+    REF     AAGA--CTTCGG
+    CIGAR    SMMIIMDDMSS
+    QRY     -xAAGGC--Cxx
+
+    >>>> # with sequence xAAGGCCxx
+    >>>> batch = CigarBatch.from_cigarstrings([2], ['1S2M2I1M2D1M2S'])
+    >>>> site_alleles_batch(batch, np.array([2, 3, 5, 9]))
+    ([[b'A' b'A' b'-' b'.']], [[0 2 0 0]])
+    >>>> site_alleles_batch(batch, np.array([1, 3, 6]), width=3)
+    ([[b'.AA' b'AC-' b'-C.']], [[2 2 0]])
+    """
+    _require_sequence(batch)
+    sites = np.asarray(sites, dtype=np.int64)
+    alleles = np.full((len(batch), len(sites), width), MISSING_ALLELE,
+                      dtype=np.uint8)
+    insertions = np.zeros((len(batch), len(sites)), dtype=np.int64)
+
+    # (read, site, offset) for every window position inside its read
+    read_starts, read_ends = reference_block_batch(batch)
+    index = BlockIndex(sites, sites + width)
+    read_index, site_index = index.overlap_join(read_starts, read_ends)
+    read_index = np.repeat(read_index, width)
+    site_index = np.repeat(site_index, width)
+    window = np.tile(np.arange(width), len(site_index) // width)
+    position = sites[site_index] + window
+    inside = ((position >= read_starts[read_index])
+              & (position < read_ends[read_index]))
+    read_index, site_index = read_index[inside], site_index[inside]
+    window, position = window[inside], position[inside]
+
+    first = batch.offsets[:-1][read_index]
+    query_length = batch.lengths * CONSUMES_QUERY_LUT[batch.ops]
+    reference_length = batch.lengths * CONSUMES_REFERENCE_LUT[batch.ops]
+    query_sum = np.concatenate([[0], np.cumsum(query_length)])
+    reference_sum = np.concatenate([[0], np.cumsum(reference_length)])
+
+    # reference_sum is non-decreasing over the batch: one search finds each op
+    key = reference_sum[first] + position - batch.reference_start[read_index]
+    op = np.searchsorted(reference_sum[1:], key, side='right')
+    op_code = batch.ops[op]
+
+    is_aligned = np.isin(op_code, [BAM_CMATCH, BAM_CEQUAL, BAM_CDIFF])
+    query_index = (batch.sequence_offsets[read_index] + query_sum[op]
+                   - query_sum[first] + key - reference_sum[op])
+    allele = np.where(op_code == BAM_CDEL, DELETED_ALLELE, MISSING_ALLELE)
+    allele = allele.astype(np.uint8)
+    allele[is_aligned] = batch.sequence[query_index[is_aligned]]
+    alleles[read_index, site_index, window] = allele
+
+    # insertions directly after the last base of an op are anchored to that
+    # base; a run of adjacent I ops counts as one insertion of their
+    # total length
+    insertion_length = batch.lengths * (batch.ops == BAM_CINS)
+    insertion_sum = np.concatenate([[0], np.cumsum(insertion_length)])
+    run_stops = np.union1d(np.flatnonzero(batch.ops != BAM_CINS),
+                           batch.offsets[1:])
+    following = op + 1
+    run_end = run_stops[np.searchsorted(run_stops, following)]
+    inserted = insertion_sum[run_end] - insertion_sum[following]
+    anchored = (key == reference_sum[op + 1] - 1) & (inserted > 0)
+    np.add.at(insertions, (read_index[anchored], site_index[anchored]),
+              inserted[anchored])
+
+    alleles = alleles.view(f'S{width}').reshape(len(batch), len(sites))
+    return alleles, insertions
@@ -0,0 +1,28 @@
+"""Shared fixtures for the cigarmath tests"""
+
+__copyright__ = """Copyright (C) 2022-present
+    Dampier & DV Klopfenstein, PhD.
+    All rights reserved"""
+__author__ = "Will Dampier, PhD"
+
+import numpy as np
+import pytest
+
+from cigarmath.batch import CigarBatch
+
+
+@pytest.fixture
+def pileup_batch():
+    # REF:     AAAAGACC--CCC
+    # READ1:   AAAA-ACCGGCCC
+    # READ2:   AAAAGACC--CCC
+    # READ3:   AATA-ACCGGCC
+    batch = CigarBatch.from_cigarstrings(
+        [0, 0, 0], ['4M1D3M2I3M', '8M3M', '2M1X1M1D3M2I2M']
+    )
+    sequences = ['AAAAACCGGCCC', 'AAAAGACCCCC', 'AATAACCGGCC']
+    batch.sequence = np.frombuffer(''.join(sequences).encode(), dtype=np.uint8)
+    batch.qualities = np.full(len(batch.sequence), 30, dtype=np.uint8)
+    lengths = [len(seq) for seq in sequences]
+    batch.sequence_offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return batch, sequences
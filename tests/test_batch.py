@@ -0,0 +1,99 @@
+import cigarmath as cm
+from cigarmath.defn import cigarstr2tup
+
+
+def test_from_alignments():
+
+    alns = [(10, cigarstr2tup('4M1D3M')),
+            (30, cigarstr2tup('2S5M'))]
+    batch = cm.CigarBatch.from_alignments(alns)
+
+    assert len(batch) == 2
+    assert batch.ops.tolist() == [0, 2, 0, 4, 0]
+    assert batch.lengths.tolist() == [4, 1, 3, 2, 5]
+    assert batch.offsets.tolist() == [0, 3, 5]
+    assert batch.read_index.tolist() == [0, 0, 0, 1, 1]
+    assert list(batch) == alns
+
+
+def test_from_alignments_empty():
+
+    batch = cm.CigarBatch.from_alignments([])
+    assert len(batch) == 0
+    assert batch.offsets.tolist() == [0]
+    assert list(batch) == []
+
+
+def test_pysam_batch_stream():
+
+    stream = cm.io.segment_stream_pysam('tests/test_data/test.sam', mode='r',
+                                        batch_size=100, with_sequence=True)
+    batches = list(stream)
+    assert [len(batch) for batch in batches] == [100, 100, 48]
+
+    segments = list(cm.io.segment_stream_pysam('tests/test_data/test.sam',
+                                               mode='r'))
+    pairs = [aln for batch in batches for aln in batch]
+    assert pairs == [(seg.reference_start, seg.cigartuples)
+                     for seg in segments]
+
+    first, segment = batches[0], segments[0]
+    assert first.query_name[0] == segment.query_name
+    assert first.flags[0] == segment.flag
+    assert first.mapq[0] == segment.mapping_quality
+    assert first.query_sequence(0) == segment.query_sequence
+    slc = slice(first.sequence_offsets[0], first.sequence_offsets[1])
+    assert first.qualities[slc].tolist() == list(segment.query_qualities)
+
+
+def test_pysam_batch_stream_no_sequence():
+
+    stream = cm.io.segment_stream_pysam('tests/test_data/test.sam', mode='r',
+                                        batch_size=1000, min_mapq=30)
+    batch, = list(stream)
+    assert len(batch) == 199
+    assert batch.sequence is None
+    assert batch.query_sequence(0) is None
+    assert (batch.mapq > 30).all()
+
+
+def test_from_cigarstrings():
+
+    cigars = ['3H4M1D3M2I3M4H', '150M', '12S1234567M10N3=1X']
+    batch = cm.CigarBatch.from_cigarstrings([0, 10, 20], cigars)
+
+    assert [tuples for _, tuples in batch] == [cigarstr2tup(cigar)
+                                               for cigar in cigars]
+    assert batch.reference_start.tolist() == [0, 10, 20]
+
+
+def test_take_and_slice():
+
+    alns = [(10, cigarstr2tup('4M1D3M')),
+            (20, cigarstr2tup('5M')),
+            (30, cigarstr2tup('2S5M'))]
+    batch = cm.CigarBatch.from_alignments(alns, query_name=['a', 'b', 'c'])
+
+    taken = batch.take([2, 0])
+    assert list(taken) == [alns[2], alns[0]]
+    assert taken.query_name == ['c', 'a']
+
+    masked = batch.take([True, False, True])
+    assert list(masked) == [alns[0], alns[2]]
+
+    sliced = batch[1:]
+    assert list(sliced) == alns[1:]
+    assert sliced.query_name == ['b', 'c']
+    assert list(batch[5:]) == []
+
+
+def test_concatenate():
+
+    alns = [(10, cigarstr2tup('4M1D3M')),
+            (20, cigarstr2tup('5M')),
+            (30, cigarstr2tup('2S5M'))]
+    batch = cm.CigarBatch.from_alignments(alns)
+
+    joined = cm.CigarBatch.concatenate([batch[:1], batch[1:]])
+    assert list(joined) == alns
+    assert joined.offsets.tolist() == batch.offsets.tolist()
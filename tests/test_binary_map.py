@@ -1,3 +1,4 @@
+import numpy as np
 import cigarmath as cm
 
 def test_segments_to_binary():
@@ -56,4 +57,47 @@ def test_segments_to_binary_multi():
     assert sum(guess[30:50]) == 0
     assert sum(guess[50:70]) == 20
     
-    assert sum(guess[70:]) == 0
\ No newline at end of file
+    assert sum(guess[70:]) == 0
+
+
+def test_segments_to_bitmatrix():
+    "Each row of the bit matrix matches segments_to_binary of that read"
+
+    starts = [10, 50, 0, 95]
+    cigars = ["20M10D5M", "20M3D5M", "5S10M2I4M", "10M"]
+    batch = cm.CigarBatch.from_cigarstrings(starts, cigars)
+    matrix = cm.segments_to_bitmatrix(batch, max_genome_size=100,
+                                      deletion_size=5, chunk_bytes=3)
+    assert matrix.shape == (4, 13)
+
+    bits = np.unpackbits(matrix, axis=1)[:, :100]
+    for row, start, cigar in zip(bits, starts, cigars):
+        correct = cm.segments_to_binary([(start, cm.cigarstr2tup(cigar))],
+                                        max_genome_size=100, deletion_size=5)
+        assert row.astype(bool).tolist() == list(correct[:100])
+    assert not np.unpackbits(matrix, axis=1)[:, 100:].any()
+
+
+def test_bitmatrix_jaccard():
+    "Test Jaccard similarity of bit-packed rows"
+
+    batch = cm.CigarBatch.from_cigarstrings([0, 0, 10, 0],
+                                            ["20M", "10M", "10M", ""])
+    matrix = cm.segments_to_bitmatrix(batch, max_genome_size=100)
+
+    guess = cm.bitmatrix_jaccard(matrix)
+    correct = [[1, 0.5, 0.5, 0],
+               [0.5, 1, 0, 0],
+               [0.5, 0, 1, 0],
+               [0, 0, 0, 1]]
+    assert np.allclose(guess, correct)
+
+    guess = cm.bitmatrix_jaccard(matrix[:2], matrix[2:], chunk_size=1)
+    assert np.allclose(guess, [[0.5, 0], [0, 0]])
+
+    index_a, index_b, similarity = cm.bitmatrix_jaccard(matrix, chunk_size=3,
+                                                        min_similarity=0.5)
+    assert list(zip(index_a.tolist(), index_b.tolist())) == [
+        (0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (2, 0), (2, 2), (3, 3)
+    ]
+    assert np.allclose(similarity, [1, 0.5, 0.5, 0.5, 1, 0.5, 1, 1])
@@ -1,3 +1,4 @@
+import numpy as np
 import cigarmath as cm
 from cigarmath.defn import cigarstr2tup
 
@@ -135,4 +136,142 @@ def test_reference_mapping_blocks():
     cigartups = cigarstr2tup(cigar)
     blocks = list(cm.reference_mapping_blocks(cigartups, reference_start=3, deletion_split=10))
     
-    assert blocks == [(3, 26)]
\ No newline at end of file
+    assert blocks == [(3, 26)]
+
+
+def test_reference_mapping_blocks_batch():
+    "Test splitting a whole batch into mapping blocks"
+
+    cigars = ['6M3D4M6D4M', '3S10M', '2M10D3M20D1M', '']
+    starts = [3, 0, 100, 5]
+    batch = cm.CigarBatch.from_cigarstrings(starts, cigars)
+    read_index, block_start, block_end = cm.reference_mapping_blocks_batch(
+        batch, deletion_split=5
+    )
+
+    correct = [(num, start, end)
+               for num, (start, cigar) in enumerate(zip(starts, cigars))
+               for start, end in cm.reference_mapping_blocks(
+                   cigarstr2tup(cigar), reference_start=start, deletion_split=5
+               )]
+    guess = zip(read_index.tolist(), block_start.tolist(), block_end.tolist())
+    assert list(guess) == correct
+
+
+def test_reference_block_batch():
+
+    cigars = ['30M', '20S30M10S', '20H30M10H', '20S25M10I5M10S',
+              '20S25M10D5M10S']
+    batch = cm.CigarBatch.from_cigarstrings([10] * len(cigars), cigars)
+    starts, ends = cm.reference_block_batch(batch)
+
+    for cigar, start, end in zip(cigars, starts.tolist(), ends.tolist()):
+        assert (start, end) == cm.reference_block(cigarstr2tup(cigar),
+                                                  reference_start=10)
+
+
+def test_reference_deletion_blocks_batch():
+
+    cigars = ['30M10D30M100D20M50D10M', '6M3D4M6D4M', '300M', '', '5M2N5M']
+    starts = [0, 3, 7, 0, 40]
+    batch = cm.CigarBatch.from_cigarstrings(starts, cigars)
+
+    for min_size in (1, 5, 20):
+        read_index, del_start, del_end = cm.reference_deletion_blocks_batch(
+            batch, min_size=min_size
+        )
+        guess = list(zip(read_index.tolist(), del_start.tolist(),
+                         del_end.tolist()))
+        correct = [(num, start, end)
+                   for num, (cigar, ref_start)
+                   in enumerate(zip(cigars, starts))
+                   for start, end in cm.reference_deletion_blocks(
+                       cigarstr2tup(cigar), ref_start, min_size
+                   )]
+        assert guess == correct
+
+
+def test_count_blocks():
+
+    batch = cm.CigarBatch.from_cigarstrings(
+        [3, 3, 10, 3], ['6M3D4M6D4M', '4M6D4M', '6M3D4M', '6M3D4M']
+    )
+    _, del_start, del_end = cm.reference_deletion_blocks_batch(batch)
+
+    starts, ends, counts = cm.count_blocks(del_start, del_end)
+    assert list(zip(starts.tolist(), ends.tolist(), counts.tolist())) == [
+        (7, 13, 1), (9, 12, 2), (16, 19, 1), (16, 22, 1)
+    ]
+
+    # merging the tables of two halves gives the same counts
+    first = cm.count_blocks(del_start[:3], del_end[:3])
+    second = cm.count_blocks(del_start[3:], del_end[3:])
+    merged = cm.count_blocks(*(np.concatenate(pair)
+                               for pair in zip(first, second)))
+    assert [col.tolist() for col in merged] == [starts.tolist(), ends.tolist(),
+                                                counts.tolist()]
+
+
+def test_reference_junction_blocks_batch():
+
+    cigars = ['4M6N4M6N4M', '2S5M2N3M1D4M', '10M', '3M2I1N8M']
+    batch = cm.CigarBatch.from_cigarstrings([3, 10, 0, 40], cigars)
+    batch.flags = np.array([0, 16, 0, 16], dtype=np.uint16)
+
+    junctions = cm.reference_junction_blocks_batch(batch)
+    read_index, start, end, strand, left_anchor, right_anchor = junctions
+    assert read_index.tolist() == [0, 0, 1, 3]
+    assert start.tolist() == [7, 17, 15, 43]
+    assert end.tolist() == [13, 23, 17, 44]
+    # the reverse flag is the alignment orientation, not the transcript strand
+    assert strand.tolist() == [0, 0, 0, 0]
+    assert left_anchor.tolist() == [4, 4, 5, 3]
+    assert right_anchor.tolist() == [4, 4, 7, 8]
+
+    # explicit per-read strand wins over flags
+    _, _, _, strand, _, _ = cm.reference_junction_blocks_batch(
+        batch, strand=np.array([-1, 1, 1, 0])
+    )
+    assert strand.tolist() == [-1, -1, 1, 0]
+
+    batch.flags = np.array([0x40, 0x40 | 16, 0x80, 0x80 | 16], dtype=np.uint16)
+    _, _, _, strand, _, _ = cm.reference_junction_blocks_batch(
+        batch, library_type='fr-secondstrand'
+    )
+    assert strand.tolist() == [1, 1, -1, 1]
+    _, _, _, strand, _, _ = cm.reference_junction_blocks_batch(
+        batch, library_type='fr-firststrand'
+    )
+    assert strand.tolist() == [-1, -1, 1, -1]
+
+
+def test_junction_counter():
+
+    batch = cm.CigarBatch.from_cigarstrings(
+        [3, 3, 3, 5], ['4M6N4M', '4M6N4M6N4M', '2M6N9M', '2M6N9M']
+    )
+    counter = cm.JunctionCounter()
+    counter.update(batch)
+    counter.update(batch[:1])
+
+    reference_id, start, end, strand, count = counter.table()
+    assert list(zip(start.tolist(), end.tolist(), count.tolist())) == [
+        (5, 11, 1), (7, 13, 4), (17, 23, 1)
+    ]
+    assert reference_id.tolist() == [-1, -1, -1]
+    assert strand.tolist() == [0, 0, 0]
+
+    # junctions with a 2 base anchor are dropped
+    counter = cm.JunctionCounter(min_anchor=3)
+    counter.update(batch)
+    _, start, end, _, count = counter.table()
+    assert list(zip(start.tolist(), end.tolist(), count.tolist())) == [
+        (7, 13, 2), (17, 23, 1)
+    ]
+
+    # one intron seen by a forward and a reverse read is one junction
+    batch = cm.CigarBatch.from_cigarstrings([0, 0], ['5M10N5M', '5M10N5M'])
+    batch.flags = np.array([0, 16], dtype=np.uint16)
+    counter = cm.JunctionCounter()
+    counter.update(batch)
+    assert counter.table()[4].tolist() == [2]
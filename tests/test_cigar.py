@@ -0,0 +1,70 @@
+import pickle
+
+import cigarmath as cm
+from cigarmath.defn import cigarstr2tup
+
+
+def test_sequence_behaviour():
+
+    cigartuples = cigarstr2tup('3H4M1D3M2I3M4H')
+    cigar = cm.Cigar(cigartuples)
+
+    assert len(cigar) == len(cigartuples)
+    assert list(cigar) == cigartuples
+    assert cigar[0] == (5, 3)
+    assert cigar[-1] == (5, 4)
+    assert cigar[1:3] == cigartuples[1:3]
+    assert isinstance(cigar[1:3], cm.Cigar)
+    assert cigar[::-1] == cigartuples[::-1]
+    assert str(cigar) == '3H4M1D3M2I3M4H'
+    assert cm.Cigar.from_string('3H4M1D3M2I3M4H') == cigar
+    assert [(4, 2)] + cigar[1:2] + [(4, 1)] == [(4, 2), (0, 4), (4, 1)]
+
+
+def test_hashable():
+
+    first = cm.Cigar.from_string('150M')
+    second = cm.Cigar(cigarstr2tup('150M'))
+
+    assert first == second
+    assert len({first, second, cm.Cigar.from_string('151M')}) == 2
+    assert hash(first) == hash(((0, 150),))
+    assert {first: 1}[((0, 150),)] == 1
+    assert pickle.loads(pickle.dumps(first)) == first
+
+
+def test_derived_values():
+
+    cigartuples = cigarstr2tup('3S4M20D3M2I3M4H')
+    cigar = cm.Cigar(cigartuples)
+
+    assert cigar.reference_offset == cm.reference_offset(cigartuples)
+    assert cigar.query_offset == cm.query_offset(cigartuples)
+    assert cigar.left_clipping == 3
+    assert cigar.right_clipping == 4
+    mapping_blocks = tuple(cm.reference_mapping_blocks(cigartuples))
+    assert cigar.mapping_blocks == mapping_blocks
+    assert cm.Cigar().left_clipping == 0
+
+
+def test_existing_functions():
+
+    cigartuples = cigarstr2tup('2I4D10M4D2M3I')
+    cigar = cm.Cigar(cigartuples)
+
+    assert (cm.softclipify(cigar, required_mapping=4)
+            == cm.softclipify(cigartuples, required_mapping=4))
+    assert cm.declip(cm.Cigar.from_string('3S10M4S')) == [(0, 10)]
+    assert cm.reference_block(cigar, 10) == cm.reference_block(cigartuples, 10)
+    assert (cm.trim_alignment(10, cigar, left=3)
+            == cm.trim_alignment(10, cigartuples, left=3))
+    assert (list(cm.liftover(cigar, 5, 6))
+            == list(cm.liftover(cigartuples, 5, 6)))
+
+    batch = cm.CigarBatch.from_alignments([(0, cigar)])
+    assert batch.cigartuples(0) == cigartuples
+
+    cache = cm.CigarCache()
+    cache(cm.reference_offset, cigar)
+    cache(cm.reference_offset, cigartuples)
+    assert cache.hits == 1
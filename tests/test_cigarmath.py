@@ -9,6 +9,9 @@ from cigarmath import cigarmath
 from cigarmath import defn
 
 from cigarmath.defn import cigarstr2tup
+from cigarmath.batch import CigarBatch
+from cigarmath.cigarmath import simplify_blocks_batch
+from cigarmath.cigarmath import collapse_adjacent_blocks_batch
 
 
 def check_cigartuples(guess, correct):
@@ -92,3 +95,37 @@ def test_collapse_adjacent_blocks():
         (defn.BAM_CINS, 15),
     ]
     check_cigartuples(guess, correct)
+
+
+def test_simplify_blocks_batch():
+    "Test replacing extended cigars for a whole batch"
+
+    cigars = ["4=2X1=2X2=", "3S4=1I2X", "10M", "5=", "3M3M2I"]
+    batch = CigarBatch.from_cigarstrings(range(len(cigars)), cigars)
+
+    guess = simplify_blocks_batch(batch)
+    for (start, tuples), cigar in zip(guess, cigars):
+        correct = cigarmath.simplify_blocks(cigarstr2tup(cigar))
+        check_cigartuples(tuples, list(correct))
+    assert guess.reference_start.tolist() == list(range(len(cigars)))
+
+    guess = simplify_blocks_batch(batch, collapse=False)
+    for (start, tuples), cigar in zip(guess, cigars):
+        correct = cigarmath.simplify_blocks(cigarstr2tup(cigar),
+                                            collapse=False)
+        check_cigartuples(tuples, list(correct))
+
+
+def test_collapse_adjacent_blocks_batch():
+    "Test merging adjacent blocks without merging across reads"
+
+    alns = [(0, [(0, 3), (0, 3), (1, 2)]),
+            (0, []),
+            (0, [(1, 2), (1, 1)]),
+            (0, [(1, 4), (0, 1)])]
+    batch = CigarBatch.from_alignments(alns)
+
+    guess = collapse_adjacent_blocks_batch(batch)
+    assert [tuples for _, tuples in guess] == [
+        [(0, 6), (1, 2)], [], [(1, 3)], [(1, 4), (0, 1)]
+    ]
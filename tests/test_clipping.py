@@ -5,6 +5,8 @@ __copyright__ = """Copyright (C) 2022-present
     All rights reserved"""
 __author__ = "Will Dampier, PhD"
 
+import numpy as np
+
 from cigarmath.defn import cigarstr2tup
 
 import cigarmath as cm
@@ -121,4 +123,114 @@ def test_declip_args():
     # Can accept many things
     cigar, _, _, clipped_seq = cm.declip(cigartups, seq, seq, seq)
     
-    assert clipped_seq == 'MMMMMMMMMM'
\ No newline at end of file
+    assert clipped_seq == 'MMMMMMMMMM'
+
+
+CLIPPING_CIGARS = ['3S10M4S', '2H5M', '5M3H', '10M', '5S', '2H3S10M4S1H',
+                   '2I4D10M4D2M3I', '1I1M1I10M1D2M3I', '3I2D', '']
+
+
+def test_declip_batch():
+    "Test declipping a whole batch"
+
+    batch = cm.CigarBatch.from_cigarstrings([0] * len(CLIPPING_CIGARS),
+                                            CLIPPING_CIGARS)
+    guess = cm.declip_batch(batch)
+
+    for (_, tuples), cigar in zip(guess, CLIPPING_CIGARS):
+        correct = cm.declip(cigarstr2tup(cigar)) if cigar else []
+        check_cigartuples(tuples, correct)
+
+
+def test_declip_batch_sequence():
+    "Test that soft-clipped bases are removed from sequences"
+
+    alns = [(0, cigarstr2tup('3S10M4S')), (0, cigarstr2tup('2H5M'))]
+    batch = cm.CigarBatch.from_alignments(alns)
+    batch.sequence = np.frombuffer(b'TTTAAAAACCCCCGGGG' + b'ACGTA',
+                                   dtype=np.uint8)
+    batch.qualities = np.arange(22, dtype=np.uint8)
+    batch.sequence_offsets = np.array([0, 17, 22])
+
+    guess = cm.declip_batch(batch)
+    assert guess.query_sequence(0) == 'AAAAACCCCC'
+    assert guess.query_sequence(1) == 'ACGTA'
+    assert guess.qualities.tolist() == list(range(3, 13)) + list(range(17, 22))
+
+
+def test_softclipify_batch():
+    "Test softclipifying a whole batch"
+
+    for required_mapping in (1, 4):
+        cigars = [cigar for cigar in CLIPPING_CIGARS
+                  if cigar and cm.clipping._decide_softclip_end(
+                      cigarstr2tup(cigar), required_mapping
+                  )[0] is not None]
+        batch = cm.CigarBatch.from_cigarstrings([0] * len(cigars), cigars)
+        guess, offsets = cm.softclipify_batch(
+            batch, required_mapping=required_mapping
+        )
+
+        for (_, tuples), offset, cigar in zip(guess, offsets.tolist(), cigars):
+            correct, correct_offset = cm.softclipify(
+                cigarstr2tup(cigar), required_mapping=required_mapping
+            )
+            check_cigartuples(tuples, correct)
+            assert offset == correct_offset
+
+
+def test_softclipify_batch_unmapped():
+    "Reads without a long enough mapping block are left alone"
+
+    batch = cm.CigarBatch.from_cigarstrings([0, 0, 0], ['3I2D', '2M1I2M', ''])
+    guess, offsets = cm.softclipify_batch(batch, required_mapping=4)
+
+    assert [tuples for _, tuples in guess] == [cigarstr2tup('3I2D'),
+                                               cigarstr2tup('2M1I2M'), []]
+    assert offsets.tolist() == [0, 0, 0]
+
+
+def test_clip_event_table():
+    "Test extracting clipped read ends"
+
+    cigars = ['3S10M4S', '2H3S10M', '10M1H', '10M', '1S5M1D5M']
+    batch = cm.CigarBatch.from_cigarstrings([3, 0, 20, 5, 7], cigars)
+
+    read_index, position, side, clip_length = cm.clip_event_table(batch)
+    assert read_index.tolist() == [0, 0, 1, 2, 4]
+    assert position.tolist() == [3, 13, 0, 30, 7]
+    assert side.tolist() == [cm.clipping.LEFT_CLIP, cm.clipping.RIGHT_CLIP,
+                             cm.clipping.LEFT_CLIP, cm.clipping.RIGHT_CLIP,
+                             cm.clipping.LEFT_CLIP]
+    assert clip_length.tolist() == [3, 4, 5, 1, 1]
+
+    # like left_clipping, soft clips behind a hard clip are not counted
+    # without hard clips
+    read_index, _, _, clip_length = cm.clip_event_table(batch, min_clip=2,
+                                                        with_hard=False)
+    assert read_index.tolist() == [0, 0]
+    assert clip_length.tolist() == [3, 4]
+
+
+def test_cluster_clip_events():
+    "Test clustering clip events into breakpoints"
+
+    position = np.array([16, 2, 3, 6, 4, 3, 5])
+    side = np.array([0, 0, 0, 0, 0, 1, 1])
+
+    reference_id, side_, start, end, support = cm.cluster_clip_events(
+        position, side, tolerance=2
+    )
+    clusters = zip(side_.tolist(), start.tolist(), end.tolist(),
+                   support.tolist())
+    assert list(clusters) == [
+        (0, 2, 6, 4), (0, 16, 16, 1), (1, 3, 5, 2)
+    ]
+    assert reference_id.tolist() == [-1, -1, -1]
+
+    _, _, start, _, support = cm.cluster_clip_events(
+        position, side, tolerance=1, min_support=2,
+        reference_id=np.array([0, 0, 0, 0, 0, 1, 2])
+    )
+    assert start.tolist() == [2]
+    assert support.tolist() == [3]
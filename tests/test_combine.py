@@ -1,11 +1,19 @@
 """Test combining CIGAR operations"""
 
-from cigarmath.defn import cigarstr2tup, BAM_CDEL, BAM_CINS, BAM_CMATCH, BAM_CSOFT_CLIP, BAM_CHARD_CLIP
+from cigarmath.defn import (
+    cigarstr2tup, cigartup2str, BAM_CDEL, BAM_CINS, BAM_CMATCH,
+    BAM_CSOFT_CLIP, BAM_CHARD_CLIP
+)
 from cigarmath.combine import (
     trim_alignment,
+    trim_alignment_batch,
+    trim_primers_batch,
     combine_adjacent_alignments,
     combine_multiple_alignments
 )
+from cigarmath.batch import CigarBatch
+import numpy as np
+import pytest
 
 def test_trim_alignment():
     """Test trimming query bases from alignments"""
@@ -261,3 +269,89 @@ def test_combine_multiple_alignments():
         assert False, "Should raise ValueError for non-sequential alignments"
     except ValueError:
         pass
+
+
+TRIM_CIGARS = ["5M1D3M", "2S5M2I3M4S", "3H4M10D3M2H", "5M2D", "1I1M1I1M1I",
+               "10M5N10M", "4M"]
+
+
+def test_trim_alignment_batch():
+    """Test trimming a batch matches trimming each read"""
+
+    alns = [(10 * num, cigarstr2tup(cigar))
+            for num, cigar in enumerate(TRIM_CIGARS)]
+    batch = CigarBatch.from_alignments(alns)
+
+    amounts = [(0, 0), (2, 0), (0, 2), (3, 1),
+               (np.arange(7), np.arange(7)[::-1]), (20, 20)]
+    for left, right in amounts:
+        for add_clipping in (None, 'soft', 'hard'):
+            guess = trim_alignment_batch(batch, left=left, right=right,
+                                         add_clipping=add_clipping)
+            lefts = np.broadcast_to(left, (len(alns),)).tolist()
+            rights = np.broadcast_to(right, (len(alns),)).tolist()
+            for (start, cigars), (ref_start, cigartups), l, r in zip(
+                    guess, alns, lefts, rights):
+                correct_start, correct_cigars = trim_alignment(
+                    ref_start, cigartups, left=l, right=r,
+                    add_clipping=add_clipping
+                )
+                assert start == correct_start
+                assert tuple(cigars) == tuple(correct_cigars)
+
+
+def test_trim_alignment_batch_sequence():
+    """Test that sequences are trimmed unless soft clipping is added"""
+
+    batch = CigarBatch.from_alignments([(10, cigarstr2tup("5M1D3M"))])
+    batch.sequence = np.frombuffer(b"AAAAACCC", dtype=np.uint8)
+    batch.qualities = np.arange(8, dtype=np.uint8)
+    batch.sequence_offsets = np.array([0, 8])
+
+    trimmed = trim_alignment_batch(batch, left=2, right=1)
+    assert trimmed.query_sequence(0) == "AAACC"
+    assert trimmed.qualities.tolist() == [2, 3, 4, 5, 6]
+
+    soft = trim_alignment_batch(batch, left=2, right=1, add_clipping='soft')
+    assert soft.query_sequence(0) == "AAAAACCC"
+
+    with pytest.raises(ValueError):
+        trim_alignment_batch(batch, left=1, add_clipping='bad')
+
+
+def test_trim_primers_batch():
+    """Test soft-clipping primers off read ends in reference coordinates"""
+
+    # PRIMER  ------                ------
+    # READ      MMMMMMMMMMMMMMMMMMMMMMMM
+    # OUT       SSSSMMMMMMMMMMMMMMMMSSSS
+    primer_starts, primer_ends = np.array([0, 22]), np.array([6, 28])
+    batch = CigarBatch.from_cigarstrings(
+        [2, 2, 10, 1, 8],
+        ['24M', '2H3S3M2D10M2I9M2S', '3M', '5M3D20M', '2S10M'],
+    )
+    trimmed = trim_primers_batch(batch, primer_starts, primer_ends)
+    guess = [(start, cigartup2str(cigars)) for start, cigars in trimmed]
+
+    assert guess == [
+        (6, '4S16M4S'),
+        (7, '2H6S10M2I5M6S'),  # deletion at the new start is dropped
+        (10, '3M'),  # no primer at either end
+        (9, '5S20M'),  # ends past the right primer
+        (8, '2S10M'),
+    ]
+
+
+def test_trim_primers_batch_window():
+    """Reads ending just outside a primer are trimmed within the window"""
+
+    batch = CigarBatch.from_cigarstrings([4, 0, 0], ['10M', '9M', '6M'])
+    primer_starts, primer_ends = np.array([5]), np.array([8])
+
+    guess = list(trim_primers_batch(batch, primer_starts, primer_ends))
+    assert guess == [(4, [(0, 10)]), (0, [(0, 9)]), (0, [(0, 5), (4, 1)])]
+
+    guess = list(trim_primers_batch(batch, primer_starts, primer_ends,
+                                    window=1))
+    assert guess == [(8, [(4, 4), (0, 6)]), (0, [(0, 5), (4, 4)]),
+                     (0, [(0, 5), (4, 1)])]
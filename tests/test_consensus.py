@@ -0,0 +1,50 @@
+"""Test consensus calling from array pileups"""
+
+__copyright__ = """Copyright (C) 2022-present
+    Dampier & DV Klopfenstein, PhD.
+    All rights reserved"""
+__author__ = "Will Dampier, PhD"
+
+import io
+
+import pytest
+
+import cigarmath as cm
+
+
+@pytest.fixture
+def pileup(pileup_batch):
+    batch, _ = pileup_batch
+    return cm.depth_matrix(batch, 0, 14)
+
+
+def test_consensus_majority(pileup):
+
+    assert cm.consensus_sequence(pileup) == b'AAAAACCGGCCCNNN'
+    # position 10 is only covered by two reads
+    assert cm.consensus_sequence(pileup, min_depth=3) == b'AAAAACCGGCCNNNN'
+    # uncovered positions are never called
+    assert cm.consensus_sequence(pileup, min_depth=0) == b'AAAAACCGGCCCNNN'
+    # the insertion is carried by two of three reads
+    assert (cm.consensus_sequence(pileup, insertion_fraction=0.9)
+            == b'AAAAACCCCCNNN')
+
+
+def test_consensus_iupac(pileup):
+
+    assert cm.consensus_sequence(pileup, method='iupac') == b'AAWAACCGGCCCNNN'
+    assert (cm.consensus_sequence(pileup, method='iupac', threshold=0.5)
+            == b'AAAAACCGGCCCNNN')
+
+    with pytest.raises(ValueError):
+        cm.consensus_sequence(pileup, method='bad')
+
+
+def test_write_fasta():
+
+    handle = io.StringIO()
+    written = cm.write_fasta(handle, 'consensus',
+                             [b'ACGTA', 'CC', b'GGGGGGG'], line_width=4)
+
+    assert written == 14
+    assert handle.getvalue() == '>consensus\nACGT\nACCG\nGGGG\nGG\n'
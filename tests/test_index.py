@@ -0,0 +1,134 @@
+import numpy as np
+
+import cigarmath as cm
+from cigarmath.defn import cigarstr2tup
+
+
+def _brute_force(starts, ends, start, end):
+    if start >= end:
+        return []
+    return [num for num, (s, e) in enumerate(zip(starts, ends))
+            if (s < end) and (e > start) and (s < e)]
+
+
+def test_overlapping():
+
+    index = cm.BlockIndex(np.array([2, 7, 20]), np.array([12, 13, 28]))
+
+    assert index.overlapping(11, 14).tolist() == [0, 1]
+    assert index.overlapping(13, 20).tolist() == []
+    assert index.overlapping(0, 100).tolist() == [0, 1, 2]
+    assert index.overlapping(27, 28).tolist() == [2]
+
+
+def test_from_batch():
+
+    alns = [(30, cigarstr2tup('10M')),
+            (10, cigarstr2tup('5S20M100D5M')),
+            (50, cigarstr2tup('10M'))]
+    batch = cm.CigarBatch.from_alignments(alns)
+    index = cm.BlockIndex.from_batch(batch)
+
+    # The long deletion makes the second read span 10-135
+    assert index.overlapping(45, 48).tolist() == [1]
+    assert index.overlapping(35, 55).tolist() == [1, 0, 2]
+
+
+def test_overlap_join_random():
+
+    rng = np.random.default_rng(42)
+    starts = rng.integers(0, 10_000, size=500)
+    ends = starts + rng.integers(0, 2_000, size=500)
+    index = cm.BlockIndex(starts, ends)
+
+    region_starts = rng.integers(0, 12_000, size=200)
+    region_ends = region_starts + rng.integers(1, 500, size=200)
+    query_index, block_index = index.overlap_join(region_starts, region_ends)
+
+    for num, (start, end) in enumerate(zip(region_starts, region_ends)):
+        guess = sorted(block_index[query_index == num].tolist())
+        assert guess == _brute_force(starts, ends, start, end)
+
+
+def test_empty_index():
+
+    index = cm.BlockIndex(np.array([]), np.array([]))
+    assert len(index) == 0
+    assert index.overlapping(0, 10).tolist() == []
+
+
+def test_overlap_join_empty_intervals():
+
+    index = cm.BlockIndex(np.array([10, 15]), np.array([20, 15]))
+    assert index.overlapping(0, 100).tolist() == [0]
+    assert index.overlapping(15, 15).tolist() == []
+
+    query_index, block_index = index.overlap_join([15, 12], [15, 18])
+    assert list(zip(query_index.tolist(), block_index.tolist())) == [(1, 0)]
+
+    index_a, index_b, _ = cm.overlap_join([15, 12], [15, 18],
+                                          [10, 15], [20, 15])
+    assert list(zip(index_a.tolist(), index_b.tolist())) == [(1, 0)]
+
+    # empty blocks stay unpaired even when distances are allowed
+    index_a, index_b, _ = cm.overlap_join([15, 12], [15, 18],
+                                          [10, 15], [20, 15], min_overlap=-5)
+    assert list(zip(index_a.tolist(), index_b.tolist())) == [(1, 0)]
+
+
+def test_overlap_join_lengths():
+
+    starts_a, ends_a = np.array([4, 0]), np.array([14, 3])
+    starts_b, ends_b = np.array([10, 28, 2]), np.array([20, 32, 12])
+
+    index_a, index_b, length = cm.overlap_join(starts_a, ends_a,
+                                               starts_b, ends_b)
+    pairs = zip(index_a.tolist(), index_b.tolist(), length.tolist())
+    assert list(pairs) == [(0, 2, 8), (0, 0, 4), (1, 2, 1)]
+
+    index_a, index_b, length = cm.overlap_join(starts_a, ends_a,
+                                               starts_b, ends_b, min_overlap=5)
+    pairs = zip(index_a.tolist(), index_b.tolist(), length.tolist())
+    assert list(pairs) == [(0, 2, 8)]
+
+    # negative overlaps are distances, like block_overlap_length
+    index_a, index_b, length = cm.overlap_join(starts_a, ends_a,
+                                               starts_b, ends_b,
+                                               min_overlap=-14)
+    pairs = zip(index_a.tolist(), index_b.tolist(), length.tolist())
+    assert (0, 1, -14) in pairs
+    assert all(cm.block_overlap_length((starts_a[a], ends_a[a]),
+                                       (starts_b[b], ends_b[b])) == size
+               for a, b, size in zip(index_a, index_b, length))
+
+
+def test_overlap_self_join_random():
+
+    rng = np.random.default_rng(7)
+    starts = rng.integers(0, 5_000, size=300)
+    ends = starts + rng.integers(0, 400, size=300)
+
+    index_a, index_b, length = cm.overlap_join(starts, ends, min_overlap=10)
+    correct = {(a, b) for a in range(300) for b in range(a + 1, 300)
+               if cm.block_overlap_length((starts[a], ends[a]),
+                                          (starts[b], ends[b])) >= 10}
+    assert set(zip(index_a.tolist(), index_b.tolist())) == correct
+    assert (length >= 10).all()
+
+
+def test_overlap_join_long_block():
+
+    rng = np.random.default_rng(3)
+    starts_b = rng.integers(0, 5_000, size=300)
+    ends_b = starts_b + rng.integers(1, 100, size=300)
+    # one block spanning everything must not change the answers
+    starts_b[0], ends_b[0] = 0, 10_000
+
+    starts_a = rng.integers(0, 5_000, size=50)
+    ends_a = starts_a + rng.integers(1, 200, size=50)
+    index_a, index_b, _ = cm.overlap_join(starts_a, ends_a, starts_b, ends_b)
+
+    for num, (start, end) in enumerate(zip(starts_a, ends_a)):
+        guess = index_b[index_a == num].tolist()
+        assert sorted(guess) == _brute_force(starts_b, ends_b, start, end)
+        assert starts_b[guess].tolist() == sorted(starts_b[guess].tolist())
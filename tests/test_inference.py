@@ -5,6 +5,8 @@ __copyright__ = """Copyright (C) 2022-present
     All rights reserved"""
 __author__ = "Will Dampier, PhD"
 
+import numpy as np
+
 from cigarmath.defn import cigarstr2tup
 
 import cigarmath as cm
@@ -16,3 +18,30 @@ def check_cigartuples(guess, correct):
     for (gop, gsz), (cop, csz) in zip(guess, correct):
         assert gop == cop
         assert gsz == csz
+
+
+def test_alignment_stats():
+    "Test per-read statistics against the single-read functions"
+
+    cigars = ['3H4M1D3M2I3M4H', '5=1X1I1D2=', '2S10M', '5S', '']
+    batch = cm.CigarBatch.from_cigarstrings([0] * len(cigars), cigars)
+    stats = cm.alignment_stats(batch)
+    assert len(stats) == len(cigars)
+
+    for num, cigar in enumerate(cigars[:-1]):
+        cigartuples = cigarstr2tup(cigar)
+        assert (stats.query_length[num]
+                == cm.inferred_query_sequence_length(cigartuples))
+        assert (stats.reference_length[num]
+                == cm.inferred_reference_length(cigartuples))
+        assert stats.left_clipping[num] == cm.left_clipping(cigartuples)
+        assert stats.right_clipping[num] == cm.right_clipping(cigartuples)
+        assert stats.op_counts[num].sum() == len(cigartuples)
+
+    assert stats.aligned_length.tolist() == [10, 8, 10, 0, 0]
+    assert stats.insertions.tolist() == [1, 1, 0, 0, 0]
+    assert stats.deletion_length.tolist() == [1, 1, 0, 0, 0]
+    clip_fraction = stats.clip_fraction[:4].round(3)
+    assert clip_fraction.tolist() == [0.368, 0.0, 0.167, 1.0]
+    assert stats.identity[1] == 7 / 10
+    assert np.isnan(stats.identity[[0, 2, 3, 4]]).all()
@@ -0,0 +1,90 @@
+"""Test interval set algebra"""
+
+__copyright__ = """Copyright (C) 2022-present
+    Dampier & DV Klopfenstein, PhD.
+    All rights reserved"""
+__author__ = "Will Dampier, PhD"
+
+import numpy as np
+
+import cigarmath as cm
+
+
+def positions(interval_set):
+    "The set of positions held by an IntervalSet"
+    return {pos for start, end in interval_set for pos in range(start, end)}
+
+
+def test_interval_set_construction():
+    "Overlapping, touching and empty intervals are normalized"
+
+    guess = cm.IntervalSet([20, 0, 5, 12, 30], [25, 6, 10, 12, 30])
+    assert list(guess) == [(0, 10), (20, 25)]
+    assert guess == cm.IntervalSet([0, 20], [10, 25])
+    assert guess.total_length() == 15
+    assert len(cm.IntervalSet()) == 0
+
+
+def test_interval_set_empty():
+    "Every operation accepts the empty set"
+
+    empty = cm.IntervalSet()
+    a = cm.IntervalSet([2], [12])
+
+    assert list(empty.merge(max_gap=5)) == []
+    assert list(empty | a) == list(a)
+    assert list(empty & a) == []
+    assert list(a - empty) == list(a)
+    assert list(empty - a) == []
+    assert list(empty.complement(0, 5)) == [(0, 5)]
+    assert empty.total_length() == 0
+    assert empty.contains([0, 3]).tolist() == [False, False]
+
+    batch = cm.CigarBatch.from_cigarstrings([0], ['10M'])
+    assert list(cm.IntervalSet.from_deletions(batch).merge()) == []
+
+
+def test_interval_set_operations():
+    "Test union, intersection, difference and complement"
+
+    a = cm.IntervalSet([2, 18], [12, 24])
+    b = cm.IntervalSet([7], [24])
+
+    assert list(a | b) == [(2, 24)]
+    assert list(a & b) == [(7, 12), (18, 24)]
+    assert list(a - b) == [(2, 7)]
+    assert list(b - a) == [(12, 18)]
+    assert list(a.complement()) == [(0, 2), (12, 18)]
+    assert list(a.complement(0, 30)) == [(0, 2), (12, 18), (24, 30)]
+    assert list(a.merge(max_gap=6)) == [(2, 24)]
+    assert list(a.merge(max_gap=5)) == list(a)
+
+
+def test_interval_set_random():
+    "Set operations agree with python sets of positions"
+
+    rng = np.random.default_rng(42)
+    for _ in range(200):
+        starts_a, starts_b = rng.integers(0, 60, 5), rng.integers(0, 60, 4)
+        a = cm.IntervalSet(starts_a, starts_a + rng.integers(0, 15, 5))
+        b = cm.IntervalSet(starts_b, starts_b + rng.integers(0, 15, 4))
+
+        assert positions(a | b) == positions(a) | positions(b)
+        assert positions(a & b) == positions(a) & positions(b)
+        assert positions(a - b) == positions(a) - positions(b)
+        assert positions(a.complement(0, 80)) == set(range(80)) - positions(a)
+        assert a.contains(np.arange(80)).tolist() == [pos in positions(a)
+                                                      for pos in range(80)]
+
+
+def test_interval_set_from_batch():
+    "Test building interval sets from cigar blocks"
+
+    batch = cm.CigarBatch.from_cigarstrings([0, 5, 40],
+                                            ['10M20D10M', '10M', '5M3D5M'])
+
+    assert list(cm.IntervalSet.from_batch(batch)) == [(0, 15), (30, 53)]
+    assert list(cm.IntervalSet.from_batch(batch, min_depth=2)) == [(5, 10)]
+    assert list(cm.IntervalSet.from_deletions(batch, min_size=5)) == [(10, 30)]
+    blocks = cm.IntervalSet.from_blocks([0, 5, 8], [10, 12, 9], min_depth=2)
+    assert list(blocks) == [(5, 10)]
@@ -1,6 +1,12 @@
+import io
+import os
+import shutil
+
+import numpy as np
 import pysam
 
 import cigarmath as cm
+from cigarmath.defn import BAM_FSUPPLEMENTARY
 
 def test_pysam_stream():
     
@@ -32,4 +38,281 @@ def test_combined_segment_stream():
     for num, (start, cigars, segments) in enumerate(stream):
         assert isinstance(segments[0], pysam.AlignedSegment)
 
-    assert num == 192 # Correct number of records
\ No newline at end of file
+    assert num == 192 # Correct number of records
+
+
+def _indexed_bam(tmp_path):
+    "Write an indexed BAM copy of the test SAM file"
+    bam_path = str(tmp_path / 'test.bam')
+    pysam.sort('-o', bam_path, 'tests/test_data/test.sam')
+    pysam.index(bam_path)
+    return bam_path
+
+
+def test_pysam_stream_threads():
+
+    stream = cm.io.segment_stream_pysam('tests/test_data/test.sam',
+                                        mode='r',
+                                        threads=2)
+
+    assert sum(1 for _ in stream) == 248
+
+
+def test_pysam_stream_regions(tmp_path):
+
+    bam_path = _indexed_bam(tmp_path)
+    regions = ['HXB2F:3001-9086', 'HXB2F:1-3000']
+
+    expected = list(cm.io.segment_stream_pysam(bam_path, mode='rb',
+                                               fetch='HXB2F', as_tuples=True))
+
+    stream = cm.io.segment_stream_pysam(bam_path, mode='rb', regions=regions,
+                                        as_tuples=True, processes=2)
+    guess = list(stream)
+
+    # coordinate ordered, and reads spanning both regions are yielded once
+    assert guess == expected
+
+
+def test_pysam_stream_regions_segments(tmp_path):
+
+    bam_path = _indexed_bam(tmp_path)
+
+    regions = ['HXB2F:1-3000', 'HXB2F:3001-9086']
+    stream = cm.io.segment_stream_pysam(bam_path, mode='rb', regions=regions,
+                                        min_mapq=30, processes=2)
+    guess = list(stream)
+
+    assert all(isinstance(aln, pysam.AlignedSegment) for aln in guess)
+    assert all(aln.mapping_quality > 30 for aln in guess)
+
+
+def test_pysam_stream_regions_batches(tmp_path):
+
+    bam_path = _indexed_bam(tmp_path)
+    regions = ['HXB2F:1-3000', 'HXB2F:3001-9086']
+
+    expected = list(cm.io.segment_stream_pysam(bam_path, mode='rb',
+                                               fetch='HXB2F', as_tuples=True))
+
+    batches = list(cm.io.segment_stream_pysam(bam_path, mode='rb',
+                                              regions=regions, batch_size=50,
+                                              processes=2))
+    assert all(isinstance(batch, cm.CigarBatch) and len(batch) <= 50
+               for batch in batches)
+    assert [aln for batch in batches for aln in batch] == expected
+
+
+def test_pysam_stream_overlapping_regions(tmp_path):
+
+    bam_path = _indexed_bam(tmp_path)
+    regions = ['HXB2F:2000-5000', 'HXB2F:1-3000', 'HXB2F:2500-2600',
+               'HXB2F:7000-8000']
+
+    expected = {}
+    for region in regions:
+        stream = cm.io.segment_stream_pysam(bam_path, mode='rb', fetch=region)
+        for aln in stream:
+            key = (aln.query_name, aln.flag, aln.reference_start)
+            expected[key] = aln.cigarstring
+    expected = sorted(expected.items(), key=lambda item: item[0][2])
+
+    segments = list(cm.io.segment_stream_pysam(bam_path, mode='rb',
+                                               regions=regions, processes=2))
+    guess = [((aln.query_name, aln.flag, aln.reference_start), aln.cigarstring)
+             for aln in segments]
+    assert [key[2] for key, _ in guess] == sorted(key[2] for key, _ in guess)
+    assert sorted(guess) == sorted(expected)
+
+    tuples = list(cm.io.segment_stream_pysam(bam_path, mode='rb',
+                                             regions=regions, as_tuples=True,
+                                             processes=2))
+    assert tuples == [(aln.reference_start, aln.cigartuples)
+                      for aln in segments]
+
+
+def test_pysam_stream_segment_filter():
+
+    from cigarmath.defn import BAM_FREVERSE
+
+    segment_filter = cm.io.SegmentFilter(flag_exclude=BAM_FSUPPLEMENTARY)
+    stream = cm.io.segment_stream_pysam('tests/test_data/test.sam', mode='r',
+                                        segment_filter=segment_filter)
+    guess = list(stream)
+    assert len(guess) == 193
+    assert not any(aln.is_supplementary for aln in guess)
+
+    segment_filter = cm.io.SegmentFilter(flag_include=BAM_FREVERSE,
+                                         flag_exclude=BAM_FSUPPLEMENTARY)
+    stream = cm.io.segment_stream_pysam('tests/test_data/test.sam', mode='r',
+                                        segment_filter=segment_filter)
+    assert sum(1 for _ in stream) == 39
+
+
+def test_pysam_stream_segment_filter_length():
+
+    segment_filter = cm.io.SegmentFilter(min_aligned_length=1000, min_mapq=30,
+                                         contig='HXB2F')
+    stream = cm.io.segment_stream_pysam('tests/test_data/test.sam', mode='r',
+                                        segment_filter=segment_filter,
+                                        as_tuples=True)
+
+    for start, cigartuples in stream:
+        assert cm.reference_offset(cigartuples) >= 1000
+
+    segment_filter = cm.io.SegmentFilter(contig='missing')
+    stream = cm.io.segment_stream_pysam('tests/test_data/test.sam', mode='r',
+                                        segment_filter=segment_filter)
+    assert list(stream) == []
+
+
+def test_segment_filter_missing_contig(tmp_path):
+    """predicate and mask agree that a missing contig keeps nothing.
+
+    In particular, the unmapped reads are not kept.
+    """
+
+    sam_path = str(tmp_path / 'unmapped.sam')
+    with open(sam_path, 'w') as handle:
+        handle.write('@SQ\tSN:HXB2F\tLN:9719\n'
+                     'mapped\t0\tHXB2F\t10\t60\t4M\t*\t0\t0\tACGT\tIIII\n'
+                     'unmapped\t4\t*\t0\t0\t*\t*\t0\t0\tACGT\tIIII\n')
+
+    segment_filter = cm.io.SegmentFilter(contig='missing', min_mapq=-1)
+    with pysam.AlignmentFile(sam_path) as samfile:
+        keep = segment_filter.predicate(samfile)
+        segments = list(samfile)
+        references = list(samfile.references)
+
+    guess = [keep(segment) for segment in segments]
+    mask = segment_filter.mask(
+        np.array([segment.flag for segment in segments]),
+        np.array([segment.mapping_quality for segment in segments]),
+        np.array([segment.reference_id for segment in segments]),
+        references
+    )
+    assert guess == mask.tolist() == [False, False]
+
+    # an indexed file skips the fetch instead of raising
+    stream = cm.io.segment_stream_pysam(_indexed_bam(tmp_path), mode='rb',
+                                        segment_filter=segment_filter)
+    assert list(stream) == []
+
+
+def test_hash_fraction():
+
+    assert cm.io.hash_fraction('read1') == cm.io.hash_fraction('read1')
+    assert (cm.io.hash_fraction('read1', seed=1)
+            != cm.io.hash_fraction('read1', seed=2))
+
+    values = [cm.io.hash_fraction(f'read{num}') for num in range(10_000)]
+    assert all(0 <= value < 1 for value in values)
+    assert 0.45 < sum(value < 0.5 for value in values) / len(values) < 0.55
+
+
+def test_pysam_stream_downsample():
+
+    def names(seed):
+        stream = cm.io.segment_stream_pysam('tests/test_data/test.sam',
+                                            mode='r', downsample=0.5,
+                                            seed=seed)
+        return [aln.query_name for aln in stream]
+
+    first = names(seed=7)
+    assert first == names(seed=7)
+    assert first != names(seed=8)
+    assert 0 < len(first) < 248
+
+    # All segments of a read are kept or dropped together
+    kept = set(first)
+    stream = cm.io.segment_stream_pysam('tests/test_data/test.sam', mode='r')
+    assert sorted(first) == sorted(aln.query_name for aln in stream
+                                   if aln.query_name in kept)
+
+
+def _assert_batches_equal(first, second):
+    for column in ('reference_start', 'ops', 'lengths', 'offsets',
+                   'reference_id', 'flags', 'mapq', 'sequence', 'qualities',
+                   'sequence_offsets'):
+        assert np.array_equal(getattr(first, column),
+                              getattr(second, column)), column
+    assert first.query_name == second.query_name
+
+
+def test_sam_batch_stream():
+
+    guess = list(cm.io.sam_batch_stream('tests/test_data/test.sam',
+                                        batch_size=100, with_sequence=True,
+                                        block_size=10_000))
+    expected = list(cm.io.segment_stream_pysam('tests/test_data/test.sam',
+                                               mode='r', batch_size=100,
+                                               with_sequence=True))
+
+    assert [len(batch) for batch in guess] == [100, 100, 48]
+    for first, second in zip(guess, expected):
+        _assert_batches_equal(first, second)
+
+
+def test_sam_batch_stream_handle():
+
+    with open('tests/test_data/test.sam', 'rb') as handle:
+        data = handle.read()
+
+    guess, = list(cm.io.sam_batch_stream(io.BytesIO(data)))
+    assert len(guess) == 248
+    assert guess.sequence is None
+
+
+def test_sam_batch_stream_filters():
+
+    segment_filter = cm.io.SegmentFilter(flag_exclude=BAM_FSUPPLEMENTARY,
+                                         min_mapq=30, min_aligned_length=1000,
+                                         contig='HXB2F')
+    kwargs = dict(segment_filter=segment_filter, downsample=0.5, seed=3,
+                  with_sequence=True)
+
+    guess, = list(cm.io.sam_batch_stream('tests/test_data/test.sam', **kwargs))
+    expected, = list(cm.io.segment_stream_pysam('tests/test_data/test.sam',
+                                                mode='r', batch_size=65_536,
+                                                **kwargs))
+
+    assert 0 < len(guess) < 248
+    _assert_batches_equal(guess, expected)
+
+
+def test_cached_batch(tmp_path):
+
+    sam_path = str(tmp_path / 'test.sam')
+    shutil.copy('tests/test_data/test.sam', sam_path)
+
+    expected = list(cm.io.segment_stream_pysam(sam_path, mode='r', min_mapq=-1,
+                                               as_tuples=True))
+
+    batch = cm.io.cached_batch(sam_path, mode='r')
+    assert list(batch) == expected
+    assert os.path.exists(sam_path + '.cigarmath/meta.json')
+
+    cached = cm.io.cached_batch(sam_path, mode='r')
+    assert isinstance(cached.ops, np.memmap)
+    assert list(cached) == expected
+    assert cached.flags.tolist() == batch.flags.tolist()
+
+    # Changing the file invalidates the cache
+    with open(sam_path) as handle:
+        lines = handle.readlines()
+    with open(sam_path, 'w') as handle:
+        handle.writelines(lines[:-10])
+
+    rebuilt = cm.io.cached_batch(sam_path, mode='r')
+    assert len(rebuilt) == len(expected) - 10
+
+
+def test_cached_batch_cache_dir(tmp_path):
+
+    cache_dir = str(tmp_path / 'cache')
+    batch = cm.io.cached_batch('tests/test_data/test.sam', mode='r',
+                               cache_dir=cache_dir)
+
+    assert len(batch) == 248
+    assert len(os.listdir(cache_dir)) == 1
+    assert not os.path.exists('tests/test_data/test.sam.cigarmath')
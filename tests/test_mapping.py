@@ -1,3 +1,4 @@
+import numpy as np
 import cigarmath as cm
         
 def test_reference2query():
@@ -44,4 +45,35 @@ def test_query2reference():
     correct = [None, 2, 3, None, None, 4, 7, None, None]
     
     assert r2q == correct
-    
+
+
+def test_reference2query_batch():
+    """Deleted positions map to the next aligned query base"""
+
+    cigars = ['1S2M2I1M2D1M2S', '3M', '2H4M1D2M']
+    batch = cm.CigarBatch.from_cigarstrings([2, 0, 5], cigars)
+
+    guess = cm.reference2query_batch(batch, np.array([5, 1, 9]))
+    assert guess.tolist() == [6, 1, 4]
+
+    # one position per read_index entry, clamped to the read
+    read_index = np.array([0, 0, 0, 0, 0, 0, 0])
+    guess = cm.reference2query_batch(batch, np.arange(0, 14, 2),
+                                     read_index=read_index)
+    assert guess.tolist() == [1, 1, 5, 6, 6, 6, 6]
+
+
+def test_reference2query_batch_hard_clip():
+    """Hard clips are not part of SEQ.
+
+    Unlike reference2query, they are not counted.
+    """
+
+    cigar = '3H2S4M'
+    batch = cm.CigarBatch.from_cigarstrings([10], [cigar])
+
+    guess = cm.reference2query_batch(batch, np.array([10]),
+                                     read_index=np.array([0]))
+    assert guess.tolist() == [2]
+    r2q = cm.reference2query(cm.cigarstr2tup(cigar), reference_start=10)
+    assert list(r2q)[0] == 5
@@ -0,0 +1,79 @@
+import pytest
+
+import cigarmath as cm
+from cigarmath.cigarmath import simplify_blocks
+from cigarmath.defn import cigarstr2tup
+
+
+def test_cached_values():
+
+    cache = cm.CigarCache()
+    offset = cache.wrap(cm.reference_offset)
+
+    for cigar in ['150M', '151M', '75M1I74M', '150M', '150M']:
+        cigartuples = cigarstr2tup(cigar)
+        assert offset(cigartuples) == cm.reference_offset(cigartuples)
+
+    assert cache.hits == 2
+    assert cache.misses == 3
+    assert cache.hit_rate == 0.4
+    assert len(cache) == 3
+
+
+def test_frozen_values():
+
+    cache = cm.CigarCache()
+    cigartuples = cigarstr2tup('2I4D10M4D2M3I')
+
+    first = cache(cm.softclipify, cigartuples, required_mapping=4)
+    second = cache(cm.softclipify, cigartuples, required_mapping=4)
+    assert first is second
+    clipped, _ = cm.softclipify(cigartuples, required_mapping=4)
+    assert first == (tuple(clipped), 4)
+
+    # Different arguments are cached separately
+    cache(cm.softclipify, cigartuples, required_mapping=1)
+    assert cache.misses == 2
+
+    simple = cache(simplify_blocks, cigarstr2tup('4=2X5='))
+    assert simple == ((0, 11),)
+
+
+def test_eviction_policies():
+
+    lru = cm.CigarCache(maxsize=2)
+    fifo = cm.CigarCache(maxsize=2, policy='fifo')
+
+    for cache in (lru, fifo):
+        for cigar in ['10M', '20M', '10M', '30M', '10M']:
+            cache(cm.reference_offset, cigarstr2tup(cigar))
+        assert cache.evictions >= 1
+
+    # LRU kept 10M because it was used recently, FIFO evicted it first
+    assert lru.stats()['hits'] == 2
+    assert fifo.stats()['hits'] == 1
+
+    lru.clear()
+    assert len(lru) == 0
+    assert lru.hit_rate == 0.0
+
+
+def test_bad_policy():
+
+    with pytest.raises(ValueError):
+        cm.CigarCache(policy='random')
+
+
+def test_cigar_key():
+
+    cigartuples = [(0, 75), (1, 1), (0, 74)]
+    key = cm.memo.cigar_key(cigartuples)
+    assert key == ((0, 75), (1, 1), (0, 74))
+    assert cm.memo.cigar_key(key) is key
+    assert cm.memo.cigar_key([[0, 75], [1, 1], [0, 74]]) == key
+    assert cm.memo.cigar_key([]) == ()
+
+    cache = cm.CigarCache()
+    as_lists = [list(op) for op in cigartuples]
+    assert cache(len, cigartuples) == cache(len, as_lists) == 3
+    assert cache.hits == 1
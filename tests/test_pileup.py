@@ -1,6 +1,10 @@
 """Unit tests for pileup functions"""
 
-from cigarmath.pileup import depth
+import numpy as np
+
+from cigarmath.batch import CigarBatch
+from cigarmath.pileup import depth, depth_matrix
+from cigarmath.pileup import PILEUP_SYMBOLS, DELETION_SYMBOL
 from cigarmath.defn import cigarstr2tup
 from collections import Counter
 
@@ -91,4 +95,68 @@ def test_skipped_regions():
     assert result[3] == Counter({'-': 1})
     assert result[4] == Counter({'-': 1})
     assert result[5] == Counter({'T': 1})
-    assert result[6] == Counter({'T': 1}) 
\ No newline at end of file
+    assert result[6] == Counter({'T': 1}) 
+
+
+def test_depth_matrix(pileup_batch):
+    """Test the array pileup against depth"""
+
+    batch, sequences = pileup_batch
+    pileup = depth_matrix(batch, 0, 11)
+
+    counts = None
+    for (start, cigartuples), seq in zip(batch, sequences):
+        counts = depth(cigartuples, start, seq, counts)
+    for pos in range(11):
+        symbols = {chr(PILEUP_SYMBOLS[num]): count
+                   for num, count in enumerate(pileup.counts[pos].tolist())
+                   if count}
+        assert symbols == counts[pos]
+
+    assert pileup.insertion_depth.tolist() == [0] * 7 + [2, 0, 0, 0]
+    assert list(zip(pileup.insertion_position.tolist(),
+                    pileup.insertion_offset.tolist(),
+                    pileup.insertion_count.tolist())) == [(7, 0, 2), (7, 1, 2)]
+
+    # piling up in two parts gives the same counts
+    first = depth_matrix(batch[:1], 0, 11)
+    both = depth_matrix(batch[1:], 0, 11, previous_count=first)
+    assert (both.counts == pileup.counts).all()
+    assert both.insertion_count.tolist() == pileup.insertion_count.tolist()
+
+
+def test_depth_matrix_window(pileup_batch):
+    """Windows of the pileup match slices of the full pileup.
+
+    This holds even across long skips.
+    """
+
+    batch, _ = pileup_batch
+    pileup = depth_matrix(batch, 0, 11)
+    window = depth_matrix(batch, 3, 6)
+    assert (window.counts == pileup.counts[3:6]).all()
+
+    batch = CigarBatch.from_cigarstrings([0, 5], ['3M1000000000N2M', '2M'])
+    batch.sequence = np.frombuffer(b'ACGTAGG', dtype=np.uint8)
+    batch.qualities = np.full(7, 30, dtype=np.uint8)
+    batch.sequence_offsets = np.array([0, 5, 7])
+    pileup = depth_matrix(batch, 2, 8)
+    assert pileup.counts[:, DELETION_SYMBOL].tolist() == [0, 1, 1, 1, 1, 1]
+    assert pileup.depth.tolist() == [1, 1, 1, 2, 2, 1]
+
+
+def test_depth_matrix_adjacent_insertions(pileup_batch):
+    """Adjacent I ops pile up like a single insertion"""
+
+    batch, _ = pileup_batch
+    split = CigarBatch.from_cigarstrings(
+        [0, 0, 0], ['4M1D3M1I1I3M', '8M3M', '2M1X1M1D3M1I1I2M']
+    )
+    split.sequence, split.qualities, split.sequence_offsets = (
+        batch.sequence, batch.qualities, batch.sequence_offsets
+    )
+
+    pileup, guess = depth_matrix(batch, 0, 11), depth_matrix(split, 0, 11)
+    assert guess.insertion_depth.tolist() == pileup.insertion_depth.tolist()
+    assert guess.insertion_offset.tolist() == pileup.insertion_offset.tolist()
+    assert guess.insertion_count.tolist() == pileup.insertion_count.tolist()
@@ -0,0 +1,87 @@
+"""Test memory-mapped FASTA access"""
+
+__copyright__ = """Copyright (C) 2022-present
+    Dampier & DV Klopfenstein, PhD.
+    All rights reserved"""
+__author__ = "Will Dampier, PhD"
+
+import pickle
+
+import numpy as np
+import pytest
+
+from cigarmath.defn import cigarstr2tup
+from cigarmath.reference import read_fai
+
+import cigarmath as cm
+
+SEQUENCES = {
+    'chr1': 'AAGACTTCGG' * 7 + 'ACG',
+    'chr2': 'acgtACGTnn',
+}
+
+
+@pytest.fixture
+def fasta_path(tmp_path):
+    path = tmp_path / 'ref.fa'
+    with open(path, 'w') as handle:
+        for name, seq in SEQUENCES.items():
+            handle.write(f'>{name} description\n')
+            for start in range(0, len(seq), 30):
+                handle.write(seq[start:start + 30] + '\n')
+    return str(path)
+
+
+def test_fasta_reference_index(fasta_path):
+
+    reference = cm.FastaReference(fasta_path)
+    assert reference.names == ['chr1', 'chr2']
+    assert 'chr2' in reference
+
+    # the index is written in samtools faidx format
+    assert read_fai(fasta_path + '.fai') == [
+        ('chr1', 73, 18, 30, 31),
+        ('chr2', 10, 112, 10, 11),
+    ]
+
+
+def test_fasta_contig_indexing(fasta_path):
+
+    reference = cm.FastaReference(fasta_path)
+    contig = reference['chr1']
+    seq = SEQUENCES['chr1']
+
+    assert len(contig) == len(seq)
+    assert contig[3] == seq[3]
+    assert contig[-1] == seq[-1]
+    assert contig[25:65] == seq[25:65]
+    assert contig[60:] == seq[60:]
+    taken = contig.take(np.array([0, 30, 72]))
+    assert taken.tobytes() == (seq[0] + seq[30] + seq[72]).encode()
+    with pytest.raises(IndexError):
+        contig[len(seq)]
+
+    # regions within one line are views of the memory map
+    within_line = contig.fetch(31, 40)
+    assert within_line.base is not None
+    assert within_line.tobytes().decode() == seq[31:40]
+    assert contig.fetch(20, 50).tobytes().decode() == seq[20:50]
+
+    restored = pickle.loads(pickle.dumps(reference))
+    assert restored['chr2'][0:10] == SEQUENCES['chr2']
+
+
+def test_fasta_contig_as_reference_sequence(fasta_path):
+
+    reference = cm.FastaReference(fasta_path)
+    cigartuples = cigarstr2tup('4M2D2M')
+
+    attached = cm.iterator_attach(cm.cigar_iterator(cigartuples, 28),
+                                  reference_sequence=reference['chr1'])
+    letters = [index.reference_letter for index in attached]
+    assert ''.join(letters) == SEQUENCES['chr1'][28:36]
+
+    nm, num_mismatches, positions = cm.mismatches(cigartuples, 'GAGTGG',
+                                                  reference['chr1'],
+                                                  reference_start=2)
+    assert (nm, num_mismatches, positions.tolist()) == (3, 1, [4])
@@ -0,0 +1,142 @@
+"""Test sequence-aware operations"""
+
+__copyright__ = """Copyright (C) 2022-present
+    Dampier & DV Klopfenstein, PhD.
+    All rights reserved"""
+__author__ = "Will Dampier, PhD"
+
+import numpy as np
+import pytest
+
+from cigarmath.defn import cigarstr2tup
+
+import cigarmath as cm
+
+REFERENCE = 'AAGACTTCGGacgtACGT'
+
+
+def _batch_with_sequences(starts, cigars, sequences):
+    batch = cm.CigarBatch.from_cigarstrings(starts, cigars)
+    batch.sequence = np.frombuffer(''.join(sequences).encode(), dtype=np.uint8)
+    lengths = [len(seq) for seq in sequences]
+    batch.sequence_offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return batch
+
+
+def test_mismatches():
+    """REF     AAGACTTCGG
+    QRY       GAGT--GG
+    CIGAR     MMMMDDMM
+    MM          ^
+    """
+
+    nm, num_mismatches, positions = cm.mismatches(
+        cigarstr2tup('4M2D2M'), 'GAGTGG', REFERENCE, reference_start=2
+    )
+    assert (nm, num_mismatches) == (3, 1)
+    assert positions.tolist() == [4]
+
+    # clips are skipped, insertions count towards NM and case is ignored
+    nm, num_mismatches, positions = cm.mismatches(
+        cigarstr2tup('2H2S3M1I2M'), 'TTacgAtC', REFERENCE, reference_start=10
+    )
+    assert (nm, num_mismatches) == (2, 1)
+    assert positions.tolist() == [14]
+
+
+def test_mismatches_batch():
+
+    batch = _batch_with_sequences(
+        [2, 10, 0, 5],
+        ['4M2D2M', '2S3=1I2X', '5M', ''],
+        ['GAGTGG', 'TTACGAGT', 'AAGAC', ''],
+    )
+    nm, num_mismatches, read_index, positions = cm.mismatches_batch(
+        batch, REFERENCE
+    )
+
+    assert nm.tolist() == [3, 3, 0, 0]
+    assert num_mismatches.tolist() == [1, 2, 0, 0]
+    assert read_index.tolist() == [0, 1, 1]
+    assert positions.tolist() == [4, 13, 14]
+
+
+def test_mismatches_batch_requires_sequence():
+
+    batch = cm.CigarBatch.from_cigarstrings([0], ['5M'])
+    with pytest.raises(ValueError):
+        cm.mismatches_batch(batch, REFERENCE)
+
+
+def test_extend_matches_batch():
+    """REF     AAGACTTCGG
+    QRY       GAGT--GG
+    CIGAR     MMMMDDMM
+    OUT       ==X=DD==
+    """
+
+    batch = _batch_with_sequences(
+        [2, 10, 0, 5],
+        ['4M2D2M', '2S3=1I2X', '2H5M1S', ''],
+        ['GAGTGG', 'TTACGAGT', 'aagacT', ''],
+    )
+    extended = cm.extend_matches_batch(batch, REFERENCE)
+
+    assert [cm.cigartup2str(cigartuples) for _, cigartuples in extended] == [
+        '2=1X1=2D2=', '2S3=1I2X', '2H5=1S', ''
+    ]
+    assert extended.reference_start.tolist() == [2, 10, 0, 5]
+    assert extended.query_sequence(0) == 'GAGTGG'
+
+
+def test_site_alleles_batch():
+    """RPOS    0123  456789
+    REF     AAGA--CTTCGG
+    CIGAR    SMMIIMDDMSS
+    QRY     -xAAGGC--Cxx
+    """
+
+    batch = _batch_with_sequences(
+        [2, 0, 20],
+        ['1S2M2I1M2D1M2S', '3M1D3M', '4M'],
+        ['xAAGGCCxx', 'ACGTTT', 'GGGG'],
+    )
+
+    alleles, insertions = cm.site_alleles_batch(batch, np.array([2, 3, 5, 9]))
+    assert alleles.tolist() == [
+        [b'A', b'A', b'-', b'.'],
+        [b'G', b'-', b'T', b'.'],
+        [b'.', b'.', b'.', b'.'],
+    ]
+    assert insertions.tolist() == [[0, 2, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]]
+
+    alleles, insertions = cm.site_alleles_batch(batch, np.array([1, 3, 21]),
+                                                width=3)
+    assert alleles.tolist() == [
+        [b'.AA', b'AC-', b'...'],
+        [b'CG-', b'-TT', b'...'],
+        [b'...', b'...', b'GGG'],
+    ]
+    assert insertions[0].tolist() == [2, 2, 0]
+
+
+def test_site_alleles_batch_adjacent_insertions():
+    "A run of adjacent I ops is one insertion of their total length"
+
+    starts, cigars = [0, 0, 1], ['5M2I3I5M', '5M5I5M', '2M1I1I1D2M']
+    sequences = ['AAGACttcggTTCGG', 'AAGACttcggTTCGG', 'AAggAC']
+    batch = _batch_with_sequences(starts, cigars, sequences)
+
+    alleles, insertions = cm.site_alleles_batch(batch, np.arange(10))
+    assert insertions[0].tolist() == [0, 0, 0, 0, 5, 0, 0, 0, 0, 0]
+    assert insertions[1].tolist() == insertions[0].tolist()
+    assert insertions[2].tolist() == [0, 0, 2, 0, 0, 0, 0, 0, 0, 0]
+
+    # every inserted base is anchored somewhere, as counted towards NM
+    for row, start, cigar, sequence in zip(insertions, starts, cigars,
+                                           sequences):
+        cigartuples = cigarstr2tup(cigar)
+        nm, num_mismatches, _ = cm.mismatches(cigartuples, sequence, REFERENCE,
+                                              reference_start=start)
+        deleted = sum(size for op, size in cigartuples if op == 2)
+        assert row.sum() == nm - num_mismatches - deleted